@@ -0,0 +1,416 @@
+"""
+Crawler nhiều trang dựa trên AsyncWebCrawler: duyệt BFS từ danh sách URL hoặc sitemap,
+giới hạn độ sâu/tên miền, chạy song song có giới hạn trên một trình duyệt dùng chung,
+bỏ qua trang trùng nội dung và chỉ tải lại trang đã thay đổi (ETag/Last-Modified).
+Kết quả được ghi thành file markdown để RAG chatbot nạp bằng load_directory.
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urljoin, urldefrag, urlparse, urlunparse
+from xml.etree import ElementTree
+
+import aiohttp
+from crawl4ai import AsyncWebCrawler
+from crawl4ai.async_configs import BrowserConfig, CacheMode, CrawlerRunConfig
+
+STATE_FILE = ".crawl_state.json"
+
+# Tham số theo dõi quảng cáo không làm thay đổi nội dung trang
+_TRACKING_PARAMS = re.compile(r"^(utm_\w+|fbclid|gclid|mc_cid|mc_eid)$", re.IGNORECASE)
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+_SKIP_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".svg", ".ico", ".css", ".js",
+                    ".pdf", ".zip", ".rar", ".gz", ".mp3", ".mp4", ".avi", ".woff", ".woff2", ".ttf")
+
+
+def normalize_url(url, base=None):
+    """
+    Chuẩn hóa URL để nhận ra các URL cùng trỏ tới một trang
+
+    Bỏ fragment, tham số theo dõi, cổng mặc định; chữ thường scheme/host; sắp xếp query.
+
+    Returns:
+        URL đã chuẩn hóa, None nếu không phải http/https hoặc là file tĩnh
+    """
+    if base:
+        url = urljoin(base, url)
+    url, _ = urldefrag(url.strip())
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower()
+    if scheme not in _DEFAULT_PORTS or not parsed.hostname:
+        return None
+    host = parsed.hostname.lower()
+    if parsed.port and parsed.port != _DEFAULT_PORTS[scheme]:
+        host = f"{host}:{parsed.port}"
+    path = re.sub(r"/{2,}", "/", parsed.path or "/")
+    if path.lower().endswith(_SKIP_EXTENSIONS):
+        return None
+    query = urlencode(sorted((key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+                             if not _TRACKING_PARAMS.match(key)))
+    return urlunparse((scheme, host, path, "", query, ""))
+
+
+def url_to_filename(url):
+    """Tên file markdown ổn định cho một URL: host_đường-dẫn_hash.md"""
+    parsed = urlparse(url)
+    slug = re.sub(r"[^\w\-]+", "-", f"{parsed.netloc}{parsed.path}").strip("-")[:100]
+    digest = hashlib.sha1(url.encode("utf-8")).hexdigest()[:10]
+    return f"{slug or 'page'}_{digest}.md"
+
+
+def domain_allowed(url, domains):
+    """URL thuộc một trong các tên miền (kể cả tên miền con) hay không"""
+    if not domains:
+        return True
+    host = urlparse(url).hostname or ""
+    return any(host == domain or host.endswith("." + domain) for domain in domains)
+
+
+class CrawlState:
+    def __init__(self, path):
+        """
+        Trạng thái các trang đã crawl (ETag, Last-Modified, hash nội dung, link), lưu dạng JSON
+
+        Args:
+            path: Đường dẫn file trạng thái
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._pages = {}
+        # content_hash -> các URL đang giữ file có nội dung đó (tra trùng nội dung không cần duyệt mọi trang)
+        self._by_hash = {}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._pages = json.load(f).get("pages", {})
+        except (OSError, ValueError) as e:
+            print(f"Không đọc được trạng thái crawl {self.path}, sẽ crawl lại toàn bộ: {e}")
+            self._pages = {}
+        self._by_hash = {}
+        for url, entry in self._pages.items():
+            self._index(url, entry)
+
+    def _index(self, url, entry):
+        if entry.get("content_hash") and entry.get("file"):
+            self._by_hash.setdefault(entry["content_hash"], set()).add(url)
+
+    def _unindex(self, url, entry):
+        urls = self._by_hash.get(entry.get("content_hash"))
+        if urls is not None:
+            urls.discard(url)
+            if not urls:
+                del self._by_hash[entry["content_hash"]]
+
+    def save(self):
+        """Ghi trạng thái xuống đĩa (ghi file tạm rồi đổi tên để tránh hỏng file)"""
+        with self._lock:
+            data = {"version": 1, "pages": self._pages}
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.path)
+
+    def get(self, url):
+        with self._lock:
+            entry = self._pages.get(url)
+            return dict(entry) if entry else None
+
+    def update(self, url, **fields):
+        with self._lock:
+            entry = self._pages.setdefault(url, {})
+            self._unindex(url, entry)
+            entry.update(fields)
+            self._index(url, entry)
+
+    def url_for_hash(self, content_hash, exclude=None):
+        """URL khác đang giữ cùng nội dung, None nếu không có"""
+        with self._lock:
+            for url in self._by_hash.get(content_hash, ()):
+                if url != exclude:
+                    return url
+        return None
+
+
+def _header(headers, name):
+    """Đọc header không phân biệt hoa thường"""
+    if not headers:
+        return None
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _markdown_text(result):
+    markdown = result.markdown
+    if markdown is None:
+        return ""
+    return getattr(markdown, "raw_markdown", None) or str(markdown)
+
+
+class SiteCrawler:
+    def __init__(self,
+                 output_dir,
+                 max_depth: int = 2,
+                 max_pages: int = 100,
+                 concurrency: int = 5,
+                 allowed_domains=None,
+                 use_browser: bool = True,
+                 conditional: bool = True,
+                 request_timeout: float = 30,
+                 browser_config=None,
+                 run_config=None):
+        """
+        Crawl nhiều trang và ghi nội dung thành file markdown
+
+        Args:
+            output_dir: Thư mục ghi file markdown (thư mục được load_directory nạp)
+            max_depth: Độ sâu BFS tối đa tính từ các URL gốc (0 = chỉ crawl URL gốc)
+            max_pages: Số trang tối đa được xử lý trong một lần chạy
+            concurrency: Số lời gọi arun chạy đồng thời tối đa
+            allowed_domains: Các tên miền được phép, None để dùng tên miền của URL gốc
+            use_browser: False để tải trang bằng HTTP thuần (không cần trình duyệt, không chạy JavaScript)
+            conditional: Gửi If-None-Match/If-Modified-Since để bỏ qua trang không đổi
+            request_timeout: Thời gian chờ (giây) của request kiểm tra và tải sitemap
+            browser_config: BrowserConfig thay thế
+            run_config: CrawlerRunConfig thay thế
+        """
+        self.output_dir = output_dir
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.concurrency = max(1, concurrency)
+        self.allowed_domains = [d.lower() for d in allowed_domains] if allowed_domains else None
+        self.use_browser = use_browser
+        self.conditional = conditional
+        self.request_timeout = request_timeout
+        self.browser_config = browser_config or BrowserConfig(verbose=False)
+        self.run_config = run_config or CrawlerRunConfig(cache_mode=CacheMode.BYPASS, verbose=False)
+        os.makedirs(output_dir, exist_ok=True)
+        self.state = CrawlState(os.path.join(output_dir, STATE_FILE))
+        self.stats = {}
+
+    def _make_crawler(self):
+        if self.use_browser:
+            return AsyncWebCrawler(config=self.browser_config)
+        from crawl4ai.async_crawler_strategy import AsyncHTTPCrawlerStrategy
+        return AsyncWebCrawler(crawler_strategy=AsyncHTTPCrawlerStrategy())
+
+    async def crawl(self, seeds=(), sitemaps=()):
+        """
+        Crawl từ các URL gốc và sitemap
+
+        Args:
+            seeds: Danh sách URL gốc
+            sitemaps: Danh sách URL sitemap (hỗ trợ sitemap index và .xml.gz)
+
+        Returns:
+            Dict thống kê của lần chạy
+        """
+        self.stats = {"fetched": 0, "written": 0, "not_modified": 0, "unchanged": 0,
+                      "duplicates": 0, "failed": 0}
+        start = time.perf_counter()
+        timeout = aiohttp.ClientTimeout(total=self.request_timeout)
+
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            roots = [normalize_url(url) for url in seeds]
+            for sitemap in sitemaps:
+                roots.extend(normalize_url(url) for url in await self._read_sitemap(session, sitemap))
+            roots = list(dict.fromkeys(url for url in roots if url))
+            if not roots:
+                print("Không có URL nào để crawl")
+                return self._finish(start)
+
+            domains = self.allowed_domains or sorted({urlparse(url).hostname for url in roots})
+            print(f"Bắt đầu crawl {len(roots)} URL gốc (độ sâu {self.max_depth}, "
+                  f"tối đa {self.max_pages} trang, {self.concurrency} luồng, tên miền: {', '.join(domains)})")
+
+            queue = asyncio.Queue()
+            seen = set()
+            for url in roots:
+                if len(seen) < self.max_pages:
+                    seen.add(url)
+                    queue.put_nowait((url, 0))
+
+            def enqueue(links, depth):
+                # Chỉ chạy trong event loop nên không cần khóa
+                for link in links:
+                    if len(seen) >= self.max_pages:
+                        return
+                    if link not in seen and domain_allowed(link, domains):
+                        seen.add(link)
+                        queue.put_nowait((link, depth))
+
+            async with self._make_crawler() as crawler:
+                async def worker():
+                    while True:
+                        url, depth = await queue.get()
+                        try:
+                            links = await self._process(crawler, session, url)
+                            if depth < self.max_depth:
+                                enqueue(links, depth + 1)
+                        except Exception as e:
+                            self.stats["failed"] += 1
+                            print(f"Lỗi khi crawl {url}: {e}")
+                        finally:
+                            queue.task_done()
+
+                workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+                try:
+                    await queue.join()
+                finally:
+                    for task in workers:
+                        task.cancel()
+                    await asyncio.gather(*workers, return_exceptions=True)
+
+        self.state.save()
+        return self._finish(start)
+
+    def _finish(self, start):
+        elapsed = time.perf_counter() - start
+        processed = sum(self.stats[key] for key in ("written", "not_modified", "unchanged", "duplicates", "failed"))
+        self.stats.update(
+            pages=processed,
+            seconds=round(elapsed, 3),
+            pages_per_second=round(processed / elapsed, 2) if elapsed > 0 else 0.0
+        )
+        print(f"Đã crawl {processed} trang trong {elapsed:.2f}s ({self.stats['pages_per_second']} trang/s): "
+              f"{self.stats['written']} ghi mới/cập nhật, {self.stats['not_modified']} không đổi (304), "
+              f"{self.stats['unchanged']} trùng nội dung cũ, {self.stats['duplicates']} trùng trang khác, "
+              f"{self.stats['failed']} lỗi")
+        return dict(self.stats)
+
+    async def _not_modified(self, session, url, entry):
+        """
+        Gửi request HEAD có điều kiện, True nếu máy chủ trả về 304 Not Modified (hoặc cùng ETag/Last-Modified).
+        Dùng HEAD để trang đã thay đổi không bị tải hai lần (một lần ở đây, một lần bởi arun).
+        """
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        if not headers:
+            return False
+        try:
+            async with session.head(url, headers=headers, allow_redirects=True) as response:
+                if response.status == 304:
+                    return True
+                if response.status != 200:
+                    return False
+                # Máy chủ bỏ qua header điều kiện nhưng vẫn trả về validator: so sánh trực tiếp
+                etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+                if etag or last_modified:
+                    return etag == entry.get("etag") and last_modified == entry.get("last_modified")
+                return False
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+
+    async def _process(self, crawler, session, url):
+        """Crawl một trang, trả về danh sách link nội bộ (đã chuẩn hóa) để tiếp tục BFS"""
+        entry = self.state.get(url)
+        if entry and self.conditional and entry.get("file") \
+                and os.path.exists(os.path.join(self.output_dir, entry["file"])) \
+                and await self._not_modified(session, url, entry):
+            self.stats["not_modified"] += 1
+            self.state.update(url, checked_at=time.strftime("%Y-%m-%dT%H:%M:%S"))
+            return entry.get("links", [])
+
+        result = await crawler.arun(url=url, config=self.run_config)
+        self.stats["fetched"] += 1
+        markdown = _markdown_text(result)
+        if not result.success and not markdown.strip():
+            self.stats["failed"] += 1
+            print(f"Không crawl được {url}: {result.error_message}")
+            return []
+
+        links = []
+        for link in (result.links or {}).get("internal", []):
+            normalized = normalize_url(link.get("href", ""), base=url)
+            if normalized:
+                links.append(normalized)
+        links = list(dict.fromkeys(links))
+
+        headers = result.response_headers or {}
+        content_hash = hashlib.sha256(markdown.encode("utf-8")).hexdigest()
+        fields = {
+            "etag": _header(headers, "ETag"),
+            "last_modified": _header(headers, "Last-Modified"),
+            "content_hash": content_hash,
+            "links": links,
+            "checked_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+        }
+
+        # Nội dung không đổi so với lần crawl trước: không ghi lại file
+        if entry and entry.get("content_hash") == content_hash and entry.get("file") \
+                and os.path.exists(os.path.join(self.output_dir, entry["file"])):
+            self.stats["unchanged"] += 1
+            self.state.update(url, **fields)
+            return links
+
+        # Trùng nội dung với một trang khác (URL khác nhau cùng một trang): không tạo file mới
+        duplicate_of = self.state.url_for_hash(content_hash, exclude=url)
+        if duplicate_of:
+            self.stats["duplicates"] += 1
+            self.state.update(url, duplicate_of=duplicate_of, file=None, **fields)
+            return links
+
+        filename = url_to_filename(url)
+        title = ((result.metadata or {}).get("title") or "").replace("\n", " ").strip()
+        front_matter = [
+            "---",
+            f"source_url: {url}",
+            f"title: {json.dumps(title, ensure_ascii=False)}",
+            f"crawled_at: {fields['checked_at']}",
+            "---",
+            ""
+        ]
+        path = os.path.join(self.output_dir, filename)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(front_matter) + "\n" + markdown)
+        os.replace(tmp_path, path)
+
+        self.stats["written"] += 1
+        self.state.update(url, file=filename, duplicate_of=None, **fields)
+        return links
+
+    async def _read_sitemap(self, session, url, depth=0):
+        """Đọc danh sách URL từ sitemap (đệ quy qua sitemap index tối đa 3 cấp)"""
+        try:
+            async with session.get(url) as response:
+                if response.status != 200:
+                    print(f"Không tải được sitemap {url}: HTTP {response.status}")
+                    return []
+                body = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Không tải được sitemap {url}: {e}")
+            return []
+
+        if url.endswith(".gz") or body[:2] == b"\x1f\x8b":
+            body = gzip.decompress(body)
+        try:
+            root = ElementTree.fromstring(body)
+        except ElementTree.ParseError as e:
+            print(f"Sitemap không hợp lệ {url}: {e}")
+            return []
+
+        locations = [element.text.strip() for element in root.iter() if element.tag.endswith("loc") and element.text]
+        if root.tag.endswith("sitemapindex"):
+            if depth >= 3:
+                return []
+            urls = []
+            for location in locations:
+                urls.extend(await self._read_sitemap(session, location, depth + 1))
+            return urls
+        print(f"Sitemap {url}: {len(locations)} URL")
+        return locations
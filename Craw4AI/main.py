@@ -1,17 +1,57 @@
+"""
+Crawl website thành các file markdown cho RAG chatbot
+
+Ví dụ:
+    python main.py http://hoc24.vn --depth 2 --max-pages 200 --concurrency 8
+    python main.py --sitemap https://example.com/sitemap.xml --output ../RAG/markdown_files
+    python main.py http://127.0.0.1:8000/ --no-browser   # crawl bằng HTTP thuần, không cần trình duyệt
+"""
+import argparse
 import asyncio
-from crawl4ai import AsyncWebCrawler
-from crawl4ai.async_configs import BrowserConfig, CrawlerRunConfig
+import os
+
+from crawler import SiteCrawler
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "RAG", "markdown_files")
+
+
+def read_seed_file(path):
+    """Đọc danh sách URL, mỗi dòng một URL, bỏ qua dòng trống và dòng bắt đầu bằng #"""
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
 
 async def main():
-    browser_config = BrowserConfig()  # Default browser configuration
-    run_config = CrawlerRunConfig()   # Default crawl run configuration
+    parser = argparse.ArgumentParser(description="Crawl website thành file markdown cho RAG chatbot")
+    parser.add_argument("urls", nargs="*", help="Các URL gốc")
+    parser.add_argument("--seed-file", help="File chứa danh sách URL gốc")
+    parser.add_argument("--sitemap", action="append", default=[], help="URL sitemap (có thể lặp lại)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Thư mục ghi file markdown")
+    parser.add_argument("--depth", type=int, default=2, help="Độ sâu tối đa tính từ URL gốc")
+    parser.add_argument("--max-pages", type=int, default=100, help="Số trang tối đa")
+    parser.add_argument("--concurrency", type=int, default=5, help="Số trang được crawl đồng thời")
+    parser.add_argument("--domain", action="append", help="Tên miền được phép (mặc định là tên miền của URL gốc)")
+    parser.add_argument("--no-browser", action="store_true", help="Tải trang bằng HTTP thuần thay vì trình duyệt")
+    parser.add_argument("--force", action="store_true", help="Tải lại mọi trang, bỏ qua kiểm tra ETag/Last-Modified")
+    args = parser.parse_args()
+
+    seeds = list(args.urls)
+    if args.seed_file:
+        seeds.extend(read_seed_file(args.seed_file))
+    if not seeds and not args.sitemap:
+        seeds = ["http://hoc24.vn"]
 
-    async with AsyncWebCrawler(config=browser_config) as crawler:
-        result = await crawler.arun(
-            url="http://hoc24.vn",
-            config=run_config
-        )
-        print(result.markdown)  # Print clean markdown content
+    crawler = SiteCrawler(
+        output_dir=args.output,
+        max_depth=args.depth,
+        max_pages=args.max_pages,
+        concurrency=args.concurrency,
+        allowed_domains=args.domain,
+        use_browser=not args.no_browser,
+        conditional=not args.force
+    )
+    await crawler.crawl(seeds=seeds, sitemaps=args.sitemap)
+    print(f"File markdown được lưu tại: {os.path.abspath(args.output)}")
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,179 @@
+"""
+Cache câu trả lời đặt trước InteractiveRAGChatbot.query
+"""
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_question(question):
+    """Chuẩn hóa câu hỏi: Unicode NFC, chữ thường, gộp khoảng trắng, bỏ dấu câu ở cuối"""
+    text = unicodedata.normalize("NFC", question).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(" ?!.…")
+
+
+def document_key(doc):
+    """Khóa ổn định của một chunk dựa trên nguồn và nội dung"""
+    source = doc.metadata.get("source", "") if doc.metadata else ""
+    return hashlib.sha1(f"{source}\0{doc.page_content}".encode("utf-8")).hexdigest()
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+class AnswerCache:
+    def __init__(self, max_entries=512, ttl_seconds=3600, similarity_threshold=None):
+        """
+        Cache câu trả lời gồm hai tầng
+
+        - Tầng khớp chính xác: câu hỏi đã chuẩn hóa + id của các chunk được truy xuất + lịch sử hội thoại
+        - Tầng tương đồng (tùy chọn): embedding của câu hỏi có cosine >= similarity_threshold
+
+        Args:
+            max_entries: Số câu trả lời tối đa, vượt quá sẽ xóa mục ít dùng nhất (LRU)
+            ttl_seconds: Thời gian sống của mỗi câu trả lời (giây)
+            similarity_threshold: Ngưỡng cosine cho tầng tương đồng, None để tắt
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.hits = {"exact": 0, "similar": 0}
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Embedding đã chuẩn hóa của các câu hỏi, mỗi dòng ứng với một mục (tầng tương đồng dùng một phép nhân ma trận)
+        self._matrix = None
+        self._row_keys = []
+        self._free_rows = []
+
+    @property
+    def similarity_enabled(self):
+        return self.similarity_threshold is not None
+
+    @staticmethod
+    def make_key(question, docs, chat_history=""):
+        """Khóa của tầng khớp chính xác; chat_history là lịch sử đã đưa vào prompt (câu trả lời phụ thuộc vào nó)"""
+        chunk_ids = ",".join(sorted(document_key(doc) for doc in docs))
+        history = hashlib.sha256(chat_history.encode("utf-8")).hexdigest() if chat_history else ""
+        return hashlib.sha256(f"{normalize_question(question)}\0{chunk_ids}\0{history}".encode("utf-8")).hexdigest()
+
+    def _expired(self, entry, now):
+        return self.ttl_seconds is not None and now - entry["created"] > self.ttl_seconds
+
+    def get(self, key):
+        """Tra cứu tầng khớp chính xác"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry, now):
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            self.hits["exact"] += 1
+            return entry
+
+    def get_similar(self, question_vector):
+        """Tra cứu tầng tương đồng: câu trả lời của câu hỏi gần nhất vượt ngưỡng cosine"""
+        if not self.similarity_enabled or question_vector is None:
+            return None
+        query = _unit(question_vector)
+        now = time.time()
+        with self._lock:
+            if self._matrix is None or len(query) != self._matrix.shape[1]:
+                return None
+            rows = len(self._row_keys)
+            scores = self._matrix[:rows] @ query
+            # Xét các dòng vượt ngưỡng theo điểm giảm dần; mục hết hạn được xóa khi gặp
+            candidates = np.flatnonzero(scores >= self.similarity_threshold)
+            for row in candidates[np.argsort(-scores[candidates], kind="stable")]:
+                key = self._row_keys[row]
+                if key is None:
+                    continue
+                if self._expired(self._entries[key], now):
+                    self._remove(key)
+                    continue
+                self._entries.move_to_end(key)
+                self.hits["similar"] += 1
+                return self._entries[key]
+            return None
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def put(self, key, answer, sources, question_vector=None):
+        """Lưu câu trả lời mới"""
+        entry = {
+            "answer": answer,
+            "sources": sources,
+            "row": None,
+            "created": time.time()
+        }
+        vector = _unit(question_vector) if question_vector is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            # Xóa theo LRU trước khi thêm để dòng vừa giải phóng được dùng lại
+            while self._entries and len(self._entries) >= self.max_entries:
+                self._remove(next(iter(self._entries)))
+            if vector is not None:
+                entry["row"] = self._add_row(key, vector)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _add_row(self, key, vector):
+        """Ghi vector vào một dòng trống của ma trận, trả về chỉ số dòng (None nếu khác số chiều)"""
+        if self._matrix is None:
+            self._matrix = np.zeros((min(self.max_entries, 64) or 1, len(vector)), dtype=np.float32)
+        if len(vector) != self._matrix.shape[1]:
+            return None
+        if self._free_rows:
+            row = self._free_rows.pop()
+            self._row_keys[row] = key
+        else:
+            row = len(self._row_keys)
+            if row == len(self._matrix):
+                grown = np.zeros((2 * len(self._matrix), self._matrix.shape[1]), dtype=np.float32)
+                grown[:row] = self._matrix
+                self._matrix = grown
+            self._row_keys.append(key)
+        self._matrix[row] = vector
+        return row
+
+    def _remove(self, key):
+        """Xóa một mục và giải phóng dòng của nó trong ma trận (phải giữ lock khi gọi)"""
+        entry = self._entries.pop(key)
+        row = entry["row"]
+        if row is not None:
+            self._matrix[row] = 0
+            self._row_keys[row] = None
+            self._free_rows.append(row)
+
+    def clear(self):
+        """Xóa toàn bộ cache (gọi khi dữ liệu trong vector store thay đổi)"""
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self._row_keys = []
+            self._free_rows = []
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.hits["exact"],
+                "similar_hits": self.hits["similar"],
+                "misses": self.misses
+            }
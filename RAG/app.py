@@ -1,44 +1,238 @@
 """
 Flask web interface cho RAG Chatbot
 """
-from flask import Flask, render_template, request, jsonify
+import time
+
+# Mốc thời gian bắt đầu tiến trình, dùng để báo cáo thời gian khởi động
+PROCESS_START = time.perf_counter()
+
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, g
 from dotenv import load_dotenv
+import json
 import os
+import tempfile
 import threading
-import time
+import uuid
 
-# Import RAG chatbot
-from rag_chatbot import InteractiveRAGChatbot  # Giả sử bạn lưu code chatbot vào file rag_chatbot.py
+# Chỉ import module nhẹ; rag_chatbot (langchain, Chroma, Google client) được import trong thread warm-up
+from doc_metadata import normalize_filter
+from metrics import REGISTRY
+from job_queue import DuplicateJobError, JobQueue, jobs_path_for
+from snapshot import SnapshotError
+from tts_service import TTSService, make_backend
+from voice_pipeline import VoicePipeline
 
 # Nạp biến môi trường
 load_dotenv()
 
 app = Flask(__name__)
 
-# Khởi tạo chatbot
-chatbot = InteractiveRAGChatbot(persist_directory="./my_rag_db")
+PERSIST_DIRECTORY = "./my_rag_db"
+# "background": server nhận request ngay, chatbot được khởi tạo trong thread nền
+# "eager": khởi tạo xong chatbot rồi mới nhận request (như trước đây)
+STARTUP_MODE = os.getenv("RAG_STARTUP_MODE", "background")
+# Đọc trước các file HNSW vào page cache khi warm-up
+PRETOUCH_INDEX = os.getenv("RAG_PRETOUCH_INDEX", "0") == "1"
+# Vector store: "chroma" hoặc "quantized" (vector float16/int8 memory-mapped, xem quantized_store.py)
+VECTOR_BACKEND = os.getenv("RAG_VECTOR_BACKEND", "chroma")
+VECTOR_DTYPE = os.getenv("RAG_VECTOR_DTYPE", "float16")
+# Chia dữ liệu thành nhiều collection theo khóa metadata (source_dir, doc_type, crawl_domain, ingest_date)
+SHARD_BY = os.getenv("RAG_SHARD_BY") or None
+# Cách chia chunk: "markdown" (theo tiêu đề, kích thước tính bằng token) hoặc "recursive" (1000 ký tự)
+CHUNKER = os.getenv("RAG_CHUNKER", "markdown")
+CHUNK_TOKENS = int(os.getenv("RAG_CHUNK_TOKENS", "300"))
+# Embedding: "gemini" (qua API), "hashing" (cục bộ, không cần tải model) hoặc "sentence-transformers"
+# (RAG_EMBEDDING_MODEL là thư mục model trên đĩa). Index tạo bằng embedding khác sẽ không được mở.
+EMBEDDING_BACKEND = os.getenv("RAG_EMBEDDING_BACKEND", "gemini")
+EMBEDDING_MODEL = os.getenv("RAG_EMBEDDING_MODEL") or None
+EMBEDDING_DIMENSION = int(os.getenv("RAG_EMBEDDING_DIMENSION") or 0) or None
+EMBEDDING_WORKERS = int(os.getenv("RAG_EMBEDDING_WORKERS") or 0) or None
+# Snapshot được nạp khi khởi động nếu chưa có dữ liệu (node mới sao chép index từ node khác)
+SNAPSHOT_PATH = os.getenv("RAG_SNAPSHOT") or None
+# Thư mục chứa snapshot của /export-snapshot và /import-snapshot (đường dẫn trong request tính từ thư mục này)
+SNAPSHOT_DIRECTORY = os.getenv("RAG_SNAPSHOT_DIRECTORY", "./snapshots")
+# Số job tải tài liệu chạy đồng thời
+INGEST_WORKERS = int(os.getenv("RAG_INGEST_WORKERS", "1"))
+# Giới hạn gọi Gemini API mỗi phút (để trống để không giới hạn), đặt theo quota của API key
+GEMINI_RPM = int(os.getenv("RAG_GEMINI_RPM") or 0) or None
+GEMINI_TPM = int(os.getenv("RAG_GEMINI_TPM") or 0) or None
 
-# Biến toàn cục để theo dõi trạng thái tải tài liệu
-loading_status = {
-    "is_loading": False,
-    "total_files": 0,
-    "processed_files": 0,
-    "message": ""
-}
+# Mô hình Whisper và ngôn ngữ của câu hỏi giọng nói (để trống để tự nhận dạng)
+WHISPER_MODEL = os.getenv("RAG_WHISPER_MODEL", "base")
+VOICE_LANGUAGE = os.getenv("RAG_VOICE_LANGUAGE") or None
+
+# Dịch vụ chuyển văn bản thành giọng nói (RAG_TTS_BACKEND=tone để chạy offline)
+tts = TTSService(backend=make_backend(), cache_dir="./tts_cache")
+REGISTRY.gauge("rag_tts_cache", "Thống kê cache âm thanh TTS (hits, misses, bytes)",
+               lambda: {(("stat", name),): value for name, value in tts.stats().items()})
+
+class Warmup:
+    """Khởi tạo chatbot (import, mở vector database, tạo retriever, làm nóng index) trong thread nền"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._thread = None
+        self.chatbot = None
+        self._state = "starting"
+        self._error = None
+        self._timings = {}
+    
+    def start(self, pretouch=False):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, args=(pretouch,), name="rag-warmup")
+            self._thread.daemon = True
+            self._thread.start()
+    
+    def wait(self, timeout=None):
+        """Chờ warm-up kết thúc, trả về chatbot (None nếu lỗi hoặc hết thời gian chờ)"""
+        self._done.wait(timeout)
+        return self.chatbot
+    
+    def _run(self, pretouch):
+        timings = {}
+        try:
+            start = time.perf_counter()
+            from rag_chatbot import InteractiveRAGChatbot
+            timings["import_seconds"] = time.perf_counter() - start
+            
+            start = time.perf_counter()
+            chatbot = InteractiveRAGChatbot(persist_directory=PERSIST_DIRECTORY,
+                                            vector_backend=VECTOR_BACKEND,
+                                            vector_dtype=VECTOR_DTYPE,
+                                            shard_by=SHARD_BY,
+                                            chunker=CHUNKER,
+                                            chunk_tokens=CHUNK_TOKENS,
+                                            embedding_backend=EMBEDDING_BACKEND,
+                                            embedding_model=EMBEDDING_MODEL,
+                                            embedding_dimension=EMBEDDING_DIMENSION,
+                                            embedding_workers=EMBEDDING_WORKERS,
+                                            requests_per_minute=GEMINI_RPM,
+                                            tokens_per_minute=GEMINI_TPM)
+            timings["init_seconds"] = time.perf_counter() - start
+            
+            if SNAPSHOT_PATH and chatbot.vectorstore is None:
+                start = time.perf_counter()
+                chatbot.import_snapshot(SNAPSHOT_PATH)
+                timings["snapshot_seconds"] = time.perf_counter() - start
+            
+            start = time.perf_counter()
+            timings.update(chatbot.warm_up(pretouch=pretouch))
+            timings["warmup_seconds"] = time.perf_counter() - start
+            timings["ready_seconds"] = time.perf_counter() - PROCESS_START
+            
+            with self._lock:
+                self.chatbot = chatbot
+                self._state = "ready"
+                self._timings = timings
+            jobs.start(chatbot)
+            print(f"Chatbot sẵn sàng sau {timings['ready_seconds']:.2f}s kể từ khi khởi động "
+                  f"(import {timings['import_seconds']:.2f}s, khởi tạo {timings['init_seconds']:.2f}s, "
+                  f"warm-up {timings['warmup_seconds']:.2f}s)")
+        except Exception as e:
+            with self._lock:
+                self._state = "error"
+                self._error = str(e)
+                self._timings = timings
+            print(f"Lỗi khi khởi tạo chatbot: {e}")
+        finally:
+            self._done.set()
+    
+    def snapshot(self):
+        with self._lock:
+            return {
+                "state": self._state,
+                "error": self._error,
+                "uptime_seconds": round(time.perf_counter() - PROCESS_START, 3),
+                "startup": {name: round(value, 3) for name, value in self._timings.items()}
+            }
+    
+    def startup_gauge(self):
+        with self._lock:
+            return {(("phase", name),): round(value, 6) for name, value in self._timings.items()}
+
+warmup = Warmup()
+REGISTRY.gauge("rag_startup_seconds", "Thời gian khởi động theo từng bước", warmup.startup_gauge)
+
+def not_ready_response():
+    """Phản hồi 503 khi chatbot chưa khởi tạo xong"""
+    snapshot = warmup.snapshot()
+    if snapshot["state"] == "error":
+        message = f"Không thể khởi tạo chatbot: {snapshot['error']}"
+    else:
+        message = "Chatbot đang khởi động, vui lòng thử lại sau giây lát."
+    return jsonify({"error": message, "startup": snapshot}), 503
+
+# Hàng đợi job tải tài liệu lưu trong SQLite cạnh database; các worker bắt đầu khi chatbot sẵn sàng
+jobs = JobQueue(jobs_path_for(PERSIST_DIRECTORY), workers=INGEST_WORKERS)
+
+SESSION_COOKIE = "rag_session"
+
+def get_session_id():
+    """Lấy session id từ request (JSON, header hoặc cookie), tạo mới nếu chưa có"""
+    if "session_id" not in g:
+        data = request.get_json(silent=True) or {}
+        session_id = (data.get('session_id')
+                      or request.headers.get('X-Session-ID')
+                      or request.cookies.get(SESSION_COOKIE))
+        if not session_id:
+            session_id = uuid.uuid4().hex
+            g.new_session = True
+        g.session_id = session_id
+    return g.session_id
+
+@app.after_request
+def set_session_cookie(response):
+    """Gửi cookie session cho client mới"""
+    if g.get("new_session"):
+        response.set_cookie(SESSION_COOKIE, g.session_id, httponly=True, samesite="Lax")
+    return response
+
+@app.route('/health', methods=['GET'])
+def health():
+    """Liveness: server đang chạy (kể cả khi chatbot chưa khởi tạo xong)"""
+    return jsonify({"status": "ok", "uptime_seconds": round(time.perf_counter() - PROCESS_START, 3)})
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness: 200 khi chatbot đã sẵn sàng nhận truy vấn, 503 nếu chưa"""
+    snapshot = warmup.snapshot()
+    return jsonify(snapshot), 200 if snapshot["state"] == "ready" else 503
 
 @app.route('/')
 def index():
     """Trang chủ"""
     return render_template('index.html')
 
+def parse_filter(value):
+    """Đọc bộ lọc metadata của request (object JSON hoặc chuỗi JSON trong query string)"""
+    if isinstance(value, str):
+        value = json.loads(value) if value.strip() else None
+    return normalize_filter(value)
+
 @app.route('/query', methods=['POST'])
 def process_query():
-    """Xử lý truy vấn"""
+    """
+    Xử lý truy vấn. Trường "filter" (tùy chọn) giới hạn phạm vi tìm kiếm theo metadata,
+    ví dụ {"crawl_domain": "hoc24.vn", "doc_type": ["md", "txt"], "ingest_date": {"$gte": "2024-05-01"}}
+    """
     data = request.json
     question = data.get('question', '')
+    # Trả thêm thời gian từng bước khi client yêu cầu "debug_timings": true
+    debug_timings = bool(data.get('debug_timings', False))
     
     if not question:
         return jsonify({"error": "Câu hỏi không được để trống"}), 400
+    try:
+        query_filter = parse_filter(data.get('filter'))
+    except ValueError as e:
+        return jsonify({"error": f"Bộ lọc không hợp lệ: {str(e)}"}), 400
+    
+    chatbot = warmup.chatbot
+    if chatbot is None:
+        return not_ready_response()
     
     # Kiểm tra xem có vector store chưa
     if chatbot.vectorstore is None:
@@ -46,14 +240,18 @@ def process_query():
     
     # Thực hiện truy vấn với sources
     try:
-        result = chatbot.query(question, return_sources=True)
+        result = chatbot.query(question, return_sources=True, session_id=get_session_id(),
+                               return_timings=debug_timings, filter=query_filter)
         
         if isinstance(result, dict) and 'answer' in result:
             response = {
                 "answer": result['answer'],
                 "has_sources": True,
-                "sources": result['sources']
+                "sources": result['sources'],
+                "cached": result.get('cached', False)
             }
+            if debug_timings:
+                response["timings"] = result.get('timings')
         else:
             response = {
                 "answer": result,
@@ -64,42 +262,206 @@ def process_query():
     except Exception as e:
         return jsonify({"error": f"Lỗi khi xử lý truy vấn: {str(e)}"}), 500
 
-@app.route('/clear-history', methods=['POST'])
-def clear_history():
-    """Xóa lịch sử hội thoại"""
-    chatbot.reset_conversation()
-    return jsonify({"success": True, "message": "Đã xóa lịch sử hội thoại"})
+def sse_event(event):
+    """Định dạng một sự kiện Server-Sent Events"""
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
 
-def load_docs_thread(file_path, is_directory=False):
-    """Hàm tải tài liệu trong thread riêng"""
-    global loading_status
+# Số câu hỏi tối đa trong một request /query-batch
+MAX_BATCH_QUESTIONS = int(os.getenv("RAG_MAX_BATCH_QUESTIONS", "256"))
+
+@app.route('/query-batch', methods=['POST'])
+def process_query_batch():
+    """Trả lời nhiều câu hỏi độc lập trong một request, kết quả và lỗi được trả về theo từng câu hỏi"""
+    data = request.json or {}
+    questions = data.get('questions')
+    concurrency = data.get('concurrency')
     
-    loading_status["is_loading"] = True
-    loading_status["message"] = "Đang bắt đầu tải dữ liệu..."
+    if not isinstance(questions, list) or not questions:
+        return jsonify({"error": "questions phải là danh sách câu hỏi không rỗng"}), 400
+    if len(questions) > MAX_BATCH_QUESTIONS:
+        return jsonify({"error": f"Tối đa {MAX_BATCH_QUESTIONS} câu hỏi mỗi request"}), 400
+    if concurrency is not None and (not isinstance(concurrency, int) or concurrency < 1):
+        return jsonify({"error": "concurrency phải là số nguyên dương"}), 400
+    try:
+        query_filter = parse_filter(data.get('filter'))
+    except ValueError as e:
+        return jsonify({"error": f"Bộ lọc không hợp lệ: {str(e)}"}), 400
     
+    chatbot = warmup.chatbot
+    if chatbot is None:
+        return not_ready_response()
+    
+    # Kiểm tra xem có vector store chưa
+    if chatbot.vectorstore is None:
+        return jsonify({"error": "Chưa có dữ liệu nào được tải. Vui lòng tải dữ liệu trước."}), 400
+    
+    questions = [question if isinstance(question, str) else "" for question in questions]
     try:
-        if is_directory:
-            loading_status["message"] = f"Đang quét thư mục {file_path}..."
-            loaded_chunks = chatbot.load_directory(file_path)
-            loading_status["message"] = f"Đã tải thành công {loaded_chunks} chunks từ thư mục."
-        else:
-            loading_status["message"] = f"Đang xử lý file {file_path}..."
-            loaded_chunks = chatbot.load_documents([file_path])
-            loading_status["message"] = f"Đã tải thành công {loaded_chunks} chunks từ file."
+        result = chatbot.query_batch(questions, return_sources=bool(data.get('return_sources', True)),
+                                     max_concurrency=concurrency, filter=query_filter)
+        return jsonify(result)
     except Exception as e:
-        loading_status["message"] = f"Lỗi khi tải dữ liệu: {str(e)}"
+        return jsonify({"error": f"Lỗi khi xử lý truy vấn: {str(e)}"}), 500
+
+@app.route('/query-stream', methods=['GET', 'POST'])
+def process_query_stream():
+    """Xử lý truy vấn và trả về câu trả lời dạng luồng (Server-Sent Events)"""
+    if request.method == 'POST':
+        data = request.json or {}
+    else:
+        data = request.args
+    question = data.get('question', '')
     
-    loading_status["is_loading"] = False
+    if not question:
+        return jsonify({"error": "Câu hỏi không được để trống"}), 400
+    try:
+        query_filter = parse_filter(data.get('filter'))
+    except ValueError as e:
+        return jsonify({"error": f"Bộ lọc không hợp lệ: {str(e)}"}), 400
+    
+    chatbot = warmup.chatbot
+    if chatbot is None:
+        return not_ready_response()
+    
+    # Kiểm tra xem có vector store chưa
+    if chatbot.vectorstore is None:
+        return jsonify({"error": "Chưa có dữ liệu nào được tải. Vui lòng tải dữ liệu trước."}), 400
+    
+    session_id = get_session_id()
+    
+    def generate():
+        for event in chatbot.query_stream(question, session_id=session_id, filter=query_filter):
+            yield sse_event(event)
+    
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
 
-@app.route('/load-file', methods=['POST'])
-def load_file():
-    """API để tải file"""
-    global loading_status
+@app.route('/tts', methods=['GET', 'POST'])
+def text_to_speech():
+    """Đọc văn bản thành giọng nói, âm thanh được gửi dạng luồng theo từng câu"""
+    if request.method == 'POST':
+        data = request.json or {}
+    else:
+        data = request.args
+    text = data.get('text', '')
+    lang = data.get('lang', 'vi')
     
-    if loading_status["is_loading"]:
-        return jsonify({"error": "Đang trong quá trình tải dữ liệu. Vui lòng đợi."}), 400
+    if not text.strip():
+        return jsonify({"error": "Văn bản không được để trống"}), 400
     
-    data = request.json
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(tts.stream(text, lang)), mimetype=tts.mimetype, headers=headers)
+
+@app.route('/voice-query', methods=['POST'])
+def process_voice_query():
+    """
+    Hỏi đáp bằng giọng nói: nhận file âm thanh (multipart, trường "audio"), trả về dạng luồng
+    (Server-Sent Events) văn bản nhận dạng, câu trả lời và âm thanh của từng câu trả lời
+    """
+    start_time = time.perf_counter()
+    audio = request.files.get('audio')
+    # Cho phép gửi câu hỏi dạng văn bản (trường "question") để bỏ qua bước nhận dạng giọng nói
+    question = request.form.get('question') or None
+    lang = request.form.get('lang') or None
+    
+    if audio is None and not question:
+        return jsonify({"error": "Thiếu file âm thanh"}), 400
+    
+    chatbot = warmup.chatbot
+    if chatbot is None:
+        return not_ready_response()
+    
+    # Kiểm tra xem có vector store chưa
+    if chatbot.vectorstore is None:
+        return jsonify({"error": "Chưa có dữ liệu nào được tải. Vui lòng tải dữ liệu trước."}), 400
+    
+    audio_path = None
+    
+    def cleanup():
+        if audio_path is not None and os.path.exists(audio_path):
+            os.remove(audio_path)
+    
+    try:
+        if question is None:
+            suffix = os.path.splitext(audio.filename or "")[1] or ".webm"
+            with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+                audio_path = f.name
+                audio.save(f)
+        
+        session_id = get_session_id()
+        pipeline = VoicePipeline(chatbot, tts, model_size=WHISPER_MODEL, language=VOICE_LANGUAGE)
+        
+        def generate():
+            for event in pipeline.run(audio_path, question, session_id=session_id, lang=lang,
+                                      start_time=start_time):
+                yield sse_event(event)
+        
+        headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+    except Exception:
+        # Lỗi trước khi trả response (lưu file, khởi tạo pipeline): response không được tạo nên phải tự xóa file
+        cleanup()
+        raise
+    # Xóa file khi response được đóng, kể cả khi client ngắt kết nối trước khi luồng bắt đầu chạy
+    response.call_on_close(cleanup)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Xuất metrics (độ trễ từng bước, cache, fallback, tải dữ liệu) theo định dạng Prometheus"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/clear-history', methods=['POST'])
+def clear_history():
+    """Xóa lịch sử hội thoại của session hiện tại"""
+    chatbot = warmup.chatbot
+    if chatbot is None:
+        return not_ready_response()
+    chatbot.reset_conversation(session_id=get_session_id())
+    return jsonify({"success": True, "message": "Đã xóa lịch sử hội thoại"})
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Gửi job tải một file hoặc thư mục, trả về id để theo dõi tiến độ qua /jobs/<id>"""
+    data = request.json or {}
+    path = data.get('path', '')
+    if not path:
+        return jsonify({"error": "Đường dẫn không được để trống"}), 400
+    if not os.path.exists(path):
+        return jsonify({"error": "Đường dẫn không tồn tại"}), 400
+    
+    try:
+        job = jobs.submit(path, is_directory=data.get('is_directory', os.path.isdir(path)))
+    except DuplicateJobError as e:
+        return jsonify({"error": str(e), "job": jobs.get(e.job_id)}), 409
+    return jsonify({"job": job}), 202
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    """Danh sách các job mới nhất (lọc theo ?status=queued|running|completed|failed|cancelled)"""
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({"jobs": jobs.list(status=request.args.get('status'), limit=limit)})
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Tiến độ của một job: số file đã xong, tốc độ và thời gian còn lại ước tính"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Không tìm thấy job"}), 404
+    return jsonify({"job": job})
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Hủy job (job đang chạy dừng sau nhóm file hiện tại)"""
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Không tìm thấy job"}), 404
+    return jsonify({"job": job})
+
+@app.route('/load-file', methods=['POST'])
+def load_file():
+    """API để tải file (tương thích với giao diện cũ, tạo một job trong hàng đợi)"""
+    data = request.json or {}
     file_path = data.get('file_path', '')
     is_directory = data.get('is_directory', False)
     
@@ -109,31 +471,114 @@ def load_file():
     if not os.path.exists(file_path):
         return jsonify({"error": "Đường dẫn không tồn tại"}), 400
     
-    # Tải file/thư mục trong thread riêng để không block server
-    thread = threading.Thread(target=load_docs_thread, args=(file_path, is_directory))
-    thread.daemon = True
-    thread.start()
+    try:
+        job = jobs.submit(file_path, is_directory=is_directory)
+    except DuplicateJobError:
+        return jsonify({"error": "Đang trong quá trình tải dữ liệu. Vui lòng đợi."}), 400
     
-    return jsonify({"success": True, "message": "Đang bắt đầu tải dữ liệu..."})
+    return jsonify({"success": True, "message": "Đang bắt đầu tải dữ liệu...", "job_id": job["id"]})
 
 @app.route('/loading-status', methods=['GET'])
 def get_loading_status():
-    """API để kiểm tra trạng thái tải dữ liệu"""
-    return jsonify(loading_status)
+    """API để kiểm tra trạng thái tải dữ liệu (tổng hợp các job đang chờ và đang chạy)"""
+    active = jobs.active()
+    if active:
+        current = next((job for job in active if job["status"] == "running"), active[0])
+        return jsonify({
+            "is_loading": True,
+            "total_files": current["total_files"] or 0,
+            "processed_files": current["done_files"],
+            "message": current["message"],
+            "job_id": current["id"],
+            "queued_jobs": sum(1 for job in active if job["status"] == "queued")
+        })
+    # Job kết thúc gần nhất
+    latest = max(jobs.list(limit=20), key=lambda job: job["finished_at"] or 0, default=None)
+    if latest is None:
+        return jsonify({"is_loading": False, "total_files": 0, "processed_files": 0, "message": "", "job_id": None})
+    return jsonify({
+        "is_loading": False,
+        "total_files": latest["total_files"] or 0,
+        "processed_files": latest["done_files"],
+        "message": latest["message"],
+        "job_id": latest["id"]
+    })
 
 @app.route('/reset-database', methods=['POST'])
 def reset_database():
     """Xóa toàn bộ database"""
-    global loading_status
+    chatbot = warmup.chatbot
+    if chatbot is None:
+        return not_ready_response()
     
-    if loading_status["is_loading"]:
+    # Không reset khi còn job tải dữ liệu; worker không nhận job mới trong lúc reset
+    try:
+        started, _ = jobs.run_exclusive(chatbot.reset_database)
+    except Exception as e:
+        return jsonify({"error": f"Lỗi khi xóa database: {str(e)}"}), 500
+    if not started:
         return jsonify({"error": "Đang trong quá trình tải dữ liệu. Vui lòng đợi."}), 400
+    return jsonify({"success": True, "message": "Đã xóa toàn bộ database"})
+
+def snapshot_path(name):
+    """
+    Đường dẫn file snapshot trong SNAPSHOT_DIRECTORY, None nếu trống hoặc trỏ ra ngoài thư mục
+    (đường dẫn tuyệt đối, "..", symlink)
+    """
+    if not name:
+        return None
+    root = os.path.realpath(SNAPSHOT_DIRECTORY)
+    path = os.path.realpath(os.path.join(root, name))
+    if path == root or os.path.commonpath([root, path]) != root:
+        return None
+    return path
+
+@app.route('/export-snapshot', methods=['POST'])
+def export_snapshot():
+    """Ghi index ra một file snapshot trong SNAPSHOT_DIRECTORY (vẫn phục vụ truy vấn trong lúc ghi)"""
+    path = snapshot_path((request.json or {}).get('path', ''))
+    if path is None:
+        return jsonify({"error": f"Đường dẫn phải là file nằm trong thư mục snapshot {SNAPSHOT_DIRECTORY}"}), 400
+    
+    chatbot = warmup.chatbot
+    if chatbot is None:
+        return not_ready_response()
     
     try:
-        chatbot.reset_database()
-        return jsonify({"success": True, "message": "Đã xóa toàn bộ database"})
+        return jsonify({"success": True, **chatbot.export_snapshot(path)})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        return jsonify({"error": f"Lỗi khi xóa database: {str(e)}"}), 500
+        return jsonify({"error": f"Lỗi khi ghi snapshot: {str(e)}"}), 500
+
+@app.route('/import-snapshot', methods=['POST'])
+def import_snapshot():
+    """Thay toàn bộ dữ liệu bằng dữ liệu trong một file snapshot của SNAPSHOT_DIRECTORY"""
+    path = snapshot_path((request.json or {}).get('path', ''))
+    if path is None or not os.path.isfile(path):
+        return jsonify({"error": f"Không tìm thấy file snapshot trong thư mục {SNAPSHOT_DIRECTORY}"}), 400
+    
+    chatbot = warmup.chatbot
+    if chatbot is None:
+        return not_ready_response()
+    
+    try:
+        started, stats = jobs.run_exclusive(lambda: chatbot.import_snapshot(path))
+    except (ValueError, SnapshotError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Lỗi khi nạp snapshot: {str(e)}"}), 500
+    if not started:
+        return jsonify({"error": "Đang trong quá trình tải dữ liệu. Vui lòng đợi."}), 400
+    return jsonify({"success": True, **stats})
+
+# Không khởi tạo chatbot trong tiến trình theo dõi của reloader (debug=True), chỉ trong tiến trình phục vụ
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    warmup.start(pretouch=PRETOUCH_INDEX)
+    if STARTUP_MODE == "eager":
+        warmup.wait()
 
 if __name__ == '__main__':
+    print(f"Server khởi động sau {time.perf_counter() - PROCESS_START:.2f}s, "
+          f"chatbot đang được khởi tạo ở chế độ {STARTUP_MODE}")
     app.run(host='0.0.0.0', port=8765, debug=True)
\ No newline at end of file
@@ -0,0 +1,501 @@
+"""
+Benchmark offline cho InteractiveRAGChatbot: tốc độ tải tài liệu, kích thước index,
+độ trễ truy xuất và độ trễ end-to-end, dùng model giả lập thay cho Gemini (không cần mạng)
+
+Ví dụ:
+    python benchmark.py --files 200 --queries 50 --embed-latency-ms 30 --llm-latency-ms 300 --output bench.json
+    python benchmark.py --compare-vector-stores --vectors 50000 --dimension 768
+    python benchmark.py --compare-sharding --vectors 50000 --domains 20 --dimension 768
+"""
+import argparse
+import contextlib
+import hashlib
+import json
+import math
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Iterator, List, Optional
+
+import numpy as np
+
+# Tắt telemetry của Chroma để benchmark chạy được khi không có mạng
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+# Đếm token theo ước lượng để không phải tải bảng mã của tiktoken
+os.environ.setdefault("RAG_TOKENIZER", "none")
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from quantized_store import QuantizedVectorStore
+from sharded_store import ShardedVectorStore, search_by_vectors
+from rag_chatbot import InteractiveRAGChatbot
+
+_WORDS = ("dữ liệu mô hình truy vấn tài liệu hệ thống người dùng câu hỏi trả lời ngôn ngữ "
+          "vector chỉ mục tìm kiếm hiệu năng bộ nhớ độ trễ máy chủ mạng lưới sản phẩm "
+          "khách hàng đơn hàng thanh toán giao hàng kho bãi báo cáo doanh thu nhân viên").split()
+
+
+class FakeEmbeddings(Embeddings):
+    """Embedding giả lập: băm từ vào vector cố định chiều, có độ trễ cấu hình được"""
+
+    def __init__(self, dimension=256, latency_ms=0.0, per_text_ms=0.0):
+        self.model = f"fake-hash-{dimension}"
+        self.dimension = dimension
+        self.latency_ms = latency_ms
+        self.per_text_ms = per_text_ms
+        self.calls = 0
+
+    def _vector(self, text):
+        vector = [0.0] * self.dimension
+        for word in text.lower().split():
+            digest = int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16)
+            vector[digest % self.dimension] += 1.0 if digest & 1 else -1.0
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def _sleep(self, count):
+        delay = (self.latency_ms + self.per_text_ms * count) / 1000
+        if delay > 0:
+            time.sleep(delay)
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        self._sleep(len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        self.calls += 1
+        self._sleep(1)
+        return self._vector(text)
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model giả lập: trả lời cố định sau một độ trễ, hỗ trợ stream từng token"""
+
+    latency_ms: float = 0.0
+    token_latency_ms: float = 0.0
+    answer_tokens: int = 40
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _answer(self, messages):
+        prompt = "".join(str(message.content) for message in messages)
+        seed = int(hashlib.md5(prompt.encode("utf-8")).hexdigest(), 16)
+        rng = random.Random(seed)
+        return [rng.choice(_WORDS) for _ in range(self.answer_tokens)]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        tokens = self._answer(messages)
+        time.sleep((self.latency_ms + self.token_latency_ms * len(tokens)) / 1000)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=" ".join(tokens)))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        tokens = self._answer(messages)
+        time.sleep(self.latency_ms / 1000)
+        for i, token in enumerate(tokens):
+            if self.token_latency_ms:
+                time.sleep(self.token_latency_ms / 1000)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token if i == 0 else " " + token))
+
+
+def make_corpus(directory, n_files, paragraphs_per_file, seed=0):
+    """Sinh corpus markdown giả lập có thể tái lập (cùng seed -> cùng nội dung)"""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    for i in range(n_files):
+        lines = [f"# Tài liệu {i}", ""]
+        for p in range(paragraphs_per_file):
+            lines.append(f"## Mục {p}")
+            words = [rng.choice(_WORDS) for _ in range(rng.randint(40, 120))]
+            words.insert(rng.randrange(len(words)), f"SP-{i:04d}-{p:02d}")
+            lines.append(" ".join(words))
+            lines.append("")
+        with open(os.path.join(directory, f"doc_{i:05d}.md"), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+
+
+def make_questions(n_files, n_queries, seed=1):
+    rng = random.Random(seed)
+    questions = []
+    for q in range(n_queries):
+        words = " ".join(rng.choice(_WORDS) for _ in range(6))
+        questions.append(f"{words} SP-{rng.randrange(n_files):04d}-{rng.randrange(3):02d} ({q})?")
+    return questions
+
+
+def percentile(values, pct):
+    """Phân vị theo phương pháp nearest-rank"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def latency_summary(seconds):
+    ms = [s * 1000 for s in seconds]
+    return {
+        "count": len(ms),
+        "mean_ms": round(sum(ms) / len(ms), 3) if ms else None,
+        "p50_ms": round(percentile(ms, 50), 3) if ms else None,
+        "p95_ms": round(percentile(ms, 95), 3) if ms else None,
+        "p99_ms": round(percentile(ms, 99), 3) if ms else None,
+        "max_ms": round(max(ms), 3) if ms else None
+    }
+
+
+def disk_usage(paths):
+    """Tổng dung lượng (byte) của các file/thư mục"""
+    total = 0
+    for path in paths:
+        if os.path.isfile(path):
+            total += os.path.getsize(path)
+        elif os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+def peak_rss_mb():
+    # ru_maxrss tính bằng KB trên Linux, byte trên macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def current_rss_mb():
+    """RSS hiện tại của tiến trình (chỉ có trên Linux), None nếu không đọc được"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rag_bench_")
+    corpus_dir = os.path.join(workdir, "corpus")
+    persist_directory = os.path.join(workdir, "db")
+    make_corpus(corpus_dir, args.files, args.paragraphs, seed=args.seed)
+
+    # "fake": giả lập độ trễ của API embedding; "hashing": embedding cục bộ thật (embedding_backends.py)
+    embeddings = None
+    if args.embedding_backend == "fake":
+        embeddings = FakeEmbeddings(dimension=args.dimension, latency_ms=args.embed_latency_ms,
+                                    per_text_ms=args.embed_per_text_ms)
+    llm = FakeChatModel(latency_ms=args.llm_latency_ms, token_latency_ms=args.llm_token_latency_ms)
+    questions = make_questions(args.files, args.queries, seed=args.seed + 1)
+
+    # Log của chatbot được chuyển sang stderr để stdout chỉ chứa JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        chatbot = InteractiveRAGChatbot(
+            persist_directory=persist_directory,
+            embeddings=embeddings,
+            embedding_backend=args.embedding_backend,
+            embedding_dimension=args.dimension,
+            llm=llm,
+            load_workers=args.load_workers,
+            embed_batch_size=args.embed_batch_size,
+            max_inflight_embeddings=args.max_inflight_embeddings,
+            answer_cache_size=0,
+            vector_backend=args.vector_backend,
+            vector_dtype=args.vector_dtype
+        )
+
+        start = time.perf_counter()
+        chunks = chatbot.load_directory(corpus_dir)
+        ingest_seconds = time.perf_counter() - start
+
+        retrieval_times = []
+        for question in questions:
+            start = time.perf_counter()
+            chatbot._retrieve_documents(chatbot._index, question)
+            retrieval_times.append(time.perf_counter() - start)
+
+        query_times = []
+        stage_times = {}
+        for question in questions:
+            start = time.perf_counter()
+            result = chatbot.query(question, session_id="benchmark", return_timings=True)
+            query_times.append(time.perf_counter() - start)
+            if isinstance(result, dict):
+                for stage, ms in result["timings"]["stages_ms"].items():
+                    stage_times.setdefault(stage, []).append(ms / 1000)
+
+        # Thông lượng của query_batch theo số lời gọi LLM đồng thời
+        batch_throughput = {}
+        for concurrency in args.batch_concurrency:
+            start = time.perf_counter()
+            batch = chatbot.query_batch(questions, return_sources=False, max_concurrency=concurrency)
+            seconds = time.perf_counter() - start
+            batch_throughput[str(concurrency)] = {
+                "seconds": round(seconds, 3),
+                "questions_per_second": round(len(questions) / seconds, 2),
+                "errors": batch["timings"]["errors"]
+            }
+
+        first_token_times = []
+        for question in questions[:args.stream_queries]:
+            start = time.perf_counter()
+            for event in chatbot.query_stream(question, session_id="benchmark-stream"):
+                if event["type"] == "token":
+                    first_token_times.append(time.perf_counter() - start)
+                    break
+
+    index_paths = [persist_directory] + [persist_directory + suffix for suffix in
+                                         ("_manifest.json", "_bm25.npz", "_bm25.npz.log",
+                                          "_embedding_cache.sqlite3")]
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "ingest": {
+            "files": args.files,
+            "chunks": chunks,
+            "seconds": round(ingest_seconds, 3),
+            "files_per_second": round(args.files / ingest_seconds, 2),
+            "chunks_per_second": round(chunks / ingest_seconds, 2),
+            "embedding_calls": embeddings.calls if embeddings is not None else None
+        },
+        "index_size_bytes": {
+            "vectorstore": disk_usage([persist_directory]),
+            "total": disk_usage(index_paths)
+        },
+        "retrieval": latency_summary(retrieval_times),
+        "query_end_to_end": latency_summary(query_times),
+        "query_stages": {stage: latency_summary(times) for stage, times in stage_times.items()},
+        "time_to_first_token": latency_summary(first_token_times),
+        "batch_throughput": batch_throughput,
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+def make_clustered_vectors(n, dimension, n_clusters=200, noise=0.35, seed=0):
+    """Vector giả lập có cấu trúc cụm giống embedding thật (các chủ đề), đã chuẩn hóa"""
+    rng = np.random.RandomState(seed)
+    centers = rng.randn(n_clusters, dimension).astype(np.float32)
+    vectors = centers[rng.randint(n_clusters, size=n)] + noise * rng.randn(n, dimension).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _measure_store(name, build, open_store, search, queries, truth, directory, k):
+    """Đo thời gian dựng, thời gian mở lại, độ trễ, recall@k, dung lượng đĩa và RSS tăng thêm của một store"""
+    start = time.perf_counter()
+    build()
+    build_seconds = time.perf_counter() - start
+
+    rss_before = current_rss_mb()
+    start = time.perf_counter()
+    store = open_store()
+    open_seconds = time.perf_counter() - start
+
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        found = search(store, query)
+        latencies.append(time.perf_counter() - start)
+        hits += len(set(found[:k]) & set(expected))
+    rss_after = current_rss_mb()
+    return {
+        "store": name,
+        "build_seconds": round(build_seconds, 3),
+        "open_seconds": round(open_seconds, 4),
+        "recall_at_k": round(hits / (k * len(queries)), 4),
+        "latency": latency_summary(latencies),
+        "disk_bytes": disk_usage([directory]),
+        "rss_delta_mb": round(rss_after - rss_before, 1) if rss_before is not None and rss_after is not None else None
+    }
+
+
+def compare_vector_stores(args):
+    """
+    So sánh Chroma (float32, HNSW) với QuantizedVectorStore (float16/int8, quét toàn bộ hoặc IVF)
+    trên cùng tập vector: recall@k so với tìm kiếm chính xác float32, độ trễ, dung lượng và bộ nhớ
+    """
+    from langchain_community.vectorstores import Chroma
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rag_vecbench_")
+    k = 10
+    vectors = make_clustered_vectors(args.vectors, args.dimension, seed=args.seed)
+    rng = np.random.RandomState(args.seed + 1)
+    picks = rng.randint(len(vectors), size=args.vector_queries)
+    queries = vectors[picks] + 0.2 * rng.randn(len(picks), args.dimension).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    truth = [list(np.argsort(-(vectors @ query))[:k]) for query in queries]
+    ids = [str(i) for i in range(len(vectors))]
+    batch = 5000
+    results = []
+
+    def chroma_search(store, query):
+        found = store._collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])
+        return [int(i) for i in found["ids"][0]]
+
+    directory = os.path.join(workdir, "chroma")
+    def chroma_build():
+        store = Chroma(persist_directory=directory, collection_metadata={"hnsw:space": "cosine"})
+        for start in range(0, len(vectors), batch):
+            store._collection.upsert(ids=ids[start:start + batch],
+                                     embeddings=vectors[start:start + batch].tolist())
+    with contextlib.redirect_stdout(sys.stderr):
+        results.append(_measure_store("chroma-float32-hnsw", chroma_build,
+                                      lambda: Chroma(persist_directory=directory), chroma_search,
+                                      queries, truth, directory, k))
+
+    def quantized_search(store, query):
+        return [int(i) for i in store._search(query, k)[1]]
+
+    for dtype in ("float16", "int8"):
+        directory = os.path.join(workdir, f"quantized_{dtype}")
+        def quantized_build(directory=directory, dtype=dtype):
+            store = QuantizedVectorStore(directory, dtype=dtype, index_type="exact",
+                                         initial_capacity=len(vectors))
+            for start in range(0, len(vectors), batch):
+                store.upsert_vectors(ids[start:start + batch], vectors[start:start + batch])
+            store.persist()
+            store.build_ivf()
+        with contextlib.redirect_stdout(sys.stderr):
+            results.append(_measure_store(
+                f"quantized-{dtype}-exact", quantized_build,
+                lambda directory=directory: QuantizedVectorStore(directory, index_type="exact"),
+                quantized_search, queries, truth, directory, k))
+            # IVF dùng lại index đã dựng, chỉ đổi số cụm được quét
+            for nprobe in (2, 4, 8, 16, 32):
+                results.append(_measure_store(
+                    f"quantized-{dtype}-ivf-nprobe{nprobe}", lambda: None,
+                    lambda directory=directory, nprobe=nprobe: QuantizedVectorStore(
+                        directory, index_type="ivf", nprobe=nprobe),
+                    quantized_search, queries, truth, directory, k))
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"vectors": args.vectors, "dimension": args.dimension, "queries": args.vector_queries,
+                   "k": k, "float32_bytes": int(vectors.nbytes)},
+        "stores": results
+    }
+
+
+def compare_sharding(args):
+    """
+    Độ trễ tìm kiếm toàn bộ corpus và tìm kiếm trong phạm vi một tên miền: một collection lọc theo
+    metadata so với collection chia shard theo crawl_domain (chỉ tìm trong shard được chọn)
+    """
+    workdir = args.workdir or tempfile.mkdtemp(prefix="rag_shardbench_")
+    k = 10
+    vectors = make_clustered_vectors(args.vectors, args.dimension, seed=args.seed)
+    domains = [f"site{i}.vn" for i in range(args.domains)]
+    metadatas = [{"crawl_domain": domains[i % len(domains)]} for i in range(len(vectors))]
+    ids = [str(i) for i in range(len(vectors))]
+    texts = [""] * len(vectors)
+    rng = np.random.RandomState(args.seed + 1)
+    queries = vectors[rng.randint(len(vectors), size=args.vector_queries)]
+    batch = 5000
+
+    def open_quantized(directory):
+        return QuantizedVectorStore(directory, dtype="float16", index_type="exact",
+                                    indexed_metadata=("crawl_domain",))
+
+    stores = {}
+    with contextlib.redirect_stdout(sys.stderr):
+        stores["single"] = open_quantized(os.path.join(workdir, "single"))
+        sharded_dir = os.path.join(workdir, "sharded")
+        stores["sharded"] = ShardedVectorStore(
+            sharded_dir, "crawl_domain",
+            lambda name: open_quantized(os.path.join(sharded_dir, "shards", name)),
+            max_workers=args.shard_workers)
+        for store in stores.values():
+            for start in range(0, len(vectors), batch):
+                end = start + batch
+                store.upsert_vectors(ids[start:end], vectors[start:end], metadatas[start:end], texts[start:end])
+            store.persist()
+
+    results = []
+    for name, store in stores.items():
+        for scope, where in (("full", None), ("one-domain", {"crawl_domain": {"$eq": domains[0]}})):
+            latencies = []
+            for query in queries:
+                start = time.perf_counter()
+                search_by_vectors(store, [query], k, where)
+                latencies.append(time.perf_counter() - start)
+            results.append({"store": name, "scope": scope, "latency": latency_summary(latencies)})
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"vectors": args.vectors, "dimension": args.dimension, "domains": args.domains,
+                   "queries": args.vector_queries, "k": k, "shard_workers": args.shard_workers},
+        "searches": results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline cho RAG chatbot")
+    parser.add_argument("--files", type=int, default=100, help="Số file trong corpus giả lập")
+    parser.add_argument("--paragraphs", type=int, default=8, help="Số đoạn mỗi file")
+    parser.add_argument("--queries", type=int, default=50, help="Số câu hỏi")
+    parser.add_argument("--stream-queries", type=int, default=10, help="Số câu hỏi đo thời gian token đầu tiên")
+    parser.add_argument("--dimension", type=int, default=256, help="Số chiều của embedding giả lập")
+    parser.add_argument("--embedding-backend", default="fake", choices=["fake", "hashing"],
+                        help="Embedding giả lập độ trễ API hoặc embedding băm đặc trưng chạy cục bộ")
+    parser.add_argument("--embed-latency-ms", type=float, default=20.0, help="Độ trễ mỗi request embedding")
+    parser.add_argument("--embed-per-text-ms", type=float, default=0.2, help="Độ trễ thêm cho mỗi văn bản")
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0, help="Độ trễ trước token đầu tiên của LLM")
+    parser.add_argument("--llm-token-latency-ms", type=float, default=2.0, help="Độ trễ mỗi token của LLM")
+    parser.add_argument("--load-workers", type=int, default=4)
+    parser.add_argument("--embed-batch-size", type=int, default=64)
+    parser.add_argument("--max-inflight-embeddings", type=int, default=4)
+    parser.add_argument("--batch-concurrency", type=lambda value: [int(v) for v in value.split(",")],
+                        default=[1, 4, 16], help="Các mức đồng thời đo thông lượng query_batch, ví dụ 1,4,16")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="Thư mục làm việc (mặc định là thư mục tạm)")
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file thay vì stdout")
+    parser.add_argument("--vector-backend", default="chroma", choices=["chroma", "quantized"],
+                        help="Vector store của chatbot")
+    parser.add_argument("--vector-dtype", default="float16", choices=["float16", "int8"],
+                        help="Kiểu lưu vector của backend quantized")
+    parser.add_argument("--compare-vector-stores", action="store_true",
+                        help="Chỉ so sánh các vector store (recall, độ trễ, dung lượng, bộ nhớ) trên vector giả lập")
+    parser.add_argument("--vectors", type=int, default=20000, help="Số vector khi so sánh vector store")
+    parser.add_argument("--vector-queries", type=int, default=200, help="Số câu hỏi khi so sánh vector store")
+    parser.add_argument("--compare-sharding", action="store_true",
+                        help="Chỉ so sánh độ trễ tìm kiếm toàn bộ và trong một tên miền (lọc metadata và chia shard)")
+    parser.add_argument("--domains", type=int, default=20, help="Số tên miền khi so sánh chia shard")
+    parser.add_argument("--shard-workers", type=int, default=8, help="Số shard được tìm kiếm song song")
+    args = parser.parse_args()
+
+    if args.compare_sharding:
+        result = compare_sharding(args)
+    elif args.compare_vector_stores:
+        result = compare_vector_stores(args)
+    else:
+        result = run_benchmark(args)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"Đã ghi kết quả benchmark vào {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+"""
+Chỉ mục nghịch đảo BM25 trong bộ nhớ, được lưu cạnh vector database
+
+Posting lists được lưu dạng mảng (CSR: vị trí bắt đầu của từng từ, dòng của chunk, tần suất) trong một file
+.npz, đọc lại không cần tách từ. Các thay đổi sau lần ghi đầy đủ gần nhất được ghi thêm (append) vào file
+nhật ký, chi phí mỗi lần lưu tỉ lệ với phần thay đổi; nhật ký được gộp vào file chính khi đủ lớn.
+"""
+import gzip
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+import zlib
+from array import array
+from collections import Counter
+
+import numpy as np
+
+_TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+def bm25_path_for(persist_directory):
+    """Đường dẫn file chỉ mục BM25 nằm cạnh thư mục persist_directory"""
+    return os.path.normpath(persist_directory) + "_bm25.npz"
+
+
+def tokenize(text):
+    """Tách từ: chuẩn hóa NFC (giữ dấu tiếng Việt), chữ thường, lấy các chuỗi chữ/số"""
+    return _TOKEN_PATTERN.findall(unicodedata.normalize("NFC", text).lower())
+
+
+def _blob(data):
+    return np.frombuffer(zlib.compress(data, 1), dtype=np.uint8)
+
+
+def _unblob(array_):
+    return zlib.decompress(array_.tobytes())
+
+
+class BM25Index:
+    def __init__(self, path, k1=1.5, b=0.75, max_df_ratio=0.5, compact_ratio=0.25):
+        """
+        Chỉ mục BM25 cho các chunk, cập nhật cùng lúc với vector store
+
+        Args:
+            path: Đường dẫn file lưu chỉ mục (nhật ký thay đổi nằm ở path + ".log")
+            k1: Tham số bão hòa tần suất từ của BM25
+            b: Tham số chuẩn hóa độ dài văn bản của BM25
+            max_df_ratio: Từ xuất hiện trong hơn tỉ lệ này số chunk bị bỏ qua khi câu hỏi còn từ hiếm hơn
+                          (idf gần 0 nhưng posting list dài nhất), None để luôn tính mọi từ
+            compact_ratio: Gộp nhật ký vào file chính khi số chunk trong nhật ký (hoặc số dòng đã xóa)
+                           vượt tỉ lệ này so với số chunk
+        """
+        self.path = path
+        self.journal_path = path + ".log"
+        self.k1 = k1
+        self.b = b
+        self.max_df_ratio = max_df_ratio
+        self.compact_ratio = compact_ratio
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        self._reset()
+        self.load()
+
+    def _reset(self):
+        # Mỗi chunk có một dòng (slot); xóa hoặc cập nhật chỉ đánh dấu dòng cũ là đã xóa
+        self._docs = {}
+        self._slots = {}
+        self._slot_ids = []
+        self._doc_len = np.zeros(0, dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._size = 0
+        self._total_len = 0.0
+        # Posting lists đã lưu trong file chính (không đổi cho tới lần gộp sau), dùng chung với các lượt tìm kiếm
+        self._terms = {}
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._post_slots = np.zeros(0, dtype=np.int32)
+        self._post_tf = np.zeros(0, dtype=np.float32)
+        # Posting lists của các chunk thêm sau lần gộp gần nhất
+        self._delta = {}
+        # Các thay đổi chưa ghi vào nhật ký và số chunk đã ghi vào nhật ký
+        self._pending = []
+        self._journal_docs = 0
+        self._needs_compaction = True
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _new_slot(self, doc_id, length):
+        if self._size == len(self._alive):
+            # Thay bằng mảng mới khi hết chỗ: lượt tìm kiếm đang chạy vẫn đọc mảng cũ
+            capacity = max(1024, 2 * len(self._alive))
+            doc_len = np.zeros(capacity, dtype=np.float32)
+            doc_len[:self._size] = self._doc_len[:self._size]
+            alive = np.zeros(capacity, dtype=bool)
+            alive[:self._size] = self._alive[:self._size]
+            self._doc_len, self._alive = doc_len, alive
+        slot = self._size
+        self._doc_len[slot] = length
+        self._alive[slot] = True
+        self._slot_ids.append(doc_id)
+        self._slots[doc_id] = slot
+        self._size += 1
+        self._total_len += length
+        return slot
+
+    def _add_one(self, doc_id, text, metadata):
+        if doc_id in self._docs:
+            self._remove_one(doc_id)
+        counts = Counter(tokenize(text))
+        self._docs[doc_id] = (text, metadata or {})
+        slot = self._new_slot(doc_id, sum(counts.values()))
+        for term, tf in counts.items():
+            postings = self._delta.get(term)
+            if postings is None:
+                postings = self._delta[term] = (array("i"), array("f"))
+            postings[0].append(slot)
+            postings[1].append(tf)
+
+    def _remove_one(self, doc_id):
+        if self._docs.pop(doc_id, None) is None:
+            return
+        slot = self._slots.pop(doc_id)
+        self._alive[slot] = False
+        self._total_len -= float(self._doc_len[slot])
+
+    def add(self, ids, texts, metadatas=None):
+        """Thêm hoặc cập nhật (upsert) các chunk"""
+        metadatas = metadatas or [None] * len(ids)
+        with self._lock:
+            for doc_id, text, metadata in zip(ids, texts, metadatas):
+                self._add_one(doc_id, text, metadata)
+                self._pending.append(["a", doc_id, text, metadata or {}])
+
+    def remove(self, ids):
+        """Xóa các chunk theo id"""
+        with self._lock:
+            for doc_id in ids:
+                if doc_id in self._docs:
+                    self._remove_one(doc_id)
+                    self._pending.append(["r", doc_id])
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+        for path in (self.path, self.journal_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def get(self, doc_id):
+        """Trả về (text, metadata) của chunk, None nếu không có"""
+        return self._docs.get(doc_id)
+
+    def search(self, query, k=10, predicate=None):
+        """
+        Tìm các chunk có điểm BM25 cao nhất. Chỉ giữ khóa trong lúc lấy tham chiếu tới posting lists
+        của các từ trong câu hỏi; việc tính điểm chạy ngoài khóa nên không chặn các lần ghi.
+
+        Args:
+            query: Câu truy vấn
+            k: Số kết quả
+            predicate: Hàm predicate(metadata) chọn các chunk được xét (lọc metadata), None để xét tất cả
+
+        Returns:
+            Danh sách (doc_id, score) theo thứ tự điểm giảm dần
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            n_docs = len(self._docs)
+            if n_docs == 0 or not terms:
+                return []
+            avg_len = self._total_len / n_docs or 1.0
+            doc_len, alive, slot_ids, size = self._doc_len, self._alive, self._slot_ids, self._size
+            term_postings = []
+            for term in terms:
+                parts = []
+                index = self._terms.get(term)
+                if index is not None:
+                    start, end = self._offsets[index], self._offsets[index + 1]
+                    parts.append((self._post_slots[start:end], self._post_tf[start:end]))
+                delta = self._delta.get(term)
+                if delta is not None:
+                    # Posting list của phần thay đổi còn được ghi thêm: sao chép
+                    parts.append((np.array(delta[0], dtype=np.int32), np.array(delta[1], dtype=np.float32)))
+                if parts:
+                    term_postings.append(parts)
+
+        postings = []
+        for parts in term_postings:
+            slots = np.concatenate([part[0] for part in parts])
+            tf = np.concatenate([part[1] for part in parts])
+            keep = alive[slots]
+            if keep.any():
+                postings.append((slots[keep], tf[keep]))
+        if self.max_df_ratio is not None:
+            # Từ quá phổ biến (idf gần 0) chỉ được tính khi câu hỏi không có từ nào hiếm hơn
+            rare = [item for item in postings if len(item[0]) <= self.max_df_ratio * n_docs]
+            postings = rare or postings
+        if not postings:
+            return []
+
+        scores = np.zeros(size, dtype=np.float64)
+        for slots, tf in postings:
+            df = len(slots)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            norm = tf + self.k1 * (1 - self.b + self.b * doc_len[slots] / avg_len)
+            scores += np.bincount(slots, weights=idf * tf * (self.k1 + 1) / norm, minlength=size)
+        candidates = np.flatnonzero(scores)
+        if predicate is None and len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+
+        results = []
+        for slot in candidates:
+            doc_id = slot_ids[slot]
+            if predicate is not None:
+                entry = self._docs.get(doc_id)
+                if entry is None or not predicate(entry[1]):
+                    continue
+            results.append((doc_id, float(scores[slot])))
+            if len(results) >= k:
+                break
+        return results
+
+    # ----- Lưu trữ -----
+
+    def load(self):
+        """Đọc chỉ mục từ file chính (posting lists dạng mảng) rồi áp dụng các thay đổi trong nhật ký"""
+        with self._lock:
+            self._reset()
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, "rb") as f:
+                        legacy = f.read(2) == _GZIP_MAGIC
+                    if legacy:
+                        self._load_legacy()
+                    else:
+                        self._load_base()
+                except (OSError, ValueError, KeyError, zlib.error) as e:
+                    print(f"Không đọc được chỉ mục BM25 {self.path}: {e}")
+                    self._reset()
+                    return
+            self._replay_journal()
+
+    def _load_base(self):
+        with np.load(self.path, allow_pickle=False) as data:
+            docs = json.loads(_unblob(data["docs"]))
+            terms = _unblob(data["terms"]).decode("utf-8")
+            self._offsets = data["offsets"]
+            self._post_slots = data["slots"]
+            self._post_tf = data["tf"]
+            doc_len = data["doc_len"]
+        self._terms = {term: i for i, term in enumerate(terms.split("\n"))} if terms else {}
+        self._slot_ids = [doc_id for doc_id, _, _ in docs]
+        self._docs = {doc_id: (text, metadata) for doc_id, text, metadata in docs}
+        self._slots = {doc_id: slot for slot, doc_id in enumerate(self._slot_ids)}
+        self._size = len(docs)
+        self._doc_len = doc_len.astype(np.float32)
+        self._alive = np.ones(self._size, dtype=bool)
+        self._total_len = float(self._doc_len.sum())
+        self._needs_compaction = False
+
+    def _load_legacy(self):
+        """File dạng cũ (JSON nén gzip, chỉ có văn bản): tách từ lại, lần lưu sau ghi theo định dạng mới"""
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        for doc_id, (text, metadata) in data.get("docs", {}).items():
+            self._add_one(doc_id, text, metadata)
+
+    def _replay_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+        try:
+            with gzip.open(self.journal_path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    op = json.loads(line)
+                    if op[0] == "a":
+                        self._add_one(op[1], op[2], op[3])
+                    else:
+                        self._remove_one(op[1])
+                    self._journal_docs += 1
+        except (OSError, EOFError, ValueError) as e:
+            # Lần ghi cuối bị ngắt giữa chừng: giữ các thay đổi đã đọc được, lần lưu sau ghi lại file chính
+            print(f"Nhật ký BM25 {self.journal_path} bị cắt cụt: {e}")
+            self._needs_compaction = True
+
+    def _wants_compaction(self):
+        threshold = max(1000, self.compact_ratio * len(self._docs))
+        return self._needs_compaction or self._journal_docs > threshold \
+            or self._size - len(self._docs) > threshold
+
+    def _compact(self):
+        """Gộp posting lists của file chính và phần thay đổi, bỏ các dòng đã xóa (gọi khi giữ khóa)"""
+        terms = list(self._terms)
+        term_index = dict(self._terms)
+        counts = np.diff(self._offsets)
+        parts_terms = [np.repeat(np.arange(len(counts), dtype=np.int64), counts)]
+        parts_slots, parts_tf = [self._post_slots], [self._post_tf]
+        for term, (slots, tf) in self._delta.items():
+            index = term_index.get(term)
+            if index is None:
+                index = term_index[term] = len(terms)
+                terms.append(term)
+            parts_terms.append(np.full(len(slots), index, dtype=np.int64))
+            parts_slots.append(np.array(slots, dtype=np.int32))
+            parts_tf.append(np.array(tf, dtype=np.float32))
+        term_ids = np.concatenate(parts_terms)
+        slots = np.concatenate(parts_slots)
+        tf = np.concatenate(parts_tf)
+        keep = self._alive[slots]
+        term_ids, slots, tf = term_ids[keep], slots[keep], tf[keep]
+
+        # Đánh số lại các dòng còn lại theo thứ tự cũ; dòng của phần thay đổi luôn lớn hơn dòng của file chính
+        # nên sắp xếp ổn định theo từ giữ posting list của mỗi từ tăng dần theo dòng
+        alive_slots = np.flatnonzero(self._alive[:self._size])
+        remap = np.full(self._size, -1, dtype=np.int32)
+        remap[alive_slots] = np.arange(len(alive_slots), dtype=np.int32)
+        order = np.argsort(term_ids, kind="stable")
+        term_ids, slots, tf = term_ids[order], remap[slots[order]], tf[order]
+        counts = np.bincount(term_ids, minlength=len(terms))
+        used = counts > 0
+
+        self._terms = {term: i for i, term in enumerate(t for t, u in zip(terms, used) if u)}
+        self._offsets = np.concatenate([[0], np.cumsum(counts[used])]).astype(np.int64)
+        self._post_slots, self._post_tf = slots, tf
+        self._slot_ids = [self._slot_ids[slot] for slot in alive_slots]
+        self._slots = {doc_id: slot for slot, doc_id in enumerate(self._slot_ids)}
+        self._doc_len = self._doc_len[alive_slots]
+        self._alive = np.ones(len(alive_slots), dtype=bool)
+        self._size = len(alive_slots)
+        self._delta = {}
+        self._journal_docs = 0
+        self._needs_compaction = False
+
+    def save(self, compact=False):
+        """
+        Lưu các thay đổi: ghi thêm vào nhật ký, hoặc ghi lại file chính khi nhật ký đã lớn
+
+        Args:
+            compact: Luôn ghi lại file chính và xóa nhật ký (ví dụ trước khi đóng gói snapshot)
+        """
+        with self._save_lock:
+            with self._lock:
+                ops, self._pending = self._pending, []
+                self._journal_docs += len(ops)
+                if compact or self._wants_compaction():
+                    self._compact()
+                    base = (list(self._terms), self._offsets, self._post_slots, self._post_tf, self._doc_len,
+                            [[doc_id, *self._docs[doc_id]] for doc_id in self._slot_ids])
+                else:
+                    base = None
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if base is not None:
+                self._write_base(*base)
+            elif ops:
+                with gzip.open(self.journal_path, "at", encoding="utf-8", compresslevel=3) as f:
+                    f.write("".join(json.dumps(op, ensure_ascii=False) + "\n" for op in ops))
+
+    def _write_base(self, terms, offsets, slots, tf, doc_len, docs):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, offsets=offsets, slots=slots, tf=tf, doc_len=doc_len,
+                     terms=_blob("\n".join(terms).encode("utf-8")),
+                     docs=_blob(json.dumps(docs, ensure_ascii=False).encode("utf-8")))
+        os.replace(tmp_path, self.path)
+        # File chính đã chứa mọi thay đổi; nếu bị ngắt trước khi xóa nhật ký, đọc lại nhật ký vẫn cho cùng kết quả
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
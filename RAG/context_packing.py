@@ -0,0 +1,195 @@
+"""
+Lắp ráp context cho prompt: đa dạng hóa bằng MMR, gộp các chunk chồng lấn và đóng gói theo ngân sách token
+"""
+import os
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+
+# Bảng mã tokenizer của tiktoken dùng để đếm token, đặt RAG_TOKENIZER=none để chỉ dùng ước lượng
+TOKENIZER = os.getenv("RAG_TOKENIZER", "cl100k_base")
+
+# Tên bảng mã -> (tokenizer, lỗi khi tải); mỗi bảng mã chỉ được tải (hoặc thử tải) một lần
+_tokenizers = {}
+_tokenizers_lock = threading.Lock()
+
+
+def _load_tokenizer(name):
+    """Tải tokenizer của tiktoken (cần tải bảng mã về lần đầu), trả về (tokenizer, lỗi)"""
+    if not name or name.lower() == "none":
+        return None, None
+    loaded = _tokenizers.get(name)
+    if loaded is not None:
+        return loaded
+    with _tokenizers_lock:
+        if name not in _tokenizers:
+            try:
+                import tiktoken
+                _tokenizers[name] = (tiktoken.get_encoding(name), None)
+            except Exception as e:
+                print(f"Không tải được tokenizer {name}, đếm token theo ước lượng 4 ký tự/token: {e}")
+                _tokenizers[name] = (None, e)
+        return _tokenizers[name]
+
+
+def tokenizer_name():
+    """Tên tokenizer được cấu hình để đếm token, "estimate" nếu chỉ ước lượng"""
+    return TOKENIZER if TOKENIZER and TOKENIZER.lower() != "none" else "estimate"
+
+
+def require_tokenizer():
+    """
+    Đảm bảo tokenizer được cấu hình dùng được. Dùng khi kết quả đếm token được lưu lại (ranh giới chunk):
+    ước lượng thay cho tokenizer sẽ chia tài liệu khác đi mà vẫn mang cùng cấu hình.
+
+    Raises:
+        RuntimeError: Không tải được tokenizer
+    """
+    _, error = _load_tokenizer(TOKENIZER)
+    if error is not None:
+        raise RuntimeError(f"Không tải được tokenizer {TOKENIZER} để chia chunk. Cho phép tải bảng mã của tiktoken "
+                           f"(hoặc đặt sẵn trong TIKTOKEN_CACHE_DIR), hoặc đặt RAG_TOKENIZER=none để đếm token "
+                           f"theo ước lượng (các file sẽ được chia lại)") from error
+
+
+def estimate_tokens(text):
+    """Số token của văn bản theo tokenizer của tiktoken, hoặc ước lượng khoảng 4 ký tự mỗi token"""
+    encoding, _ = _load_tokenizer(TOKENIZER)
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return max(1, len(encoding.encode(text, disallowed_special=())))
+
+
+def mmr_order(query_vector, doc_vectors, lambda_mult=0.5):
+    """
+    Sắp xếp toàn bộ ứng viên theo Maximal Marginal Relevance
+
+    Args:
+        query_vector: Vector của câu hỏi
+        doc_vectors: Ma trận vector của các ứng viên (n x d)
+        lambda_mult: 1.0 chỉ xét độ liên quan, 0.0 chỉ xét độ đa dạng
+
+    Returns:
+        Danh sách chỉ số ứng viên theo thứ tự được chọn
+    """
+    doc_vectors = np.asarray(doc_vectors, dtype=np.float32)
+    if len(doc_vectors) == 0:
+        return []
+    query = np.asarray(query_vector, dtype=np.float32)
+    doc_vectors = doc_vectors / (np.linalg.norm(doc_vectors, axis=1, keepdims=True) + 1e-12)
+    query = query / (np.linalg.norm(query) + 1e-12)
+
+    relevance = doc_vectors @ query
+    pairwise = doc_vectors @ doc_vectors.T
+    selected = [int(np.argmax(relevance))]
+    remaining = set(range(len(doc_vectors))) - set(selected)
+    while remaining:
+        candidates = np.fromiter(remaining, dtype=np.int64)
+        redundancy = pairwise[candidates][:, selected].max(axis=1)
+        scores = lambda_mult * relevance[candidates] - (1 - lambda_mult) * redundancy
+        best = int(candidates[np.argmax(scores)])
+        selected.append(best)
+        remaining.discard(best)
+    return selected
+
+
+def _span(doc):
+    start = doc.metadata.get("start_index")
+    if start is None:
+        return None
+    return start, start + len(doc.page_content)
+
+
+def merge_adjacent(docs):
+    """
+    Gộp các chunk liền kề hoặc chồng lấn của cùng một nguồn thành một đoạn,
+    bỏ các chunk trùng nội dung. Giữ thứ tự của chunk xuất hiện đầu tiên.
+    """
+    merged = _merge_once(docs)
+    # Một chunk có thể nối hai đoạn đã gộp trước đó, lặp lại cho đến khi không gộp thêm được
+    while True:
+        again = _merge_once(merged)
+        if len(again) == len(merged):
+            return again
+        merged = again
+
+
+def _merge_once(docs):
+    merged = []
+    seen_texts = set()
+    for doc in docs:
+        if doc.page_content in seen_texts:
+            continue
+        seen_texts.add(doc.page_content)
+
+        span = _span(doc)
+        target = None
+        if span is not None:
+            source = doc.metadata.get("source")
+            for i, other in enumerate(merged):
+                other_span = _span(other)
+                if (other_span is not None and other.metadata.get("source") == source
+                        and span[0] <= other_span[1] and other_span[0] <= span[1]):
+                    target = i
+                    break
+        if target is None:
+            merged.append(doc)
+            continue
+
+        # Nối hai đoạn, bỏ phần chồng lấn
+        other = merged[target]
+        first, second = (other, doc) if _span(other)[0] <= span[0] else (doc, other)
+        first_span, second_span = _span(first), _span(second)
+        overlap = first_span[1] - second_span[0]
+        text = first.page_content + second.page_content[overlap:] if second_span[1] > first_span[1] \
+            else first.page_content
+        metadata = dict(first.metadata)
+        metadata["start_index"] = first_span[0]
+        merged[target] = Document(page_content=text, metadata=metadata)
+    return merged
+
+
+class ContextPacker:
+    def __init__(self, embeddings, token_budget=1200, lambda_mult=0.5, count_tokens=estimate_tokens):
+        """
+        Chọn và đóng gói các chunk vào context sao cho không vượt ngân sách token
+
+        Args:
+            embeddings: Embedding model (nên là CachedEmbeddings để vector của chunk được dùng lại)
+            token_budget: Số token tối đa của phần context trong prompt
+            lambda_mult: Hệ số MMR giữa độ liên quan và độ đa dạng
+            count_tokens: Hàm đếm token của một đoạn văn bản
+        """
+        self.embeddings = embeddings
+        self.token_budget = token_budget
+        self.lambda_mult = lambda_mult
+        self.count_tokens = count_tokens
+
+    def pack(self, question, candidates, question_vector=None):
+        """
+        Lắp ráp context từ tập ứng viên
+
+        Args:
+            question: Câu hỏi
+            candidates: Các chunk ứng viên (tập rộng hơn số chunk cần dùng)
+            question_vector: Vector câu hỏi nếu đã có sẵn
+
+        Returns:
+            Danh sách Document đã gộp, tổng số token không vượt token_budget
+        """
+        if not candidates:
+            return []
+        if question_vector is None:
+            question_vector = self.embeddings.embed_query(question)
+        doc_vectors = self.embeddings.embed_documents([doc.page_content for doc in candidates])
+        ranked = [candidates[i] for i in mmr_order(question_vector, doc_vectors, self.lambda_mult)]
+
+        # Thêm lần lượt theo thứ tự MMR, bỏ qua chunk làm vượt ngân sách
+        selected = []
+        for doc in ranked:
+            attempt = merge_adjacent(selected + [doc])
+            if sum(self.count_tokens(d.page_content) for d in attempt) <= self.token_budget:
+                selected = attempt
+        # Luôn giữ ít nhất chunk liên quan nhất, kể cả khi nó lớn hơn ngân sách
+        return selected or ranked[:1]
@@ -0,0 +1,211 @@
+"""
+Metadata có cấu trúc gắn vào chunk khi nạp (thư mục nguồn, loại tài liệu, tên miền crawl, ngày nạp)
+và bộ lọc metadata khi truy vấn (cú pháp "where" của Chroma, dùng chung cho mọi vector store)
+"""
+import os
+import re
+import time
+from datetime import date
+from urllib.parse import urlparse
+
+# Các trường metadata dùng để lọc và chia shard
+FILTER_KEYS = ("source_dir", "doc_type", "crawl_domain", "ingest_date")
+
+_DOC_TYPES = {"markdown": "md", "htm": "html", "text": "txt"}
+_FIELD_OPERATORS = ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin")
+_FRONT_MATTER = re.compile(r"\A---\s*\n(.*?)\n---\s*\n", re.DOTALL)
+
+
+def front_matter_length(text):
+    """Độ dài phần front matter ở đầu file (0 nếu không có)"""
+    match = _FRONT_MATTER.match(text)
+    return match.end() if match else 0
+
+
+def read_front_matter(text):
+    """Đọc các dòng "key: value" trong front matter ở đầu file markdown (file do crawler ghi ra)"""
+    match = _FRONT_MATTER.match(text)
+    if not match:
+        return {}
+    fields = {}
+    for line in match.group(1).splitlines():
+        key, sep, value = line.partition(":")
+        if sep and key.strip():
+            fields[key.strip()] = value.strip().strip('"')
+    return fields
+
+
+def ingest_day(timestamp=None):
+    """Ngày nạp dạng số nguyên YYYYMMDD (Chroma chỉ so sánh lớn/nhỏ được với số)"""
+    return int(time.strftime("%Y%m%d", time.localtime(timestamp)))
+
+
+def document_metadata(file_path, text="", ingest_date=None):
+    """
+    Metadata có cấu trúc của một file
+
+    Args:
+        file_path: Đường dẫn file
+        text: Nội dung file (để đọc source_url trong front matter của trang đã crawl)
+        ingest_date: Ngày nạp YYYYMMDD, None để dùng ngày hiện tại
+
+    Returns:
+        Dict gồm source_dir, doc_type, crawl_domain ("" nếu không phải trang crawl), ingest_date
+        và source_url nếu có
+    """
+    extension = os.path.splitext(file_path)[1].lower().lstrip(".")
+    metadata = {
+        "source_dir": os.path.dirname(os.path.abspath(file_path)),
+        "doc_type": _DOC_TYPES.get(extension, extension or "unknown"),
+        "crawl_domain": "",
+        "ingest_date": ingest_date or ingest_day()
+    }
+    source_url = read_front_matter(text).get("source_url")
+    if source_url:
+        host = (urlparse(source_url).hostname or "").lower()
+        metadata["crawl_domain"] = host[4:] if host.startswith("www.") else host
+        metadata["source_url"] = source_url
+    return metadata
+
+
+def _normalize_value(key, value):
+    if key == "source_dir" and isinstance(value, str):
+        return os.path.abspath(value)
+    if key == "ingest_date" and isinstance(value, str):
+        # Nhận "2024-05-01" hoặc "20240501"
+        try:
+            return int(date.fromisoformat(value).strftime("%Y%m%d")) if "-" in value else int(value)
+        except ValueError:
+            raise ValueError(f"ingest_date không hợp lệ: {value} (dùng dạng YYYY-MM-DD)")
+    if key == "crawl_domain" and isinstance(value, str):
+        value = value.lower()
+        return value[4:] if value.startswith("www.") else value
+    return value
+
+
+def _normalize_condition(key, condition):
+    if isinstance(condition, list):
+        condition = {"$in": condition}
+    elif not isinstance(condition, dict):
+        condition = {"$eq": condition}
+    if len(condition) != 1:
+        raise ValueError(f"Điều kiện của {key} phải có đúng một toán tử")
+    operator, value = next(iter(condition.items()))
+    if operator not in _FIELD_OPERATORS:
+        raise ValueError(f"Toán tử không hỗ trợ: {operator}")
+    if operator in ("$in", "$nin"):
+        if not isinstance(value, list) or not value:
+            raise ValueError(f"{operator} cần danh sách giá trị không rỗng")
+        value = [_normalize_value(key, item) for item in value]
+    else:
+        value = _normalize_value(key, value)
+    return {key: {operator: value}}
+
+
+def normalize_filter(filter):
+    """
+    Chuẩn hóa bộ lọc metadata về cú pháp "where" của Chroma
+
+    Chấp nhận dạng rút gọn: {"doc_type": "md"}, {"crawl_domain": ["a.vn", "b.vn"]},
+    {"ingest_date": {"$gte": "2024-05-01"}}, nhiều khóa được ghép bằng $and;
+    cũng nhận sẵn $and/$or lồng nhau.
+
+    Returns:
+        Dict "where" (mỗi mức chỉ một khóa), None nếu không lọc
+
+    Raises:
+        ValueError: Bộ lọc không hợp lệ
+    """
+    if not filter:
+        return None
+    if not isinstance(filter, dict):
+        raise ValueError("Bộ lọc phải là một object")
+    clauses = []
+    for key, condition in filter.items():
+        if key in ("$and", "$or"):
+            if not isinstance(condition, list) or not condition:
+                raise ValueError(f"{key} cần danh sách điều kiện không rỗng")
+            parts = [normalize_filter(part) for part in condition]
+            parts = [part for part in parts if part]
+            if parts:
+                clauses.append(parts[0] if len(parts) == 1 else {key: parts})
+        elif key.startswith("$"):
+            raise ValueError(f"Toán tử không hỗ trợ: {key}")
+        else:
+            clauses.append(_normalize_condition(key, condition))
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def _compare(operator, actual, expected):
+    if operator == "$eq":
+        return actual == expected
+    if operator == "$ne":
+        return actual != expected
+    if operator == "$in":
+        return actual in expected
+    if operator == "$nin":
+        return actual not in expected
+    if actual is None:
+        return False
+    try:
+        if operator == "$gt":
+            return actual > expected
+        if operator == "$gte":
+            return actual >= expected
+        if operator == "$lt":
+            return actual < expected
+        return actual <= expected
+    except TypeError:
+        return False
+
+
+def metadata_matches(metadata, where):
+    """Metadata có thỏa bộ lọc đã chuẩn hóa hay không (dùng cho BM25 và chọn shard)"""
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(metadata_matches(metadata, part) for part in condition):
+                return False
+        elif key == "$or":
+            if not any(metadata_matches(metadata, part) for part in condition):
+                return False
+        else:
+            operator, expected = next(iter(condition.items()))
+            if not _compare(operator, (metadata or {}).get(key), expected):
+                return False
+    return True
+
+
+def allowed_values(where, key):
+    """
+    Tập giá trị của key mà bộ lọc cho phép (để bỏ qua các shard không liên quan),
+    None nếu bộ lọc không giới hạn key
+    """
+    if not where:
+        return None
+    if key in where:
+        operator, expected = next(iter(where[key].items()))
+        if operator == "$eq":
+            return {expected}
+        if operator == "$in":
+            return set(expected)
+        return None
+    if "$and" in where:
+        result = None
+        for part in where["$and"]:
+            values = allowed_values(part, key)
+            if values is not None:
+                result = values if result is None else result & values
+        return result
+    if "$or" in where:
+        result = set()
+        for part in where["$or"]:
+            values = allowed_values(part, key)
+            if values is None:
+                return None
+            result |= values
+        return result
+    return None
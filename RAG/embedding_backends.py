@@ -0,0 +1,247 @@
+"""
+Các backend embedding: Gemini (qua API), embedding băm đặc trưng (hashing) chạy cục bộ trên CPU
+và model sentence-transformers đọc từ thư mục trên đĩa. Index ghi lại backend, model và số chiều
+đã tạo ra nó để không bị mở bằng một embedding khác (kết quả tìm kiếm sẽ sai mà không báo lỗi).
+
+Ví dụ đo tốc độ embedding cục bộ:
+    python embedding_backends.py ../Craw4AI/output --dimension 768
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+import zlib
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_BACKENDS = ("gemini", "hashing", "sentence-transformers")
+GEMINI_EMBEDDING_MODEL = "models/embedding-001"
+
+_TOKEN = re.compile(r"\w+")
+
+
+def embedding_info_path_for(persist_directory):
+    """Đường dẫn file ghi backend và số chiều embedding của index, nằm cạnh thư mục persist_directory"""
+    return os.path.normpath(persist_directory) + "_embedding.json"
+
+
+def load_embedding_info(path):
+    """Đọc thông tin embedding của index, None nếu chưa có"""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_embedding_info(path, info):
+    """Ghi thông tin embedding của index (ghi file tạm rồi đổi tên)"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(info, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def describe_embedding(info):
+    dimension = f", {info['dimension']} chiều" if info.get("dimension") else ""
+    return f"{info.get('backend')} ({info.get('model')}{dimension})"
+
+
+def check_embedding_info(recorded, current, source="Index"):
+    """
+    So sánh embedding đã tạo ra index (hoặc snapshot) với embedding đang dùng
+
+    Raises:
+        ValueError: Khác backend, khác model hoặc khác số chiều
+    """
+    same = recorded.get("backend") == current.get("backend") and recorded.get("model") == current.get("model")
+    if same and recorded.get("dimension") and current.get("dimension"):
+        same = recorded["dimension"] == current["dimension"]
+    if not same:
+        raise ValueError(f"{source} được tạo bằng embedding {describe_embedding(recorded)}, "
+                         f"chatbot đang dùng {describe_embedding(current)}. "
+                         f"Hãy dùng đúng embedding hoặc reset database rồi tải lại tài liệu")
+
+
+def _mix(hashes):
+    """Trộn bit của hash 32-bit (bước cuối của MurmurHash3) để bit dấu và ô của vector phân bố đều"""
+    hashes = hashes ^ (hashes >> 16)
+    hashes = (hashes * 0x85EBCA6B) & 0xFFFFFFFF
+    hashes = hashes ^ (hashes >> 13)
+    hashes = (hashes * 0xC2B2AE35) & 0xFFFFFFFF
+    return hashes ^ (hashes >> 16)
+
+
+def _hash_texts(texts, dimension, ngrams):
+    """
+    Băm các n-gram từ của từng văn bản vào vector dimension chiều. Mỗi từ khác nhau chỉ được băm một lần;
+    hash của n-gram được tính từ hash của các từ bằng phép toán trên mảng numpy.
+
+    Returns:
+        Ma trận float32 (len(texts) x dimension), mỗi dòng có chuẩn L2 bằng 1 (hoặc bằng 0 nếu văn bản rỗng)
+    """
+    tokens, lengths = [], []
+    for text in texts:
+        found = _TOKEN.findall(unicodedata.normalize("NFC", text).lower())
+        tokens.extend(found)
+        lengths.append(len(found))
+    if not tokens:
+        return np.zeros((len(texts), dimension), dtype=np.float32)
+
+    vocabulary = {}
+    ids = np.fromiter((vocabulary.setdefault(token, len(vocabulary)) for token in tokens),
+                      dtype=np.int64, count=len(tokens))
+    word_hashes = np.fromiter((zlib.crc32(token.encode("utf-8")) for token in vocabulary),
+                              dtype=np.uint64, count=len(vocabulary))
+    hashes = word_hashes[ids]
+    rows = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+
+    feature_hashes, feature_rows = [hashes], [rows]
+    gram = hashes
+    for n in range(2, ngrams + 1):
+        # n-gram bắt đầu tại vị trí i = (n-1)-gram tại i nối với từ thứ i+n-1, không vượt qua ranh giới văn bản
+        gram = (gram[:-1] * 0x01000193 + hashes[n - 1:]) & 0xFFFFFFFF
+        same_text = rows[:len(gram)] == rows[n - 1:]
+        feature_hashes.append(gram[same_text])
+        feature_rows.append(rows[:len(gram)][same_text])
+    hashes = _mix(np.concatenate(feature_hashes))
+
+    # Bit cao nhất của hash chọn dấu để các đặc trưng trùng ô triệt tiêu nhau thay vì cộng dồn
+    signs = np.where(hashes >> 31, -1.0, 1.0)
+    cells = np.concatenate(feature_rows) * dimension + (hashes % dimension).astype(np.int64)
+    matrix = np.bincount(cells, weights=signs, minlength=len(texts) * dimension).reshape(len(texts), dimension)
+    # Tần suất dạng log (sublinear tf) để từ lặp nhiều lần không át các từ khác
+    matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return (matrix / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+class HashingEmbeddings(Embeddings):
+    def __init__(self, dimension=768, ngrams=2):
+        """
+        Embedding cục bộ không cần tải model: các từ và cặp từ liền nhau được băm (feature hashing)
+        vào vector cố định số chiều. Không có IDF nên vector của một chunk không đổi khi thêm tài liệu.
+        Cả lô được tính trong process hiện tại bằng numpy (không fork process từ server đang chạy nhiều thread).
+
+        Args:
+            dimension: Số chiều của vector
+            ngrams: Độ dài n-gram từ lớn nhất (2: từ đơn và cặp từ)
+        """
+        self.dimension = dimension
+        self.ngrams = max(1, ngrams)
+        self.model = f"hashing-v2-{dimension}d-{self.ngrams}gram"
+
+    def embed_array(self, texts):
+        """Embedding danh sách văn bản, trả về ma trận float32"""
+        return _hash_texts(list(texts), self.dimension, self.ngrams)
+
+    def embed_documents(self, texts):
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text):
+        return self.embed_array([text])[0].tolist()
+
+    def embed_queries(self, texts):
+        return self.embed_documents(texts)
+
+
+class SentenceTransformerEmbeddings(Embeddings):
+    def __init__(self, model_path, batch_size=64, device="cpu", threads=None):
+        """
+        Embedding cục bộ bằng model sentence-transformers đã có sẵn trên đĩa (không tải từ mạng)
+
+        Args:
+            model_path: Thư mục chứa model
+            batch_size: Số văn bản mỗi lần chạy model
+            device: Thiết bị chạy model ("cpu", "cuda"...)
+            threads: Số luồng tính toán của torch trên CPU, None để giữ mặc định (số lõi CPU)
+        """
+        if not os.path.isdir(model_path):
+            raise ValueError(f"Không tìm thấy thư mục model sentence-transformers: {model_path}")
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError("Backend sentence-transformers cần cài gói sentence-transformers") from e
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        self._model = SentenceTransformer(model_path, device=device, local_files_only=True)
+        self.batch_size = batch_size
+        self.dimension = self._model.get_sentence_embedding_dimension()
+        self.model = f"sentence-transformers/{os.path.basename(os.path.normpath(model_path))}"
+        # Model dùng chung: mỗi lần chỉ một lô chạy, lô đó dùng hết các luồng của torch
+        self._lock = threading.Lock()
+
+    def embed_array(self, texts):
+        with self._lock:
+            vectors = self._model.encode(list(texts), batch_size=self.batch_size, convert_to_numpy=True,
+                                         normalize_embeddings=True, show_progress_bar=False)
+        return vectors.astype(np.float32, copy=False)
+
+    def embed_documents(self, texts):
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text):
+        return self.embed_array([text])[0].tolist()
+
+    def embed_queries(self, texts):
+        return self.embed_documents(texts)
+
+
+def make_embeddings(name=None, model=None, dimension=None, workers=None):
+    """
+    Tạo embedding model theo tên backend, mặc định đọc từ biến môi trường RAG_EMBEDDING_BACKEND
+
+    Args:
+        name: "gemini", "hashing" hoặc "sentence-transformers"
+        model: Tên model Gemini, hoặc thư mục model với backend sentence-transformers
+        dimension: Số chiều của backend hashing
+        workers: Số luồng torch của backend sentence-transformers
+
+    Returns:
+        Embedding model, có thuộc tính model (tên model) và dimension (None nếu chỉ biết sau lần gọi đầu tiên)
+    """
+    name = (name or os.getenv("RAG_EMBEDDING_BACKEND", "gemini")).lower()
+    if name == "gemini":
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        return GoogleGenerativeAIEmbeddings(model=model or GEMINI_EMBEDDING_MODEL)
+    if name == "hashing":
+        return HashingEmbeddings(dimension=dimension or 768)
+    if name == "sentence-transformers":
+        if not model:
+            raise ValueError("Backend sentence-transformers cần đường dẫn thư mục model")
+        return SentenceTransformerEmbeddings(model, threads=workers)
+    raise ValueError(f"Backend embedding không hợp lệ: {name} (chỉ hỗ trợ {', '.join(EMBEDDING_BACKENDS)})")
+
+
+if __name__ == "__main__":
+    from markdown_chunker import MarkdownChunker, _iter_files
+
+    parser = argparse.ArgumentParser(description="Đo tốc độ embedding cục bộ trên các chunk của tài liệu")
+    parser.add_argument("paths", nargs="+", help="File hoặc thư mục tài liệu")
+    parser.add_argument("--backend", default="hashing", choices=["hashing", "sentence-transformers"])
+    parser.add_argument("--model", help="Thư mục model sentence-transformers")
+    parser.add_argument("--dimension", type=int, default=768)
+    parser.add_argument("--workers", type=int, default=None, help="Số luồng torch (sentence-transformers)")
+    parser.add_argument("--batch-size", type=int, default=1024, help="Số chunk mỗi lần gọi embedding")
+    args = parser.parse_args()
+
+    chunker = MarkdownChunker()
+    chunks = []
+    for file_path in _iter_files(args.paths):
+        with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+            chunks.extend(chunker.split_text(f.read()))
+    embeddings = make_embeddings(args.backend, args.model, args.dimension, args.workers)
+    embeddings.embed_array(chunks[:args.batch_size])  # khởi động process / nạp model
+    start = time.perf_counter()
+    for offset in range(0, len(chunks), args.batch_size):
+        embeddings.embed_array(chunks[offset:offset + args.batch_size])
+    seconds = time.perf_counter() - start
+    print(f"{embeddings.model}: {len(chunks)} chunks trong {seconds:.2f}s "
+          f"({len(chunks) / max(seconds, 1e-9):.0f} chunks/s)")
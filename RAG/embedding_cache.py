@@ -0,0 +1,212 @@
+"""
+Cache embedding trên đĩa (SQLite) bọc quanh một embedding model bất kỳ
+"""
+import hashlib
+import inspect
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+
+def embedding_cache_path_for(persist_directory):
+    """Đường dẫn file cache nằm cạnh (không nằm trong) thư mục persist_directory,
+    để việc xóa và tạo lại vector database không làm mất cache"""
+    return os.path.normpath(persist_directory) + "_embedding_cache.sqlite3"
+
+
+class CachedEmbeddings(Embeddings):
+    # Số lượng tham số tối đa trong một câu lệnh SQLite
+    _SQL_BATCH = 500
+
+    def __init__(self, embeddings, cache_path, model_name, max_entries=200000):
+        """
+        Bọc embedding model với cache trên đĩa, khóa theo (model, loại, sha256 của văn bản)
+
+        Args:
+            embeddings: Embedding model gốc (ví dụ GoogleGenerativeAIEmbeddings)
+            cache_path: Đường dẫn file SQLite lưu cache, None để không dùng cache (model cục bộ
+                        tính vector nhanh hơn tra cứu SQLite)
+            model_name: Tên model embedding, là một phần của khóa cache
+            max_entries: Số vector tối đa được giữ lại, vượt quá sẽ xóa theo LRU
+        """
+        self.embeddings = embeddings
+        self.cache_path = cache_path
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._count = 0
+        self._conn = None
+        if cache_path is None:
+            return
+
+        directory = os.path.dirname(cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _key(self, text, kind):
+        # Vector của câu hỏi và của tài liệu có thể khác nhau (task type khác nhau) nên tách riêng
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{self.model_name}:{kind}:{digest}"
+
+    @staticmethod
+    def _encode(vector):
+        return array("f", vector).tobytes()
+
+    @staticmethod
+    def _decode(blob):
+        vector = array("f")
+        vector.frombytes(blob)
+        return vector.tolist()
+
+    def _lookup(self, keys):
+        """Tra cứu nhiều khóa cùng lúc, cập nhật thời điểm truy cập cho các khóa tìm thấy"""
+        found = {}
+        if self._conn is None:
+            return found
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(keys), self._SQL_BATCH):
+                batch = keys[start:start + self._SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                found.update((key, self._decode(blob)) for key, blob in rows)
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+        return found
+
+    def _store(self, items):
+        """Lưu các cặp (khóa, vector) và xóa bớt các vector ít dùng nhất nếu vượt giới hạn"""
+        if self._conn is None:
+            return
+        now = time.time()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                [(key, self._encode(vector), now) for key, vector in items]
+            )
+            self._count += self._conn.total_changes - before
+            if self._count > self.max_entries:
+                # Xóa thêm 10% để không phải dọn dẹp sau mỗi lần ghi
+                excess = self._count - int(self.max_entries * 0.9)
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_access LIMIT ?)",
+                    (excess,)
+                )
+                self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            self._conn.commit()
+
+    def embed_documents(self, texts):
+        """Embedding danh sách văn bản, chỉ gọi model gốc cho những văn bản chưa có trong cache"""
+        keys = [self._key(text, "document") for text in texts]
+        cached = self._lookup(list(set(keys)))
+
+        # Gom các văn bản chưa có trong cache (bỏ trùng lặp) để gọi model một lần
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        with self._lock:
+            self.hits += len(texts) - sum(1 for key in keys if key not in cached)
+            self.misses += sum(1 for key in keys if key not in cached)
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            self._store(new_items)
+            cached.update(new_items)
+
+        return [list(cached[key]) for key in keys]
+
+    def embed_query(self, text):
+        """Embedding câu hỏi, dùng lại kết quả nếu câu hỏi đã được hỏi trước đó"""
+        key = self._key(text, "query")
+        cached = self._lookup([key])
+        if key in cached:
+            with self._lock:
+                self.hits += 1
+            return cached[key]
+
+        with self._lock:
+            self.misses += 1
+        vector = self.embeddings.embed_query(text)
+        self._store([(key, vector)])
+        return list(vector)
+
+    def embed_queries(self, texts):
+        """Embedding nhiều câu hỏi: tra cache một lần, các câu hỏi chưa có được gửi trong một request"""
+        keys = [self._key(text, "query") for text in texts]
+        cached = self._lookup(list(set(keys)))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        with self._lock:
+            self.hits += len(texts) - sum(1 for key in keys if key not in cached)
+            self.misses += sum(1 for key in keys if key not in cached)
+
+        if missing:
+            vectors = embed_query_batch(self.embeddings, list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            self._store(new_items)
+            cached.update(new_items)
+
+        return [list(cached[key]) for key in keys]
+
+    def stats(self):
+        """Thống kê hit/miss và số vector đang được lưu"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "entries": self._count,
+                "max_entries": self.max_entries
+            }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+
+
+def embed_query_batch(embeddings, texts):
+    """
+    Embedding nhiều câu hỏi bằng một request nếu model hỗ trợ: model có embed_queries, hoặc
+    embed_documents nhận task_type (Gemini). Nếu không, gọi embed_query song song.
+    """
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(texts)
+    if "task_type" in inspect.signature(embeddings.embed_documents).parameters:
+        task_type = getattr(embeddings, "task_type", None) or "RETRIEVAL_QUERY"
+        return embeddings.embed_documents(texts, task_type=task_type)
+    with ThreadPoolExecutor(max_workers=min(8, len(texts))) as executor:
+        return list(executor.map(embeddings.embed_query, texts))
@@ -1,29 +1,79 @@
-from dotenv import load_dotenv
-from google import genai
+"""
+Kiểm tra việc gọi Gemini API qua lớp giới hạn tần suất (gemini_client.py): gửi nhiều request
+embedding đồng thời (có cả request trùng nhau) và một câu hỏi tới LLM, sau đó in số lần gọi API,
+số lần retry, số lần bị 429 và số request được gộp.
+
+Giới hạn gọi API là quota của API key (xem trong Google AI Studio), không hỏi được từ model;
+đặt --rpm/--tpm theo quota đó.
+
+Ví dụ:
+    python embeding.py --rpm 15 --requests 30
+    python embeding.py --fake --error-rate 0.3 --latency-ms 200   # chạy với server giả lập, không cần mạng
+"""
+import argparse
 import os
-import google.generativeai as genai
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
+
+from gemini_client import GeminiClient, RateLimitedChatModel, RateLimitedEmbeddings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kiểm tra gọi Gemini API có giới hạn tần suất")
+    parser.add_argument("--rpm", type=int, help="Số request tối đa mỗi phút")
+    parser.add_argument("--tpm", type=int, help="Số token tối đa mỗi phút")
+    parser.add_argument("--requests", type=int, default=20, help="Số request embedding gửi đi")
+    parser.add_argument("--distinct", type=int, default=5, help="Số văn bản khác nhau trong các request")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-retries", type=int, default=5)
+    parser.add_argument("--model", default="gemini-1.5-pro-latest")
+    parser.add_argument("--fake", action="store_true", help="Dùng server giả lập (fake_gemini_server.py)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Xác suất server giả lập trả 429")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Độ trễ của server giả lập")
+    args = parser.parse_args()
 
+    # Tải các biến môi trường từ tệp .env
+    load_dotenv()
+    api_key = os.getenv("GOOGLE_API_KEY") or os.getenv("API_KEY") or "fake"
 
-# Tải các biến môi trường từ tệp .env
-load_dotenv()
+    embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key=api_key)
+    llm = ChatGoogleGenerativeAI(model=args.model, google_api_key=api_key)
+    if args.fake:
+        from fake_gemini_server import connect, start_server
+        server, _ = start_server(error_rate=args.error_rate, latency_ms=args.latency_ms)
+        endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+        connect(embeddings, endpoint)
+        connect(llm, endpoint)
+        print(f"Dùng server giả lập tại {endpoint}")
 
-# Truy cập vào biến môi trường
-API = os.getenv('API_KEY')
+    client = GeminiClient(requests_per_minute=args.rpm, tokens_per_minute=args.tpm, max_retries=args.max_retries)
+    embeddings = RateLimitedEmbeddings(embeddings, client)
+    llm = RateLimitedChatModel(llm=llm, client=client)
 
-genai.configure(api_key=API)
+    texts = [f"Văn bản thử nghiệm số {i % max(1, args.distinct)}" for i in range(args.requests)]
+    start = time.perf_counter()
+    errors = 0
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [executor.submit(embeddings.embed_query, text) for text in texts]
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                errors += 1
+                print(f"Lỗi embedding: {e}")
+    print(f"{len(texts)} request embedding trong {time.perf_counter() - start:.2f}s, {errors} lỗi")
 
-# Lấy danh sách model khả dụng
-# models = genai.list_models()
+    try:
+        print("LLM:", llm.invoke("Xin chào, hãy trả lời bằng một câu ngắn.").content)
+    except Exception as e:
+        print(f"Lỗi LLM: {e}")
 
-# # In danh sách model để kiểm tra
-# for model in models:
-model = genai.GenerativeModel("gemini-1.5-pro-latest")
+    for name, value in client.stats().items():
+        print(f"  {name}: {value}")
 
-def ask_gemini(question):
-    response = model.generate_content(question)
-    return response.text
 
-# Test hỏi đáp
-question = "cho tôi biết giới hạn call api của bạn là bao nhiêu?"
-answer = ask_gemini(question)
-print(answer)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Server giả lập REST API của Gemini (v1beta) để thử nghiệm giới hạn tần suất, retry và gộp request
+mà không cần mạng: trả lỗi 429 khi vượt giới hạn request/phút hoặc theo xác suất, có độ trễ cấu hình được.
+
+Trỏ model thật của langchain_google_genai vào server bằng connect():
+    embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001", google_api_key="fake")
+    connect(embeddings, "http://127.0.0.1:8998")
+
+Ví dụ:
+    python fake_gemini_server.py --port 8998 --rpm 60 --error-rate 0.1 --latency-ms 200
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeGeminiState:
+    def __init__(self, requests_per_minute=None, error_rate=0.0, latency_ms=0.0, dimension=768,
+                 answer="Đây là câu trả lời giả lập.", seed=0):
+        """
+        Cấu hình và bộ đếm của server giả lập
+
+        Args:
+            requests_per_minute: Số request tối đa trong 60 giây gần nhất, vượt quá trả 429 (None để không giới hạn)
+            error_rate: Xác suất trả 429 ngẫu nhiên cho mỗi request
+            latency_ms: Độ trễ trước khi trả lời
+            dimension: Số chiều của embedding trả về
+            answer: Câu trả lời của generateContent
+        """
+        self.requests_per_minute = requests_per_minute
+        self.error_rate = error_rate
+        self.latency_ms = latency_ms
+        self.dimension = dimension
+        self.answer = answer
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window = deque()
+        self.calls = {}
+        self.rate_limited = 0
+
+    def admit(self, method):
+        """Ghi nhận một request, trả về False nếu request bị từ chối (429)"""
+        now = time.monotonic()
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            while self._window and now - self._window[0] > 60:
+                self._window.popleft()
+            limited = (self.requests_per_minute is not None and len(self._window) >= self.requests_per_minute) \
+                or self._random.random() < self.error_rate
+            if limited:
+                self.rate_limited += 1
+                return False
+            self._window.append(now)
+            return True
+
+    def embedding(self, text):
+        """Vector giả lập tất định theo nội dung văn bản"""
+        values = []
+        counter = 0
+        while len(values) < self.dimension:
+            digest = hashlib.sha256(f"{counter}:{text}".encode("utf-8")).digest()
+            values.extend((byte - 127.5) / 127.5 for byte in digest)
+            counter += 1
+        return values[:self.dimension]
+
+    def stats(self):
+        with self._lock:
+            return {"calls": dict(self.calls), "rate_limited": self.rate_limited}
+
+
+def _text_of(content):
+    return "".join(part.get("text", "") for part in content.get("parts", []))
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.startswith("/stats"):
+                self._send(200, state.stats())
+            else:
+                self._send(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            path = self.path.split("?")[0]
+            method = path.rsplit(":", 1)[-1] if ":" in path else path
+
+            if method == "reset":
+                state.__init__(state.requests_per_minute, state.error_rate, state.latency_ms,
+                               state.dimension, state.answer)
+                self._send(200, {})
+                return
+            if state.latency_ms:
+                time.sleep(state.latency_ms / 1000)
+            if not state.admit(method):
+                self._send(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED",
+                                           "message": "Resource has been exhausted (e.g. check quota)."}})
+                return
+
+            if method == "batchEmbedContents":
+                self._send(200, {"embeddings": [{"values": state.embedding(_text_of(request.get("content", {})))}
+                                                for request in body.get("requests", [])]})
+            elif method == "embedContent":
+                self._send(200, {"embedding": {"values": state.embedding(_text_of(body.get("content", {})))}})
+            elif method in ("generateContent", "streamGenerateContent"):
+                prompt_chars = sum(len(_text_of(content)) for content in body.get("contents", []))
+                usage = {"promptTokenCount": prompt_chars // 4, "candidatesTokenCount": len(state.answer) // 4,
+                         "totalTokenCount": (prompt_chars + len(state.answer)) // 4}
+                if method == "generateContent":
+                    words = [state.answer]
+                else:
+                    words = [word + " " for word in state.answer.split(" ")]
+                    words[-1] = words[-1].rstrip()
+                chunks = [{"candidates": [{"content": {"role": "model", "parts": [{"text": word}]},
+                                           "finishReason": "STOP", "index": 0}],
+                           "usageMetadata": usage} for word in words]
+                # streamGenerateContent trả về một mảng JSON các phần của câu trả lời
+                self._send(200, chunks[0] if method == "generateContent" else chunks)
+            else:
+                self._send(404, {"error": {"code": 404, "message": f"Unknown method {method}", "status": "NOT_FOUND"}})
+
+    return Handler
+
+
+def connect(model, endpoint):
+    """
+    Cho GoogleGenerativeAIEmbeddings hoặc ChatGoogleGenerativeAI gửi request tới server giả lập qua REST
+    (GoogleGenerativeAIEmbeddings bỏ qua tham số transport nên phải thay client sau khi khởi tạo)
+    """
+    from langchain_google_genai._genai_extension import build_generative_service
+    model.client = build_generative_service(api_key="fake", client_options={"api_endpoint": endpoint},
+                                            transport="rest")
+    return model
+
+
+def start_server(port=0, **config):
+    """
+    Chạy server giả lập trong thread nền
+
+    Returns:
+        (server, state): server.server_address[1] là cổng đang nghe, server.shutdown() để dừng
+    """
+    state = FakeGeminiState(**config)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="fake-gemini", daemon=True)
+    thread.start()
+    return server, state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Server giả lập REST API của Gemini")
+    parser.add_argument("--port", type=int, default=8998)
+    parser.add_argument("--rpm", type=int, help="Giới hạn request mỗi phút")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Xác suất trả 429 ngẫu nhiên")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Độ trễ mỗi request")
+    parser.add_argument("--dimension", type=int, default=768)
+    args = parser.parse_args()
+
+    server, _ = start_server(args.port, requests_per_minute=args.rpm, error_rate=args.error_rate,
+                             latency_ms=args.latency_ms, dimension=args.dimension)
+    print(f"Server giả lập Gemini đang chạy tại http://127.0.0.1:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,345 @@
+"""
+Lớp gọi Gemini dùng chung cho embedding và chat model: giới hạn tần suất bằng token bucket
+(request/phút và token/phút), retry với backoff ngẫu nhiên khi gặp 429 hoặc lỗi tạm thời,
+và gộp các lời gọi giống hệt nhau đang chạy đồng thời thành một request (single-flight)
+"""
+import hashlib
+import itertools
+import json
+import math
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+from google.api_core import exceptions as google_exceptions
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+
+from context_packing import estimate_tokens
+from embedding_cache import embed_query_batch
+
+
+class RateLimitError(Exception):
+    """Vẫn bị giới hạn tần suất (429) sau khi đã retry hết số lần cho phép"""
+
+
+def _error_chain(exc):
+    """Lỗi và các lỗi gốc của nó (langchain bọc lỗi của Google API trong GoogleGenerativeAIError)"""
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        yield exc
+        exc = exc.__cause__
+
+
+def is_rate_limit_error(exc):
+    """Lỗi do vượt quota hoặc giới hạn tần suất của API"""
+    for error in _error_chain(exc):
+        if isinstance(error, (RateLimitError, google_exceptions.TooManyRequests,
+                              google_exceptions.ResourceExhausted)):
+            return True
+        text = str(error)
+        if "429" in text or "RESOURCE_EXHAUSTED" in text or "quota" in text.lower():
+            return True
+    return False
+
+
+def is_retryable_error(exc):
+    """Lỗi tạm thời nên thử lại: giới hạn tần suất, lỗi 5xx, timeout hoặc mất kết nối"""
+    if is_rate_limit_error(exc):
+        return True
+    return any(isinstance(error, (google_exceptions.ServerError, google_exceptions.DeadlineExceeded,
+                                  ConnectionError, TimeoutError))
+               for error in _error_chain(exc))
+
+
+class TokenBucket:
+    def __init__(self, per_minute, capacity=None):
+        """
+        Token bucket nạp đều per_minute token mỗi phút
+
+        Args:
+            per_minute: Tốc độ nạp (token mỗi phút)
+            capacity: Số token tối đa tích lũy được, mặc định bằng lượng nạp trong 6 giây: quota của API
+                      tính theo cửa sổ một phút nên bucket đầy cả phút sẽ cho phép gửi gấp đôi quota
+        """
+        self.rate = per_minute / 60.0
+        self.capacity = float(capacity or max(1.0, per_minute / 10))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount):
+        """
+        Đặt trước amount token, trả về số giây phải chờ trước khi được dùng
+
+        Số token được phép âm: người đặt sau chờ lâu hơn người đặt trước nên thứ tự
+        được giữ và không có luồng nào bị bỏ đói; request lớn hơn capacity chờ đủ lượng nạp tương ứng.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self.rate)
+
+    def adjust(self, amount):
+        """Trả lại (amount > 0) hoặc trừ thêm (amount < 0) token khi biết số token thực tế"""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        """
+        Giới hạn số request và số token gửi đi mỗi phút
+
+        Args:
+            requests_per_minute: Số request tối đa mỗi phút, None để không giới hạn
+            tokens_per_minute: Số token (ước lượng) tối đa mỗi phút, None để không giới hạn
+        """
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=0, requests=1):
+        """Chờ đến khi được phép gửi request, trả về số giây đã chờ"""
+        with self._lock:
+            wait = max(0.0, self._blocked_until - time.monotonic())
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(requests))
+        if self.tokens is not None and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def cooldown(self, seconds):
+        """Tạm dừng mọi request trong seconds giây (sau khi API trả 429)"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def adjust_tokens(self, amount):
+        if self.tokens is not None:
+            self.tokens.adjust(amount)
+
+
+class SingleFlight:
+    """Gộp các lời gọi cùng khóa đang chạy đồng thời: chỉ lời gọi đầu tiên thực sự chạy"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """
+        Returns:
+            (kết quả, shared): shared là True nếu dùng chung kết quả của một lời gọi đang chạy
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return result, False
+
+
+class GeminiClient:
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, max_retries=5,
+                 base_delay=1.0, max_delay=32.0):
+        """
+        Client dùng chung cho mọi lời gọi tới Gemini trong tiến trình
+
+        Args:
+            requests_per_minute: Số request tối đa mỗi phút, None để không giới hạn
+            tokens_per_minute: Số token tối đa mỗi phút, None để không giới hạn
+            max_retries: Số lần thử lại tối đa khi gặp lỗi tạm thời
+            base_delay: Thời gian chờ cơ sở của backoff (giây)
+            max_delay: Thời gian chờ tối đa giữa hai lần thử (giây)
+        """
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max(0, max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._flight = SingleFlight()
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "coalesced": 0, "retries": 0, "rate_limited": 0,
+                       "failures": 0, "throttled_seconds": 0.0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def backoff(self, attempt):
+        """Exponential backoff với full jitter: thời gian chờ ngẫu nhiên trong [0, base * 2^attempt]"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, fn, tokens=0, requests=1):
+        """
+        Gọi fn sau khi được bộ giới hạn cho phép, thử lại khi gặp lỗi tạm thời
+
+        Args:
+            fn: Hàm thực hiện request
+            tokens: Số token ước lượng của request
+            requests: Số request fn gửi đi
+
+        Raises:
+            RateLimitError: Vẫn bị 429 sau max_retries lần thử lại
+        """
+        for attempt in itertools.count():
+            self._count("throttled_seconds", self.limiter.acquire(tokens, requests))
+            self._count("calls")
+            try:
+                return fn()
+            except Exception as e:
+                rate_limited = is_rate_limit_error(e)
+                if rate_limited:
+                    self._count("rate_limited")
+                if attempt >= self.max_retries or not is_retryable_error(e):
+                    self._count("failures")
+                    if rate_limited and not isinstance(e, RateLimitError):
+                        raise RateLimitError(f"Vượt giới hạn tần suất của API sau {attempt + 1} lần thử: {e}") from e
+                    raise
+                self._count("retries")
+                delay = self.backoff(attempt)
+                if rate_limited:
+                    # Quota dùng chung: mọi luồng cùng tạm dừng thay vì tiếp tục gửi request bị từ chối
+                    self.limiter.cooldown(delay)
+                else:
+                    time.sleep(delay)
+
+    def coalesced(self, key, fn, tokens=0, requests=1):
+        """Như call, nhưng các lời gọi cùng key đang chạy đồng thời dùng chung một request"""
+        result, shared = self._flight.do(key, lambda: self.call(fn, tokens, requests))
+        if shared:
+            self._count("coalesced")
+        return result
+
+    def record_usage(self, reserved, actual):
+        """Điều chỉnh token bucket theo số token thực tế API báo về"""
+        if actual is not None:
+            self.limiter.adjust_tokens(reserved - actual)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["throttled_seconds"] = round(stats["throttled_seconds"], 3)
+        return stats
+
+
+def _key(kind, payload):
+    return hashlib.sha256(f"{kind}\x00{payload}".encode("utf-8")).hexdigest()
+
+
+class RateLimitedEmbeddings(Embeddings):
+    def __init__(self, embeddings, client, request_batch_size=100):
+        """
+        Bọc embedding model để mọi request đi qua GeminiClient
+
+        Args:
+            embeddings: Embedding model gốc
+            client: GeminiClient dùng chung
+            request_batch_size: Số văn bản tối đa trong một request của model gốc (Gemini: 100)
+        """
+        self.embeddings = embeddings
+        self.client = client
+        self.request_batch_size = request_batch_size
+        self.model = getattr(embeddings, "model", None)
+
+    def _call(self, kind, texts, fn):
+        tokens = sum(estimate_tokens(text) for text in texts)
+        requests = max(1, math.ceil(len(texts) / self.request_batch_size))
+        result = self.client.coalesced(_key(kind, "\x00".join(texts)), fn, tokens, requests)
+        # Các lời gọi được gộp nhận bản sao riêng của kết quả
+        return [list(vector) for vector in result] if kind != "query" else list(result)
+
+    def embed_documents(self, texts):
+        return self._call("documents", texts, lambda: self.embeddings.embed_documents(texts))
+
+    def embed_query(self, text):
+        return self._call("query", [text], lambda: self.embeddings.embed_query(text))
+
+    def embed_queries(self, texts):
+        return self._call("queries", texts, lambda: embed_query_batch(self.embeddings, texts))
+
+
+class RateLimitedChatModel(BaseChatModel):
+    """
+    Bọc chat model để mọi request đi qua GeminiClient. Lời gọi không luồng được gộp theo nội dung
+    prompt; lời gọi dạng luồng chỉ được thử lại trước khi nhận phần đầu tiên của câu trả lời.
+    """
+
+    llm: BaseChatModel
+    client: GeminiClient
+    expected_output_tokens: int = 256
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def _llm_type(self):
+        return f"rate-limited-{self.llm._llm_type}"
+
+    # Đếm token bằng model gốc (mặc định của BaseChatModel cần gói transformers để dùng tokenizer GPT-2);
+    # memory giới hạn theo token và memory tóm tắt gọi các hàm này
+    def get_num_tokens(self, text):
+        return self.llm.get_num_tokens(text)
+
+    def get_num_tokens_from_messages(self, messages):
+        return self.llm.get_num_tokens_from_messages(messages)
+
+    def get_token_ids(self, text):
+        return self.llm.get_token_ids(text)
+
+    def _tokens(self, messages):
+        return sum(estimate_tokens(str(message.content)) for message in messages) + self.expected_output_tokens
+
+    def _record_usage(self, reserved, message):
+        usage = getattr(message, "usage_metadata", None) or {}
+        self.client.record_usage(reserved, usage.get("total_tokens"))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._tokens(messages)
+        payload = json.dumps([[message.type, message.content] for message in messages]
+                             + [stop, sorted(kwargs.items())], ensure_ascii=False, default=str)
+        result = self.client.coalesced(_key("generate", payload),
+                                       lambda: self.llm._generate(messages, stop=stop, **kwargs), tokens)
+        if result.generations:
+            self._record_usage(tokens, result.generations[0].message)
+        return result
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        tokens = self._tokens(messages)
+
+        def open_stream():
+            # Lỗi quota xảy ra khi mở luồng: đọc phần đầu tiên trong lời gọi được retry
+            chunks = self.llm._stream(messages, stop=stop, **kwargs)
+            return next(chunks, None), chunks
+
+        first, chunks = self.client.call(open_stream, tokens)
+        if first is None:
+            return
+        last = first
+        for chunk in itertools.chain([first], chunks):
+            last = chunk
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+        self._record_usage(tokens, last.message)
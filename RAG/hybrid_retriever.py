@@ -0,0 +1,72 @@
+"""
+Retriever kết hợp tìm kiếm từ khóa (BM25) và tìm kiếm vector bằng Reciprocal Rank Fusion
+"""
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from doc_metadata import metadata_matches
+
+
+def _fusion_key(doc):
+    return doc.metadata.get("source"), doc.page_content
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Lấy fetch_k kết quả từ mỗi nguồn (vector và BM25), cộng điểm
+    weight / (rrf_k + thứ hạng) cho từng chunk rồi trả về k chunk có điểm cao nhất.
+    filter (cú pháp "where" của Chroma) giới hạn cả hai nguồn theo metadata.
+    """
+
+    vectorstore: Any
+    bm25: Any
+    k: int = 3
+    fetch_k: int = 10
+    vector_weight: float = 1.0
+    lexical_weight: float = 1.0
+    rrf_k: int = 60
+    filter: Optional[dict] = None
+
+    def _vector_results(self, query, fetch_k):
+        if self.filter:
+            return self.vectorstore.similarity_search(query, k=fetch_k, filter=self.filter)
+        return self.vectorstore.similarity_search(query, k=fetch_k)
+
+    def _lexical_results(self, query, fetch_k):
+        predicate = (lambda metadata: metadata_matches(metadata, self.filter)) if self.filter else None
+        docs = []
+        for doc_id, _ in self.bm25.search(query, k=fetch_k, predicate=predicate):
+            entry = self.bm25.get(doc_id)
+            if entry is not None:
+                text, metadata = entry
+                docs.append(Document(page_content=text, metadata=dict(metadata)))
+        return docs
+
+    def fuse(self, vector_docs, lexical_docs, k=None):
+        """Gộp hai danh sách kết quả bằng Reciprocal Rank Fusion có trọng số"""
+        scores = {}
+        documents = {}
+        for weight, docs in ((self.vector_weight, vector_docs), (self.lexical_weight, lexical_docs)):
+            if weight <= 0:
+                continue
+            for rank, doc in enumerate(docs):
+                key = _fusion_key(doc)
+                scores[key] = scores.get(key, 0.0) + weight / (self.rrf_k + rank + 1)
+                documents.setdefault(key, doc)
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        return [documents[key] for key in ranked[:k or self.k]]
+
+    def fuse_with_lexical(self, query, vector_docs):
+        """Gộp kết quả vector đã tìm sẵn (ví dụ khi tìm theo batch) với kết quả BM25 của câu hỏi"""
+        lexical_docs = self._lexical_results(query, self.fetch_k) if self.lexical_weight > 0 else []
+        return self.fuse(vector_docs if self.vector_weight > 0 else [], lexical_docs)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        vector_docs = self._vector_results(query, self.fetch_k) if self.vector_weight > 0 else []
+        lexical_docs = self._lexical_results(query, self.fetch_k) if self.lexical_weight > 0 else []
+        return self.fuse(vector_docs, lexical_docs)
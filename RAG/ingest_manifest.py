@@ -0,0 +1,148 @@
+"""
+Manifest lưu trạng thái các file đã nạp vào vector store (ingestion manifest)
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def file_sha256(file_path, block_size=1 << 20):
+    """Tính SHA-256 của nội dung file, đọc theo từng khối để không tốn bộ nhớ"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def manifest_path_for(persist_directory):
+    """Đường dẫn file manifest nằm cạnh thư mục persist_directory"""
+    return os.path.normpath(persist_directory) + "_manifest.json"
+
+
+class IngestManifest:
+    def __init__(self, path):
+        """
+        Manifest ghi lại các file đã nạp: path, size, mtime, hash nội dung và id của các chunk
+
+        Args:
+            path: Đường dẫn file JSON lưu manifest
+        """
+        self.path = path
+        self.files = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    @staticmethod
+    def _key(file_path):
+        return os.path.abspath(file_path)
+
+    def load(self):
+        """Đọc manifest từ đĩa (nếu có)"""
+        if not os.path.exists(self.path):
+            self.files = {}
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.files = data.get("files", {})
+        except (OSError, ValueError) as e:
+            print(f"Không đọc được manifest {self.path}: {e}")
+            self.files = {}
+
+    def save(self):
+        """Ghi manifest xuống đĩa một cách nguyên tử (ghi file tạm rồi đổi tên)"""
+        with self._lock:
+            data = {"version": 1, "files": self.files}
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.path)
+
+    def clear(self):
+        """Xóa toàn bộ manifest (dùng khi force_reload hoặc reset database)"""
+        with self._lock:
+            self.files = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def get(self, file_path):
+        return self.files.get(self._key(file_path))
+
+    def check(self, file_path, splitter=None):
+        """
+        Kiểm tra trạng thái của file so với manifest
+
+        Args:
+            file_path: Đường dẫn file
+            splitter: Cấu hình chia chunk hiện tại, file được chia bằng cấu hình khác coi như đã thay đổi
+
+        Returns:
+            Tuple (status, content_hash, stat) với status là "new", "modified" hoặc "unchanged" và stat là
+            kết quả os.stat lấy trước khi tính hash (truyền lại cho update)
+        """
+        entry = self.get(file_path)
+        # Lấy stat trước khi đọc nội dung: file bị ghi lại sau thời điểm này có mtime khác với mtime được lưu,
+        # lần kiểm tra sau sẽ tính lại hash và nạp lại file
+        stat = os.stat(file_path)
+        if entry and entry.get("splitter") != splitter:
+            return "modified", file_sha256(file_path), stat
+        # Nếu size và mtime không đổi thì coi như file không đổi, không cần đọc lại nội dung
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return "unchanged", entry["hash"], stat
+        content_hash = file_sha256(file_path)
+        if entry is None:
+            return "new", content_hash, stat
+        if entry["hash"] == content_hash:
+            # Chỉ mtime thay đổi (ví dụ touch) -> cập nhật lại stat, không cần nạp lại
+            self.update(file_path, content_hash, entry["chunk_ids"], stat, splitter)
+            return "unchanged", content_hash, stat
+        return "modified", content_hash, stat
+
+    def update(self, file_path, content_hash, chunk_ids, stat, splitter=None):
+        """
+        Ghi nhận file đã được nạp thành công cùng danh sách id của các chunk
+
+        Args:
+            stat: Kết quả os.stat do check() trả về cùng content_hash (không stat lại lúc ghi nhận:
+                  file bị ghi lại trong lúc nạp sẽ được lưu với size/mtime mới nhưng hash cũ)
+        """
+        entry = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "hash": content_hash,
+            "chunk_ids": list(chunk_ids),
+            "ingested_at": time.time()
+        }
+        if splitter is not None:
+            entry["splitter"] = splitter
+        with self._lock:
+            self.files[self._key(file_path)] = entry
+
+    def remove(self, file_path):
+        """Xóa file khỏi manifest, trả về danh sách chunk id cũ của file"""
+        with self._lock:
+            entry = self.files.pop(self._key(file_path), None)
+        return entry["chunk_ids"] if entry else []
+
+    def files_under(self, directory_path):
+        """Danh sách các file trong manifest nằm trong thư mục cho trước"""
+        prefix = os.path.join(os.path.abspath(directory_path), "")
+        return [path for path in self.files if path.startswith(prefix)]
+
+
+def make_chunk_ids(file_path, content_hash, count, splitter=None):
+    """
+    Sinh id ổn định cho các chunk của một file dựa trên đường dẫn, hash nội dung
+    và cấu hình chia chunk (chunk của hai cách chia khác nhau không trùng id)
+    """
+    key = f"{os.path.abspath(file_path)}:{content_hash}"
+    if splitter is not None:
+        key += f":{splitter}"
+    base = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return [f"{base}-{i}" for i in range(count)]
@@ -0,0 +1,326 @@
+"""
+Hàng đợi job tải tài liệu lưu trong SQLite: mỗi job có id, tiến độ theo từng file, tốc độ và thời gian
+còn lại ước tính, có thể hủy, và được chạy tiếp từ file đã ghi nhận cuối cùng khi tiến trình khởi động lại
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+def jobs_path_for(persist_directory):
+    """Đường dẫn database của hàng đợi job nằm cạnh thư mục persist_directory"""
+    return os.path.normpath(persist_directory) + "_jobs.sqlite3"
+
+
+class DuplicateJobError(Exception):
+    """Đã có job đang chờ hoặc đang chạy cho cùng đường dẫn"""
+
+    def __init__(self, job_id, path):
+        super().__init__(f"Đã có job {job_id} đang tải {path}")
+        self.job_id = job_id
+
+
+class JobQueue:
+    def __init__(self, path, workers=1, commit_every=64, poll_interval=1.0):
+        """
+        Hàng đợi job tải tài liệu
+
+        Args:
+            path: Đường dẫn database SQLite của hàng đợi
+            workers: Số job được chạy đồng thời (các job lần lượt ghi từng nhóm file vào index)
+            commit_every: Số file mỗi lần tải; trạng thái file được ghi nhận sau mỗi nhóm để chạy tiếp khi khởi động lại
+            poll_interval: Thời gian chờ (giây) giữa hai lần kiểm tra job mới
+        """
+        self.path = path
+        self.workers = max(1, workers)
+        self.commit_every = max(1, commit_every)
+        self.poll_interval = poll_interval
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._paused = 0
+        self._chatbot = None
+        # Tiến độ của lần chạy hiện tại: job id -> số file đã xong khi bắt đầu, thời điểm bắt đầu
+        # và bộ đếm các file đã xong nhưng chưa được ghi nhận xuống database
+        self._live = {}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " path TEXT NOT NULL,"
+            " kind TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " started_at REAL,"
+            " finished_at REAL,"
+            " total_files INTEGER,"
+            " processed_files INTEGER NOT NULL DEFAULT 0,"
+            " skipped_files INTEGER NOT NULL DEFAULT 0,"
+            " failed_files INTEGER NOT NULL DEFAULT 0,"
+            " chunks INTEGER NOT NULL DEFAULT 0,"
+            " cancel_requested INTEGER NOT NULL DEFAULT 0,"
+            " message TEXT,"
+            " error TEXT)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_files ("
+            " job_id TEXT NOT NULL,"
+            " path TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " chunks INTEGER NOT NULL DEFAULT 0,"
+            " PRIMARY KEY (job_id, path))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS job_files_status ON job_files(job_id, status)")
+        # Job đang chạy khi tiến trình dừng đột ngột được đưa lại vào hàng đợi
+        resumed = self._conn.execute(
+            "UPDATE jobs SET status = 'queued', message = 'Chạy tiếp sau khi khởi động lại' "
+            "WHERE status = 'running'").rowcount
+        self._conn.commit()
+        if resumed:
+            print(f"Sẽ chạy tiếp {resumed} job tải dữ liệu bị gián đoạn")
+
+    # ----- Gửi và theo dõi job -----
+
+    def submit(self, path, is_directory=False):
+        """
+        Thêm job tải một file hoặc một thư mục
+
+        Returns:
+            Trạng thái của job vừa tạo
+
+        Raises:
+            DuplicateJobError: Đường dẫn đang được tải bởi một job khác
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            existing = self._conn.execute(
+                f"SELECT id FROM jobs WHERE path = ? AND status IN {ACTIVE_STATUSES}", (path,)).fetchone()
+            if existing:
+                raise DuplicateJobError(existing["id"], path)
+            job_id = uuid.uuid4().hex
+            self._conn.execute(
+                "INSERT INTO jobs (id, path, kind, status, created_at, message) VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, path, "directory" if is_directory else "file", time.time(), "Đang chờ xử lý"))
+            self._conn.commit()
+        self._wake.set()
+        return self.get(job_id)
+
+    def _describe(self, row):
+        job = dict(row)
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        done = job["processed_files"] + job["skipped_files"] + job["failed_files"]
+        live = self._live.get(job["id"])
+        if live is not None:
+            # Cộng thêm các file đã xong nhưng chưa được ghi nhận xuống database
+            done += sum(live["counts"].values())
+            job["processed_files"] += live["counts"]["done"]
+            job["skipped_files"] += live["counts"]["skipped"]
+            job["failed_files"] += live["counts"]["failed"]
+            job["chunks"] += live["chunks"]
+        job["done_files"] = done
+        job["files_per_second"] = job["eta_seconds"] = None
+        if live is not None:
+            elapsed = time.time() - live["started_at"]
+            finished = done - live["run_base"]
+            if elapsed > 0 and finished:
+                rate = finished / elapsed
+                job["files_per_second"] = round(rate, 2)
+                if job["total_files"] is not None:
+                    job["eta_seconds"] = round(max(job["total_files"] - done, 0) / rate, 1)
+        return job
+
+    def get(self, job_id):
+        """Trạng thái và tiến độ của một job, None nếu không có"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return self._describe(row) if row else None
+
+    def list(self, status=None, limit=50):
+        """Các job mới nhất, lọc theo trạng thái nếu có"""
+        query, params = "SELECT * FROM jobs", []
+        if status:
+            query += " WHERE status = ?"
+            params.append(status)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            return [self._describe(row) for row in self._conn.execute(query, params)]
+
+    def active(self):
+        """Các job đang chờ hoặc đang chạy, theo thứ tự gửi"""
+        with self._lock:
+            return [self._describe(row) for row in self._conn.execute(
+                f"SELECT * FROM jobs WHERE status IN {ACTIVE_STATUSES} ORDER BY created_at")]
+
+    def cancel(self, job_id):
+        """
+        Hủy job: job đang chờ bị hủy ngay, job đang chạy dừng sau nhóm file hiện tại
+        (các file đã tải xong vẫn được giữ lại)
+
+        Returns:
+            Trạng thái của job, None nếu không có
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ?, message = 'Đã hủy' "
+                "WHERE id = ? AND status = 'queued'", (time.time(), job_id))
+            self._conn.execute(
+                "UPDATE jobs SET cancel_requested = 1, message = 'Đang hủy...' "
+                "WHERE id = ? AND status = 'running'", (job_id,))
+            self._conn.commit()
+        return self.get(job_id)
+
+    # ----- Worker -----
+
+    def start(self, chatbot):
+        """Bắt đầu các worker xử lý job bằng chatbot đã sẵn sàng"""
+        with self._lock:
+            if self._threads:
+                return
+            self._chatbot = chatbot
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"ingest-job-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def run_exclusive(self, fn):
+        """
+        Chạy fn khi không có job nào đang chờ hoặc đang chạy (reset database, nạp snapshot);
+        các worker không nhận job mới cho đến khi fn kết thúc
+
+        Returns:
+            (True, kết quả của fn) hoặc (False, None) nếu đang có job
+        """
+        with self._lock:
+            if self._conn.execute(f"SELECT 1 FROM jobs WHERE status IN {ACTIVE_STATUSES} LIMIT 1").fetchone():
+                return False, None
+            self._paused += 1
+        try:
+            return True, fn()
+        finally:
+            with self._lock:
+                self._paused -= 1
+            self._wake.set()
+
+    def _claim(self):
+        with self._lock:
+            if self._paused:
+                return None
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = COALESCE(started_at, ?), message = ? WHERE id = ?",
+                (time.time(), "Đang tải dữ liệu...", row["id"]))
+            self._conn.commit()
+            job = dict(row)
+            done = job["processed_files"] + job["skipped_files"] + job["failed_files"]
+            self._live[job["id"]] = {"run_base": done, "started_at": time.time(), "chunks": 0,
+                                     "counts": {"done": 0, "skipped": 0, "failed": 0}}
+            return job
+
+    def _work(self):
+        while not self._stop.is_set():
+            job = self._claim()
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            try:
+                self._run(job)
+            except Exception as e:
+                print(f"Lỗi khi chạy job {job['id']}: {e}")
+                self._finish(job["id"], "failed", f"Lỗi khi tải dữ liệu: {e}", error=str(e))
+
+    def _expand(self, job):
+        """Ghi danh sách file của job (một lần cho mỗi job, lần chạy tiếp dùng lại danh sách đã ghi)"""
+        if job["kind"] == "directory":
+            if not os.path.isdir(job["path"]):
+                raise ValueError(f"Thư mục không tồn tại: {job['path']}")
+            # Loại bỏ các file đã bị xóa khỏi thư mục
+            self._chatbot.purge_missing_files(job["path"])
+            paths = self._chatbot.list_files(job["path"])
+        else:
+            paths = [job["path"]]
+        with self._lock:
+            self._conn.executemany("INSERT OR IGNORE INTO job_files (job_id, path, status) VALUES (?, ?, 'pending')",
+                                   [(job["id"], path) for path in paths])
+            self._conn.execute("UPDATE jobs SET total_files = ? WHERE id = ?", (len(paths), job["id"]))
+            self._conn.commit()
+
+    def _run(self, job):
+        job_id = job["id"]
+        if job["total_files"] is None:
+            self._expand(job)
+        live = self._live[job_id]
+        while True:
+            with self._lock:
+                if self._conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]:
+                    self._finish(job_id, "cancelled", "Đã hủy")
+                    return
+                paths = [row["path"] for row in self._conn.execute(
+                    "SELECT path FROM job_files WHERE job_id = ? AND status = 'pending' ORDER BY path LIMIT ?",
+                    (job_id, self.commit_every))]
+            if not paths:
+                break
+
+            results = {}
+
+            def on_file_done(path, status, chunks):
+                results[path] = (status, chunks)
+                with self._lock:
+                    live["counts"][status] += 1
+                    live["chunks"] += chunks
+
+            self._chatbot.load_documents(paths, on_file_done=on_file_done)
+            # Ghi nhận cả nhóm sau khi load_documents đã lưu manifest và chỉ mục xuống đĩa
+            with self._lock:
+                for path in paths:
+                    if path not in results:
+                        results[path] = ("failed", 0)
+                        live["counts"]["failed"] += 1
+                self._conn.executemany(
+                    "UPDATE job_files SET status = ?, chunks = ? WHERE job_id = ? AND path = ?",
+                    [(status, chunks, job_id, path) for path, (status, chunks) in results.items()])
+                counts = {status: sum(1 for s, _ in results.values() if s == status)
+                          for status in ("done", "skipped", "failed")}
+                self._conn.execute(
+                    "UPDATE jobs SET processed_files = processed_files + ?, skipped_files = skipped_files + ?,"
+                    " failed_files = failed_files + ?, chunks = chunks + ? WHERE id = ?",
+                    (counts["done"], counts["skipped"], counts["failed"],
+                     sum(chunks for _, chunks in results.values()), job_id))
+                for status, count in counts.items():
+                    live["counts"][status] -= count
+                live["chunks"] -= sum(chunks for _, chunks in results.values())
+                self._conn.commit()
+
+        final = self.get(job_id)
+        message = (f"Đã tải {final['chunks']} chunks từ {final['processed_files']} file "
+                   f"({final['skipped_files']} file không đổi, {final['failed_files']} file lỗi)")
+        self._finish(job_id, "completed", message)
+
+    def _finish(self, job_id, status, message, error=None):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = ?, finished_at = ?, message = ?, error = ? WHERE id = ?",
+                               (status, time.time(), message, error, job_id))
+            self._conn.commit()
+            self._live.pop(job_id, None)
+        print(f"Job {job_id}: {message}")
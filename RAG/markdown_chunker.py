@@ -0,0 +1,263 @@
+"""
+Chia tài liệu markdown theo cấu trúc: cắt tại tiêu đề và ranh giới đoạn, kích thước chunk tính bằng token,
+đường dẫn tiêu đề (heading_path) được lưu trong metadata thay cho phần chồng lấn giữa các chunk
+
+Ví dụ so sánh với splitter cũ (1000 ký tự, chồng lấn 200):
+    python markdown_chunker.py ../Craw4AI/output --chunk-tokens 300
+"""
+import argparse
+import os
+import re
+import time
+
+from langchain_core.documents import Document
+
+from context_packing import estimate_tokens, require_tokenizer, tokenizer_name
+from doc_metadata import front_matter_length
+
+_HEADING = re.compile(r"^[ \t]{0,3}(#{1,6})[ \t]+(.*?)[ \t#]*$")
+_FENCE = re.compile(r"^[ \t]{0,3}(`{3,}|~{3,})")
+# Ranh giới câu: sau dấu kết thúc câu có khoảng trắng, hoặc xuống dòng
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?…:;])[ \t]+|\n+")
+_WORD_BREAK = re.compile(r"\s+")
+
+HEADING_SEPARATOR = " > "
+
+
+def _iter_blocks(text, start=0):
+    """
+    Tách văn bản thành các khối liên tiếp: tiêu đề, đoạn văn (kể cả danh sách, bảng) và khối code
+
+    Yields:
+        (kind, start, end, level, title): kind là "heading", "text" hoặc "code";
+        level/title chỉ có với tiêu đề; text[start:end] không có dòng trống ở đầu và cuối
+    """
+    block_start = block_end = None
+    fence = None
+    position = start
+    for line in text[start:].splitlines(keepends=True):
+        line_start, position = position, position + len(line)
+        content = line.rstrip("\r\n")
+        line_end = line_start + len(content)
+
+        if fence is not None:
+            block_end = line_end
+            if content.strip().startswith(fence):
+                yield "code", block_start, block_end, 0, None
+                block_start = fence = None
+            continue
+
+        fence_match = _FENCE.match(content)
+        heading = _HEADING.match(content) if not fence_match else None
+        if fence_match or heading or not content.strip():
+            if block_start is not None:
+                yield "text", block_start, block_end, 0, None
+                block_start = None
+        if fence_match:
+            fence = fence_match.group(1)
+            block_start, block_end = line_start, line_end
+        elif heading:
+            yield "heading", line_start, line_end, len(heading.group(1)), heading.group(2).strip()
+        elif content.strip():
+            if block_start is None:
+                block_start = line_start
+            block_end = line_end
+    if block_start is not None:
+        # Khối code chưa đóng đến hết file vẫn được giữ lại
+        yield "code" if fence is not None else "text", block_start, block_end, 0, None
+
+
+def _pieces(text, start, end, pattern):
+    """Cắt text[start:end] tại các vị trí khớp pattern, trả về các đoạn (start, end) không rỗng"""
+    pieces = []
+    position = start
+    for match in pattern.finditer(text, start, end):
+        if match.start() > position:
+            pieces.append((position, match.start()))
+        position = match.end()
+    if position < end:
+        pieces.append((position, end))
+    return pieces
+
+
+class MarkdownChunker:
+    def __init__(self, chunk_tokens=300, min_chunk_tokens=60, count_tokens=estimate_tokens):
+        """
+        Chia tài liệu theo cấu trúc markdown, kích thước chunk tính bằng token
+
+        Args:
+            chunk_tokens: Số token tối đa của một chunk
+            min_chunk_tokens: Section ngắn hơn số token này được gộp với section tiếp theo
+            count_tokens: Hàm đếm token của một đoạn văn bản
+
+        Raises:
+            RuntimeError: Không tải được tokenizer cấu hình trong RAG_TOKENIZER (không tự chuyển sang ước lượng
+                          vì signature và id của chunk phụ thuộc vào tokenizer)
+        """
+        if count_tokens is estimate_tokens:
+            require_tokenizer()
+        self.chunk_tokens = max(1, chunk_tokens)
+        self.min_chunk_tokens = min(max(0, min_chunk_tokens), self.chunk_tokens)
+        self.count_tokens = count_tokens
+
+    @property
+    def signature(self):
+        """Cấu hình chia chunk, thay đổi thì các file phải được chia lại"""
+        return f"markdown:{self.chunk_tokens}:{self.min_chunk_tokens}:{tokenizer_name()}"
+
+    def _split_large(self, text, start, end, pattern=_SENTENCE_BREAK):
+        """Chia khối lớn hơn chunk_tokens theo câu (hoặc theo từ nếu một câu vẫn quá lớn)"""
+        current = None
+        for piece_start, piece_end in _pieces(text, start, end, pattern):
+            tokens = self.count_tokens(text[piece_start:piece_end])
+            if tokens > self.chunk_tokens and pattern is not _WORD_BREAK:
+                if current is not None:
+                    yield current[0], current[1]
+                    current = None
+                yield from self._split_large(text, piece_start, piece_end, _WORD_BREAK)
+                continue
+            if current is not None and current[2] + tokens > self.chunk_tokens:
+                yield current[0], current[1]
+                current = None
+            if current is None:
+                current = [piece_start, piece_end, tokens]
+            else:
+                current[1] = piece_end
+                current[2] += tokens
+        if current is not None:
+            yield current[0], current[1]
+
+    def iter_chunks(self, text):
+        """
+        Chia văn bản thành các chunk, xử lý tuần tự từng khối nên không giữ bản sao của cả tài liệu
+
+        Yields:
+            (start, end, heading_path): chunk là text[start:end], heading_path là các tiêu đề
+            bao quanh chunk, nối bằng " > "
+        """
+        headings = []
+        current = None  # [start, end, tokens, heading_path, has_body]
+
+        def path():
+            return HEADING_SEPARATOR.join(title for _, title in headings)
+
+        for kind, start, end, level, title in _iter_blocks(text, front_matter_length(text)):
+            if kind == "heading":
+                # Section mới bắt đầu chunk mới, trừ khi chunk hiện tại quá ngắn để đứng riêng
+                if current is not None and current[2] >= self.min_chunk_tokens:
+                    yield current[0], current[1], current[3]
+                    current = None
+                while headings and headings[-1][0] >= level:
+                    headings.pop()
+                headings.append((level, title))
+                if current is not None and not current[4]:
+                    # Chunk mới chỉ có tiêu đề: lấy đường dẫn của tiêu đề sâu nhất
+                    current[3] = path()
+
+            tokens = self.count_tokens(text[start:end])
+            if tokens > self.chunk_tokens:
+                if current is not None:
+                    yield current[0], current[1], current[3]
+                    current = None
+                for piece_start, piece_end in self._split_large(text, start, end):
+                    yield piece_start, piece_end, path()
+                continue
+            if current is not None and current[2] + tokens > self.chunk_tokens:
+                yield current[0], current[1], current[3]
+                current = None
+            if current is None:
+                current = [start, end, tokens, path(), kind != "heading"]
+            else:
+                current[1] = end
+                current[2] += tokens
+                current[4] = current[4] or kind != "heading"
+        if current is not None:
+            yield current[0], current[1], current[3]
+
+    def split_text(self, text):
+        return [text[start:end] for start, end, _ in self.iter_chunks(text)]
+
+    def split_documents(self, documents):
+        """
+        Chia các Document thành chunk, giữ metadata gốc và thêm start_index, heading_path
+
+        Returns:
+            Danh sách Document, mỗi chunk là một đoạn liên tục của văn bản gốc
+        """
+        chunks = []
+        for document in documents:
+            text = document.page_content
+            for start, end, heading_path in self.iter_chunks(text):
+                metadata = dict(document.metadata)
+                metadata["start_index"] = start
+                metadata["heading_path"] = heading_path
+                chunks.append(Document(page_content=text[start:end], metadata=metadata))
+        return chunks
+
+
+def _iter_files(paths, extensions=(".md", ".markdown", ".txt")):
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+            continue
+        for root, _, names in os.walk(path):
+            for name in sorted(names):
+                if name.lower().endswith(extensions):
+                    yield os.path.join(root, name)
+
+
+def compare_splitters(paths, splitters, count_tokens=estimate_tokens):
+    """
+    So sánh các splitter trên cùng tập file: số chunk, tổng số token được embedding,
+    kích thước chunk và thời gian chia. Đọc từng file một nên dùng được cho thư mục lớn.
+
+    Args:
+        paths: Các file hoặc thư mục
+        splitters: Dict tên -> splitter (có split_text)
+        count_tokens: Hàm đếm token dùng chung để so sánh
+
+    Returns:
+        Dict tên -> thống kê
+    """
+    stats = {name: {"chunks": 0, "embedded_tokens": 0, "max_chunk_tokens": 0, "split_seconds": 0.0}
+             for name in splitters}
+    files = source_tokens = 0
+    for file_path in _iter_files(paths):
+        with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+            text = f.read()
+        files += 1
+        source_tokens += count_tokens(text) if text.strip() else 0
+        for name, splitter in splitters.items():
+            start = time.perf_counter()
+            chunks = splitter.split_text(text)
+            stats[name]["split_seconds"] += time.perf_counter() - start
+            for chunk in chunks:
+                tokens = count_tokens(chunk)
+                stats[name]["chunks"] += 1
+                stats[name]["embedded_tokens"] += tokens
+                stats[name]["max_chunk_tokens"] = max(stats[name]["max_chunk_tokens"], tokens)
+    for item in stats.values():
+        item["mean_chunk_tokens"] = round(item["embedded_tokens"] / max(item["chunks"], 1), 1)
+        item["tokens_vs_source"] = round(item["embedded_tokens"] / max(source_tokens, 1), 3)
+        item["split_seconds"] = round(item["split_seconds"], 3)
+    return {"files": files, "source_tokens": source_tokens, "tokenizer": tokenizer_name(), "splitters": stats}
+
+
+if __name__ == "__main__":
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    parser = argparse.ArgumentParser(description="So sánh chia chunk theo cấu trúc markdown với splitter cũ")
+    parser.add_argument("paths", nargs="+", help="File hoặc thư mục tài liệu")
+    parser.add_argument("--chunk-tokens", type=int, default=300)
+    parser.add_argument("--min-chunk-tokens", type=int, default=60)
+    args = parser.parse_args()
+
+    report = compare_splitters(args.paths, {
+        "recursive-1000-chars": RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len),
+        "markdown": MarkdownChunker(args.chunk_tokens, args.min_chunk_tokens)
+    })
+    print(f"{report['files']} file, {report['source_tokens']} token (tokenizer: {report['tokenizer']})")
+    for name, item in report["splitters"].items():
+        print(f"  {name}: {item['chunks']} chunks, {item['embedded_tokens']} token được embedding "
+              f"({item['tokens_vs_source']}x tài liệu gốc), trung bình {item['mean_chunk_tokens']} token/chunk, "
+              f"lớn nhất {item['max_chunk_tokens']}, chia trong {item['split_seconds']}s")
@@ -0,0 +1,191 @@
+"""
+Đo độ trễ theo từng bước và xuất metrics theo định dạng văn bản của Prometheus
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=None):
+    items = list(key) + (list(extra.items()) if extra else [])
+    if not items:
+        return ""
+    body = ",".join(f'{name}="{str(value)}"' for name, value in items)
+    return "{" + body + "}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """Lưu các counter, histogram và gauge (đọc qua hàm callback) trong bộ nhớ"""
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}
+        self._histograms = {}
+        self._buckets = {}
+        self._gauges = {}
+
+    def counter(self, name, help_text):
+        with self._lock:
+            self._help[name] = help_text
+            self._counters.setdefault(name, {})
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        with self._lock:
+            self._help[name] = help_text
+            self._buckets[name] = tuple(buckets)
+            self._histograms.setdefault(name, {})
+
+    def gauge(self, name, help_text, callback):
+        """Đăng ký gauge có giá trị được tính khi xuất metrics; callback trả về số hoặc dict {labels_tuple: số}"""
+        with self._lock:
+            self._help[name] = help_text
+            self._gauges[name] = callback
+
+    def inc(self, name, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            buckets = self._buckets.setdefault(name, DEFAULT_BUCKETS)
+            series = self._histograms.setdefault(name, {})
+            state = series.get(key)
+            if state is None:
+                state = series[key] = {"counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def render(self):
+        """Xuất tất cả metrics theo định dạng văn bản của Prometheus (version 0.0.4)"""
+        lines = []
+        with self._lock:
+            for name, series in self._counters.items():
+                lines.append(f"# HELP {name} {self._help.get(name, '')}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            for name, series in self._histograms.items():
+                buckets = self._buckets[name]
+                lines.append(f"# HELP {name} {self._help.get(name, '')}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, state in series.items():
+                    for bound, count in zip(buckets, state["counts"]):
+                        lines.append(f"{name}_bucket{_format_labels(key, {'le': bound})} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(key, {'le': '+Inf'})} {state['count']}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {round(state['sum'], 6)}")
+                    lines.append(f"{name}_count{_format_labels(key)} {state['count']}")
+            gauges = list(self._gauges.items())
+        for name, callback in gauges:
+            try:
+                value = callback()
+            except Exception:
+                continue
+            lines.append(f"# HELP {name} {self._help.get(name, '')}")
+            lines.append(f"# TYPE {name} gauge")
+            if isinstance(value, dict):
+                for key, item in value.items():
+                    lines.append(f"{name}{_format_labels(key)} {item}")
+            else:
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Registry dùng chung trong tiến trình
+REGISTRY = MetricsRegistry()
+REGISTRY.histogram("rag_query_stage_seconds", "Thời gian từng bước của một truy vấn")
+REGISTRY.histogram("rag_query_seconds", "Tổng thời gian của một truy vấn")
+REGISTRY.histogram("rag_prompt_tokens", "Số token (ước lượng) của prompt gửi tới LLM",
+                   buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000))
+REGISTRY.histogram("rag_ingest_stage_seconds", "Thời gian từng bước khi tải tài liệu (theo file hoặc theo batch)")
+REGISTRY.counter("rag_answer_cache_total", "Số lần tra cứu cache câu trả lời theo kết quả")
+REGISTRY.counter("rag_query_fallback_total", "Số lần truy vấn phải chuyển sang manual_query")
+REGISTRY.counter("rag_queries_total", "Số truy vấn theo loại")
+REGISTRY.counter("rag_ingested_chunks_total", "Số chunk đã ghi vào vector store")
+REGISTRY.counter("rag_near_duplicate_chunks_total", "Số chunk gần trùng được gộp, không cần embedding")
+
+
+class QueryTrace:
+    def __init__(self, registry=REGISTRY, kind="query"):
+        """
+        Ghi lại thời gian từng bước, số token, trạng thái cache và fallback của một truy vấn
+
+        Args:
+            registry: MetricsRegistry nhận các số đo
+            kind: Loại truy vấn ("query", "stream", ...) dùng làm nhãn
+        """
+        self.registry = registry
+        self.kind = kind
+        self.stages = {}
+        self.prompt_tokens = None
+        self.answer_tokens = None
+        self.cache = None
+        self.fallback = False
+        self.total_seconds = None
+        self._start = time.perf_counter()
+        registry.inc("rag_queries_total", kind=kind)
+
+    @contextmanager
+    def stage(self, name):
+        """Đo thời gian của một bước: `with trace.stage("retrieval"): ...`"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        self.registry.observe("rag_query_stage_seconds", seconds, stage=name, kind=self.kind)
+
+    def set_cache(self, result):
+        self.cache = result
+        self.registry.inc("rag_answer_cache_total", result=result)
+
+    def set_prompt_tokens(self, tokens):
+        self.prompt_tokens = tokens
+        self.registry.observe("rag_prompt_tokens", tokens, kind=self.kind)
+
+    def mark_fallback(self):
+        self.fallback = True
+        self.registry.inc("rag_query_fallback_total", kind=self.kind)
+
+    def finish(self):
+        """Kết thúc truy vấn, ghi tổng thời gian"""
+        self.total_seconds = time.perf_counter() - self._start
+        self.registry.observe("rag_query_seconds", self.total_seconds, kind=self.kind)
+        return self.total_seconds
+
+    def to_dict(self):
+        total = self.total_seconds
+        if total is None:
+            total = time.perf_counter() - self._start
+        return {
+            "total_ms": round(total * 1000, 2),
+            "stages_ms": {name: round(seconds * 1000, 2) for name, seconds in self.stages.items()},
+            "prompt_tokens": self.prompt_tokens,
+            "answer_tokens": self.answer_tokens,
+            "cache": self.cache,
+            "fallback": self.fallback
+        }
+
+
+@contextmanager
+def timed(registry, name, **labels):
+    """Đo thời gian của một khối lệnh và ghi vào histogram"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(name, time.perf_counter() - start, **labels)
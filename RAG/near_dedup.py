@@ -0,0 +1,261 @@
+"""
+Phát hiện chunk gần trùng (MinHash + LSH) để không embedding và lưu lại các đoạn lặp
+(header, footer, menu...) xuất hiện trong nhiều tài liệu
+"""
+import base64
+import gzip
+import json
+import os
+import threading
+import zlib
+
+import numpy as np
+
+from bm25_index import tokenize
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+
+
+def near_dedup_path_for(persist_directory):
+    """Đường dẫn file chỉ mục chunk gần trùng nằm cạnh thư mục persist_directory"""
+    return os.path.normpath(persist_directory) + "_near_dedup.json.gz"
+
+
+def _choose_bands(num_perm, threshold):
+    """
+    Chọn số band x số hàng cho LSH sao cho ngưỡng ước lượng (1/b)^(1/r) thấp hơn threshold một chút
+    (ưu tiên không bỏ sót, các ứng viên đều được kiểm tra lại bằng chữ ký)
+    """
+    pairs = [(b, num_perm // b) for b in range(1, num_perm + 1) if num_perm % b == 0]
+    below = [(b, r) for b, r in pairs if (1 / b) ** (1 / r) <= threshold - 0.1]
+    if not below:
+        return min(pairs, key=lambda pair: (1 / pair[0]) ** (1 / pair[1]))
+    return max(below, key=lambda pair: (1 / pair[0]) ** (1 / pair[1]))
+
+
+class NearDuplicateIndex:
+    def __init__(self, path, threshold=0.9, num_perm=128, shingle_size=3, seed=1):
+        """
+        Chỉ mục MinHash của các chunk đã lưu trong vector store
+
+        Mỗi chunk được lưu (canonical) giữ danh sách tham chiếu tới các chunk gần trùng với nó
+        (kể cả chính nó). Chunk chỉ bị xóa khỏi vector store khi không còn tham chiếu nào.
+
+        Args:
+            path: Đường dẫn file lưu chỉ mục
+            threshold: Ngưỡng độ tương đồng Jaccard (ước lượng) để coi hai chunk là gần trùng
+            num_perm: Số hàm băm của chữ ký MinHash
+            shingle_size: Số từ liên tiếp trong mỗi shingle
+            seed: Seed sinh các hàm băm (phải cố định để chữ ký đã lưu còn dùng được)
+        """
+        self.path = path
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = _choose_bands(num_perm, threshold)
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._entries = {}
+        self._alias_of = {}
+        self._buckets = {}
+        self._lock = threading.RLock()
+        self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def signature(self, text):
+        """Chữ ký MinHash của văn bản (mảng uint32 độ dài num_perm)"""
+        tokens = tokenize(text)
+        size = min(self.shingle_size, len(tokens)) or 1
+        shingles = {" ".join(tokens[i:i + size]) for i in range(max(1, len(tokens) - size + 1))}
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        permuted = (hashes[:, None] * self._a + self._b) % _MERSENNE_PRIME
+        return (permuted.min(axis=0) & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+                for band in range(self.bands)]
+
+    def find(self, signature, source=None, scope=None):
+        """
+        Tìm chunk đã lưu gần trùng nhất với chữ ký
+
+        Args:
+            signature: Chữ ký MinHash của chunk mới
+            source: Nguồn của chunk mới; không so với các chunk có cùng nguồn để chỉnh sửa
+                    nhỏ trong một file vẫn được cập nhật
+            scope: Dict metadata mà chunk đã lưu phải khớp (ví dụ cùng shard), None để không giới hạn
+
+        Returns:
+            Id của chunk đã lưu, None nếu không có chunk nào đạt ngưỡng
+        """
+        with self._lock:
+            candidates = set()
+            for key in self._band_keys(signature):
+                candidates.update(self._buckets.get(key, ()))
+            best_id, best_score = None, self.threshold
+            for chunk_id in candidates:
+                entry = self._entries[chunk_id]
+                if source is not None and entry["metadata"].get("source") == source:
+                    continue
+                if scope and any(entry["metadata"].get(key) != value for key, value in scope.items()):
+                    continue
+                score = float(np.mean(entry["signature"] == signature))
+                if score >= best_score:
+                    best_id, best_score = chunk_id, score
+            return best_id
+
+    def add(self, chunk_id, signature, metadata):
+        """Ghi nhận một chunk được lưu vào vector store, trả về số tham chiếu tới chunk"""
+        with self._lock:
+            entry = self._entries.get(chunk_id)
+            if entry is None:
+                entry = self._entries[chunk_id] = {"signature": signature, "metadata": dict(metadata), "refs": {}}
+                for key in self._band_keys(signature):
+                    self._buckets.setdefault(key, set()).add(chunk_id)
+            else:
+                entry["metadata"] = dict(metadata)
+            entry["refs"][chunk_id] = _ref(metadata)
+            self._alias_of[chunk_id] = chunk_id
+            return len(entry["refs"])
+
+    def add_alias(self, canonical_id, chunk_id, metadata):
+        """Ghi nhận chunk chunk_id gần trùng với chunk đã lưu canonical_id (không cần embedding)"""
+        with self._lock:
+            self._entries[canonical_id]["refs"][chunk_id] = _ref(metadata)
+            self._alias_of[chunk_id] = canonical_id
+
+    def release(self, chunk_ids):
+        """
+        Bỏ tham chiếu của các chunk (file bị xóa hoặc thay đổi)
+
+        Returns:
+            (ids cần xóa khỏi vector store, ids cần cập nhật lại metadata nguồn)
+        """
+        deleted, touched = [], set()
+        with self._lock:
+            for chunk_id in chunk_ids:
+                canonical_id = self._alias_of.pop(chunk_id, None)
+                if canonical_id is None:
+                    # Chunk không được theo dõi (database tạo trước khi có chỉ mục này)
+                    deleted.append(chunk_id)
+                    continue
+                entry = self._entries[canonical_id]
+                entry["refs"].pop(chunk_id, None)
+                if not entry["refs"]:
+                    self._drop(canonical_id)
+                    deleted.append(canonical_id)
+                    touched.discard(canonical_id)
+                else:
+                    touched.add(canonical_id)
+        return deleted, sorted(touched)
+
+    def discard(self, chunk_ids):
+        """Bỏ các chunk chưa được ghi thành công cùng mọi tham chiếu tới chúng"""
+        with self._lock:
+            for chunk_id in chunk_ids:
+                if chunk_id in self._entries:
+                    self._drop(chunk_id)
+
+    def _drop(self, canonical_id):
+        entry = self._entries.pop(canonical_id)
+        for chunk_id in entry["refs"]:
+            if self._alias_of.get(chunk_id) == canonical_id:
+                del self._alias_of[chunk_id]
+        for key in self._band_keys(entry["signature"]):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(canonical_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def provenance_metadata(self, canonical_id):
+        """
+        Metadata của chunk đã lưu kèm nguồn gốc: source là nguồn chính (chính chunk đó nếu
+        file gốc còn, nếu không là một chunk gần trùng còn lại), duplicate_sources là danh sách
+        (chuỗi JSON) các nguồn khác có nội dung gần trùng
+        """
+        with self._lock:
+            entry = self._entries.get(canonical_id)
+            if entry is None:
+                return None
+            refs = entry["refs"]
+            primary = refs.get(canonical_id) or refs[min(refs)]
+            metadata = dict(entry["metadata"])
+            metadata["source"] = primary["source"]
+            if primary.get("start_index") is not None:
+                metadata["start_index"] = primary["start_index"]
+            others = sorted({ref["source"] for ref in refs.values()} - {primary["source"]})
+            metadata["duplicate_sources"] = json.dumps(others, ensure_ascii=False)
+            metadata["duplicate_count"] = len(refs) - 1
+            return metadata
+
+    def stats(self):
+        with self._lock:
+            return {
+                "stored_chunks": len(self._entries),
+                "referenced_chunks": len(self._alias_of),
+                "collapsed_chunks": len(self._alias_of) - len(self._entries)
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._alias_of.clear()
+            self._buckets.clear()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def load(self):
+        """Đọc chỉ mục từ đĩa và dựng lại các bucket LSH"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Không đọc được chỉ mục chunk gần trùng {self.path}: {e}")
+            return
+        if data.get("num_perm") != self.num_perm or data.get("shingle_size") != self.shingle_size:
+            print("Chỉ mục chunk gần trùng được tạo với tham số khác, sẽ dựng lại")
+            return
+        with self._lock:
+            for chunk_id, item in data.get("entries", {}).items():
+                signature = np.frombuffer(base64.b64decode(item["signature"]), dtype=np.uint32).copy()
+                self.add(chunk_id, signature, item["metadata"])
+                self._entries[chunk_id]["refs"] = item["refs"]
+                for ref_id in item["refs"]:
+                    self._alias_of[ref_id] = chunk_id
+                if chunk_id not in item["refs"]:
+                    self._alias_of.pop(chunk_id, None)
+
+    def save(self):
+        """Ghi chỉ mục xuống đĩa"""
+        with self._lock:
+            data = {
+                "version": 1,
+                "num_perm": self.num_perm,
+                "shingle_size": self.shingle_size,
+                "entries": {
+                    chunk_id: {
+                        "signature": base64.b64encode(entry["signature"].tobytes()).decode("ascii"),
+                        "metadata": entry["metadata"],
+                        "refs": entry["refs"]
+                    }
+                    for chunk_id, entry in self._entries.items()
+                }
+            }
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=3) as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def _ref(metadata):
+    return {"source": metadata.get("source"), "start_index": metadata.get("start_index")}
@@ -0,0 +1,652 @@
+"""
+Vector store cục bộ gọn nhẹ: vector được lưu dạng float16 hoặc int8 (lượng tử hóa theo từng vector)
+trong file memory-mapped, văn bản và metadata nằm trong một bảng SQLite.
+Tìm kiếm chính xác (vector hóa bằng numpy) cho corpus nhỏ, IVF (chia cụm bằng k-means) cho corpus lớn.
+"""
+import json
+import math
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import uuid
+from urllib.parse import quote
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+DTYPES = {"float16": np.float16, "int8": np.int8}
+
+# Số dòng được giải mã và nhân với câu hỏi mỗi lần, giữ bộ nhớ tạm ở mức vài chục MB
+_BLOCK_ROWS = 16384
+
+_SQL_OPERATORS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+_METADATA_KEY = re.compile(r"^\w+$")
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def _top_k(scores, rows, k):
+    """Chọn k phần tử có điểm cao nhất, trả về (scores, rows) đã sắp xếp giảm dần"""
+    if len(scores) > k:
+        part = np.argpartition(-scores, k - 1)[:k]
+        scores, rows = scores[part], rows[part]
+    order = np.argsort(-scores, kind="stable")
+    return scores[order], rows[order]
+
+
+class QuantizedVectorStore(VectorStore):
+    META_FILE = "index.sqlite3"
+
+    def __init__(self,
+                 persist_directory: str,
+                 embedding_function: Optional[Embeddings] = None,
+                 dtype: str = "float16",
+                 index_type: str = "auto",
+                 ivf_min_size: int = 20000,
+                 nlist: Optional[int] = None,
+                 nprobe: int = 8,
+                 initial_capacity: int = 1024,
+                 indexed_metadata: Iterable[str] = ()):
+        """
+        Vector store lưu vector đã lượng tử hóa trong file memory-mapped
+
+        Vector được chuẩn hóa về độ dài 1 trước khi lưu, khoảng cách trả về là 1 - cosine.
+
+        Args:
+            persist_directory: Thư mục lưu dữ liệu
+            embedding_function: Embedding model dùng cho câu hỏi và add_texts
+            dtype: "float16" (1/2 dung lượng float32) hoặc "int8" (1/4 dung lượng, kèm hệ số tỉ lệ mỗi vector);
+                   chỉ có tác dụng khi tạo mới, index đã có giữ nguyên kiểu đã lưu
+            index_type: "exact" (quét toàn bộ), "ivf" hoặc "auto" (IVF khi số vector >= ivf_min_size)
+            ivf_min_size: Số vector tối thiểu để dùng IVF ở chế độ "auto"
+            nlist: Số cụm của IVF, None để chọn theo căn bậc hai số vector
+            nprobe: Số cụm gần câu hỏi nhất được quét khi tìm kiếm bằng IVF
+            initial_capacity: Số dòng cấp phát ban đầu của file vector (tự tăng gấp đôi khi đầy)
+            indexed_metadata: Các khóa metadata được đánh index trong SQLite để lọc nhanh
+        """
+        if dtype not in DTYPES:
+            raise ValueError(f"Kiểu lưu vector không hợp lệ: {dtype} (chỉ hỗ trợ {', '.join(DTYPES)})")
+        if index_type not in ("exact", "ivf", "auto"):
+            raise ValueError(f"Kiểu index không hợp lệ: {index_type}")
+        self.persist_directory = persist_directory
+        self._embedding = embedding_function
+        self.index_type = index_type
+        self.ivf_min_size = ivf_min_size
+        self.nlist = nlist
+        self.nprobe = max(1, nprobe)
+        self.initial_capacity = max(16, initial_capacity)
+        self._lock = threading.RLock()
+        # Kết nối chỉ đọc riêng của từng luồng: truy vấn đọc SQLite (chế độ WAL) không chờ khóa ghi
+        self._readers = threading.local()
+        self._build_lock = threading.Lock()
+        # Các dòng được ghi trong lúc build_ivf chạy k-means ngoài khóa (None khi không dựng)
+        self._ivf_written = None
+
+        os.makedirs(persist_directory, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(persist_directory, self.META_FILE), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " id TEXT PRIMARY KEY,"
+            " row INTEGER NOT NULL UNIQUE,"
+            " document TEXT,"
+            " metadata TEXT)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS free_rows (row INTEGER PRIMARY KEY)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)")
+        for key in indexed_metadata:
+            # Index theo biểu thức: truy vấn phải dùng đúng json_extract(metadata, '$.key') mới dùng được index
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS meta_{self._metadata_key(key)} "
+                               f"ON chunks({self._metadata_expr(key)})")
+        self._conn.commit()
+
+        info = dict(self._conn.execute("SELECT key, value FROM info").fetchall())
+        if "dtype" in info and info["dtype"] != dtype:
+            print(f"Index tại {persist_directory} lưu vector dạng {info['dtype']}, bỏ qua dtype={dtype}")
+        self.dtype = info.get("dtype", dtype)
+        self.dimension = int(info["dimension"]) if "dimension" in info else None
+        self._capacity = int(info.get("capacity", 0))
+        self._size = int(info.get("size", 0))
+        self._ivf_trained = int(info.get("ivf_trained", 0))
+
+        self._vectors = None
+        self._scales = None
+        self._alive = np.zeros(self._capacity, dtype=bool)
+        self._ivf = None
+        self._count = 0
+        if self.dimension is not None:
+            self._open_arrays()
+            rows = [row for (row,) in self._conn.execute("SELECT row FROM chunks")]
+            self._alive[rows] = True
+            self._count = len(rows)
+            self._load_ivf()
+        self._publish()
+
+    # ----- Lưu trữ -----
+
+    def _path(self, name):
+        return os.path.join(self.persist_directory, name)
+
+    @property
+    def _vector_file(self):
+        return self._path("vectors.f16" if self.dtype == "float16" else "vectors.i8")
+
+    def _open_arrays(self):
+        """Mở (hoặc mở rộng) các file memory-mapped theo self._capacity"""
+        itemsize = np.dtype(DTYPES[self.dtype]).itemsize
+        files = [(self._vector_file, self._capacity * self.dimension * itemsize)]
+        if self.dtype == "int8":
+            files.append((self._path("scales.f32"), self._capacity * 4))
+        for path, size in files:
+            with open(path, "ab") as f:
+                if f.tell() < size:
+                    f.truncate(size)
+        # Tạo memmap mới thay vì sửa memmap cũ: truy vấn đang chạy vẫn đọc được mảng cũ (file chỉ tăng kích thước)
+        self._vectors = np.memmap(self._vector_file, dtype=DTYPES[self.dtype], mode="r+",
+                                  shape=(self._capacity, self.dimension))
+        if self.dtype == "int8":
+            self._scales = np.memmap(self._path("scales.f32"), dtype=np.float32, mode="r+",
+                                     shape=(self._capacity,))
+
+    def _publish(self):
+        """
+        Công bố trạng thái cho truy vấn không khóa bằng một phép gán tuple duy nhất (gọi khi giữ self._lock,
+        sau khi đã ghi xong): truy vấn lấy cả tuple nên các mảng luôn khớp nhau và khớp với size
+        """
+        self._snapshot = (self._vectors, self._scales, self._alive, self._ivf, self._size)
+
+    def _grow(self, needed):
+        capacity = max(self._capacity, self.initial_capacity)
+        while capacity < needed:
+            capacity *= 2
+        if capacity == self._capacity:
+            return
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self._capacity] = self._alive
+        self._capacity = capacity
+        self._open_arrays()
+        self._alive = alive
+        if self._ivf is not None:
+            assign = np.full(capacity, -1, dtype=np.int32)
+            assign[:len(self._ivf["assign"])] = self._ivf["assign"]
+            self._ivf = dict(self._ivf, assign=assign)
+
+    def _save_info(self):
+        items = {"dtype": self.dtype, "dimension": self.dimension, "capacity": self._capacity,
+                 "size": self._size, "ivf_trained": self._ivf_trained}
+        self._conn.executemany("INSERT OR REPLACE INTO info (key, value) VALUES (?, ?)",
+                               [(key, str(value)) for key, value in items.items() if value is not None])
+
+    def _encode(self, rows, vectors):
+        vectors = _normalize(vectors)
+        if self.dtype == "float16":
+            self._vectors[rows] = vectors.astype(np.float16)
+        else:
+            scales = np.abs(vectors).max(axis=1) / 127
+            scales[scales == 0] = 1.0
+            self._vectors[rows] = np.round(vectors / scales[:, None]).astype(np.int8)
+            self._scales[rows] = scales
+
+    def _decode(self, vectors, scales, rows):
+        block = np.asarray(vectors[rows], dtype=np.float32)
+        if scales is not None:
+            block *= np.asarray(scales[rows])[:, None]
+        return block
+
+    # ----- Ghi -----
+
+    def upsert_vectors(self, ids: List[str], embeddings: List[List[float]],
+                       metadatas: Optional[List[dict]] = None, documents: Optional[List[str]] = None):
+        """Ghi (thêm hoặc thay thế) các vector đã tính sẵn cùng văn bản và metadata"""
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        metadatas = metadatas or [{} for _ in ids]
+        documents = documents or [None for _ in ids]
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = vectors.shape[1]
+                self._grow(len(ids))
+            elif vectors.shape[1] != self.dimension:
+                raise ValueError(f"Vector có {vectors.shape[1]} chiều, index yêu cầu {self.dimension} chiều")
+
+            # Id đã có giữ nguyên dòng, id mới dùng lại dòng đã xóa rồi mới cấp dòng mới
+            existing = dict(self._lookup_rows(ids))
+            new_ids = [chunk_id for chunk_id in dict.fromkeys(ids) if chunk_id not in existing]
+            free = [row for (row,) in self._conn.execute(
+                "SELECT row FROM free_rows ORDER BY row LIMIT ?", (len(new_ids),))]
+            if free:
+                self._conn.executemany("DELETE FROM free_rows WHERE row = ?", [(row,) for row in free])
+            fresh = len(new_ids) - len(free)
+            self._count += len(new_ids)
+            rows_for_new = free + list(range(self._size, self._size + fresh))
+            self._grow(self._size + fresh)
+            self._size += fresh
+            existing.update(zip(new_ids, rows_for_new))
+
+            rows = np.array([existing[chunk_id] for chunk_id in ids], dtype=np.int64)
+            self._encode(rows, vectors)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (id, row, document, metadata) VALUES (?, ?, ?, ?)",
+                [(chunk_id, int(row), document, json.dumps(metadata or {}, ensure_ascii=False))
+                 for chunk_id, row, document, metadata in zip(ids, rows, documents, metadatas)]
+            )
+            if self._ivf is not None:
+                self._assign_ivf(rows)
+            if self._ivf_written is not None:
+                self._ivf_written.append(rows)
+            self._alive[rows] = True
+            self._save_info()
+            self._conn.commit()
+            self._publish()
+
+    def update_metadata(self, ids: List[str], metadatas: List[dict]):
+        """Cập nhật metadata của các chunk đã lưu (không đổi vector)"""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE chunks SET metadata = ? WHERE id = ?",
+                [(json.dumps(metadata or {}, ensure_ascii=False), chunk_id)
+                 for chunk_id, metadata in zip(ids, metadatas)]
+            )
+            self._conn.commit()
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        if self._embedding is None:
+            raise ValueError("Cần embedding_function để thêm văn bản")
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        self.upsert_vectors(ids, self._embedding.embed_documents(texts), metadatas, texts)
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return False
+        with self._lock:
+            rows = [row for _, row in self._lookup_rows(ids)]
+            if not rows:
+                return False
+            self._count -= len(rows)
+            self._alive[rows] = False
+            self._vectors[rows] = 0
+            self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(chunk_id,) for chunk_id in ids])
+            self._conn.executemany("INSERT OR IGNORE INTO free_rows (row) VALUES (?)", [(row,) for row in rows])
+            self._conn.commit()
+        return True
+
+    def persist(self):
+        """Ghi các file vector xuống đĩa; dựng lại IVF khi số vector đã tăng nhiều kể từ lần dựng trước"""
+        with self._lock:
+            if self._vectors is None:
+                return
+            self._vectors.flush()
+            if self._scales is not None:
+                self._scales.flush()
+            rebuild = self._wants_ivf() and (self._ivf is None or len(self) > 2 * self._ivf_trained)
+        if rebuild:
+            self.build_ivf()
+        with self._lock:
+            self._save_info()
+            self._conn.commit()
+
+    def delete_collection(self):
+        """
+        Xóa toàn bộ dữ liệu của store trên đĩa. Kết nối SQLite và các memmap không bị đóng: truy vấn đang chạy
+        vẫn đọc được dữ liệu cũ qua các file đang mở, kết nối được đóng khi store cũ không còn được tham chiếu.
+        Sau khi xóa, tạo store mới để ghi tiếp.
+        """
+        with self._lock:
+            shutil.rmtree(self.persist_directory, ignore_errors=True)
+
+    # ----- IVF -----
+
+    def _wants_ivf(self):
+        return self.index_type == "ivf" or (self.index_type == "auto" and len(self) >= self.ivf_min_size)
+
+    def build_ivf(self, iterations=8, seed=0):
+        """
+        Chia các vector thành nlist cụm bằng k-means (cosine) và ghi nhận cụm của từng vector.
+        K-means và việc gán cụm chạy ngoài khóa trên trạng thái đã công bố; khi công bố kết quả,
+        các dòng được ghi trong lúc dựng được gán cụm lại.
+        """
+        with self._build_lock:
+            with self._lock:
+                vectors, scales, alive, _, size = self._snapshot
+                alive_rows = np.flatnonzero(alive[:size])
+                if len(alive_rows) == 0:
+                    return
+                self._ivf_written = []
+            try:
+                centroids, assign = self._train_ivf(vectors, scales, alive_rows, size, iterations, seed)
+            except BaseException:
+                with self._lock:
+                    self._ivf_written = None
+                raise
+
+            with self._lock:
+                written, self._ivf_written = self._ivf_written, None
+                full = np.full(self._capacity, -1, dtype=np.int32)
+                full[:size] = assign
+                self._ivf = {"centroids": centroids, "assign": full}
+                stale = np.unique(np.concatenate(written + [np.arange(size, self._size, dtype=np.int64)]))
+                self._assign_ivf(stale[self._alive[stale]])
+                self._ivf_trained = len(alive_rows)
+                np.save(self._path("ivf_centroids.npy"), centroids)
+                self._publish()
+            print(f"Đã dựng IVF với {len(centroids)} cụm cho {len(alive_rows)} vectors")
+
+    def _train_ivf(self, vectors, scales, alive_rows, size, iterations, seed):
+        """K-means trên một mẫu các dòng còn dùng, trả về (centroids, cụm của từng dòng < size)"""
+        nlist = self.nlist or int(min(4096, max(8, round(math.sqrt(len(alive_rows))))))
+        nlist = min(nlist, len(alive_rows))
+        rng = np.random.RandomState(seed)
+        # Huấn luyện trên một mẫu con để thời gian dựng không tăng theo kích thước corpus
+        sample_rows = np.sort(rng.choice(alive_rows, size=min(len(alive_rows), 64 * nlist), replace=False))
+        sample = self._decode(vectors, scales, sample_rows)
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = np.bincount(labels, minlength=nlist) == 0
+            # Cụm rỗng được khởi tạo lại bằng một vector ngẫu nhiên
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+            centroids = _normalize(sums)
+        centroids = centroids.astype(np.float32)
+        assign = np.full(size, -1, dtype=np.int32)
+        for start in range(0, len(alive_rows), _BLOCK_ROWS):
+            block_rows = alive_rows[start:start + _BLOCK_ROWS]
+            assign[block_rows] = np.argmax(self._decode(vectors, scales, block_rows) @ centroids.T, axis=1)
+        return centroids, assign
+
+    def _assign_ivf(self, rows):
+        ivf = self._ivf
+        assign = ivf["assign"]
+        for start in range(0, len(rows), _BLOCK_ROWS):
+            block_rows = rows[start:start + _BLOCK_ROWS]
+            block = self._decode(self._vectors, self._scales, block_rows)
+            assign[block_rows] = np.argmax(block @ ivf["centroids"].T, axis=1)
+        # Danh sách dòng của từng cụm được dựng lại khi tìm kiếm
+        self._ivf = {"centroids": ivf["centroids"], "assign": assign}
+        np.save(self._path("ivf_assign.npy"), assign[:self._size])
+
+    def _load_ivf(self):
+        centroids_path, assign_path = self._path("ivf_centroids.npy"), self._path("ivf_assign.npy")
+        if not (os.path.exists(centroids_path) and os.path.exists(assign_path)):
+            return
+        assign = np.full(self._capacity, -1, dtype=np.int32)
+        stored = np.load(assign_path)
+        assign[:len(stored)] = stored
+        self._ivf = {"centroids": np.load(centroids_path), "assign": assign}
+        # Vector được ghi sau lần lưu cuối chưa có cụm
+        missing = np.flatnonzero(self._alive[:self._size] & (assign[:self._size] < 0))
+        if len(missing):
+            self._assign_ivf(missing)
+
+    @staticmethod
+    def _ivf_lists(ivf, size):
+        """Dòng của từng cụm (sắp xếp theo cụm) và vị trí bắt đầu của mỗi cụm, tính một lần cho mỗi lần ghi"""
+        lists = ivf.get("lists")
+        if lists is None or lists[0] != size:
+            assign = ivf["assign"][:size]
+            order = np.argsort(assign, kind="stable").astype(np.int64)
+            offsets = np.searchsorted(assign[order], np.arange(len(ivf["centroids"]) + 1))
+            lists = ivf["lists"] = (size, order, offsets)
+        return lists[1], lists[2]
+
+    # ----- Đọc -----
+
+    def __len__(self):
+        return self._count
+
+    def _reader(self):
+        """Kết nối SQLite chỉ đọc của luồng hiện tại, mở khi cần"""
+        conn = getattr(self._readers, "conn", None)
+        if conn is None:
+            path = os.path.abspath(os.path.join(self.persist_directory, self.META_FILE))
+            conn = sqlite3.connect(f"file:{quote(path)}?mode=ro", uri=True, check_same_thread=False)
+            self._readers.conn = conn
+        return conn
+
+    def _read(self, query, params=()):
+        """Chạy truy vấn đọc qua kết nối chỉ đọc (thấy dữ liệu đã commit gần nhất), không giữ self._lock"""
+        try:
+            conn = self._reader()
+        except sqlite3.OperationalError:
+            # Thư mục đã bị xóa (delete_collection) trước khi luồng này mở kết nối: đọc qua kết nối ghi còn mở
+            with self._lock:
+                return self._conn.execute(query, params).fetchall()
+        return conn.execute(query, params).fetchall()
+
+    def _lookup_rows(self, ids, read=None):
+        read = read or (lambda query, params: self._conn.execute(query, params).fetchall())
+        found = []
+        for start in range(0, len(ids), 500):
+            batch = list(ids[start:start + 500])
+            placeholders = ",".join("?" * len(batch))
+            found.extend(read(f"SELECT id, row FROM chunks WHERE id IN ({placeholders})", batch))
+        return found
+
+    @staticmethod
+    def _metadata_key(key):
+        if not _METADATA_KEY.match(key):
+            raise ValueError(f"Khóa metadata không hợp lệ: {key}")
+        return key
+
+    @classmethod
+    def _metadata_expr(cls, key):
+        return f"json_extract(metadata, '$.{cls._metadata_key(key)}')"
+
+    @classmethod
+    def _where_sql(cls, where, params):
+        """
+        Dịch bộ lọc cú pháp "where" của Chroma sang SQL: {"key": value}, {"key": {"$gte": v}},
+        {"key": {"$in": [...]}}, {"$and": [...]}, {"$or": [...]}
+        """
+        clauses = []
+        for key, condition in where.items():
+            if key in ("$and", "$or"):
+                parts = [cls._where_sql(part, params) for part in condition]
+                clauses.append("(" + (" AND " if key == "$and" else " OR ").join(parts) + ")")
+                continue
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for operator, value in condition.items():
+                expr = cls._metadata_expr(key)
+                if operator in ("$in", "$nin"):
+                    params.extend(value)
+                    negate = "NOT " if operator == "$nin" else ""
+                    clauses.append(f"{expr} {negate}IN ({','.join('?' * len(value))})")
+                elif operator in _SQL_OPERATORS:
+                    params.append(value)
+                    clauses.append(f"{expr} {_SQL_OPERATORS[operator]} ?")
+                else:
+                    raise ValueError(f"Toán tử không hỗ trợ: {operator}")
+        return " AND ".join(clauses) if clauses else "1"
+
+    def _filter_rows(self, filter):
+        """Các dòng có metadata khớp bộ lọc (cú pháp "where" của Chroma)"""
+        params = []
+        query = "SELECT row FROM chunks WHERE " + self._where_sql(filter, params)
+        return np.array([row for (row,) in self._read(query, params)], dtype=np.int64)
+
+    def _search(self, query_vector, k, filter=None):
+        """Trả về (scores, rows) của k vector có cosine lớn nhất"""
+        return self._search_many([query_vector], k, filter)[0]
+
+    def _search_many(self, query_vectors, k, filter=None):
+        """Tìm k vector gần nhất cho nhiều câu hỏi trong một lượt quét, trả về danh sách (scores, rows)"""
+        # Đọc trạng thái đã công bố một lần; lần ghi đồng thời chỉ công bố tuple mới
+        vectors, scales, alive, ivf, size = self._snapshot
+        queries = _normalize(np.atleast_2d(np.asarray(query_vectors, dtype=np.float32)))
+        if vectors is None or size == 0:
+            return [(np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)) for _ in queries]
+
+        if filter:
+            return self._scan(vectors, scales, alive, size, queries, k, self._filter_rows(filter))
+        if ivf is not None and self._wants_ivf():
+            # Mỗi câu hỏi quét các cụm khác nhau
+            order, offsets = self._ivf_lists(ivf, size)
+            results = []
+            for query in queries:
+                probes = np.argsort(-(ivf["centroids"] @ query))[:self.nprobe]
+                candidates = np.concatenate([order[offsets[p]:offsets[p + 1]] for p in probes])
+                results.extend(self._scan(vectors, scales, alive, size, query[None, :], k, candidates))
+            return results
+        return self._scan(vectors, scales, alive, size, queries, k)
+
+    def _scan(self, vectors, scales, alive, size, queries, k, candidates=None):
+        """Tính cosine theo từng khối dòng (toàn bộ hoặc các dòng ứng viên) cho ma trận câu hỏi"""
+        best = [(np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)) for _ in queries]
+        total = size if candidates is None else len(candidates)
+        for start in range(0, total, _BLOCK_ROWS):
+            if candidates is None:
+                # Quét toàn bộ: đọc từng khối liên tiếp, bỏ các dòng đã xóa sau khi tính điểm
+                end = min(start + _BLOCK_ROWS, size)
+                scores = np.asarray(vectors[start:end], dtype=np.float32) @ queries.T
+                if scales is not None:
+                    scores *= np.asarray(scales[start:end])[:, None]
+                mask = alive[start:end]
+                rows = np.arange(start, end, dtype=np.int64)[mask]
+                scores = scores[mask]
+            else:
+                rows = candidates[start:start + _BLOCK_ROWS]
+                # Bộ lọc đọc SQLite sau khi lấy trạng thái, có thể trả về dòng mới ghi nằm ngoài trạng thái đó
+                rows = rows[rows < size]
+                rows = np.sort(rows[alive[rows]])
+                scores = self._decode(vectors, scales, rows) @ queries.T
+            if not len(rows):
+                continue
+            for j, (best_scores, best_rows) in enumerate(best):
+                best[j] = _top_k(np.concatenate([best_scores, scores[:, j]]),
+                                 np.concatenate([best_rows, rows]), k)
+        return best
+
+    def _documents_for_rows(self, rows):
+        found = {}
+        rows = [int(row) for row in rows]
+        for start in range(0, len(rows), 500):
+            batch = rows[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            for row, chunk_id, document, metadata in self._read(
+                    f"SELECT row, id, document, metadata FROM chunks WHERE row IN ({placeholders})", batch):
+                found[row] = (chunk_id, document, json.loads(metadata) if metadata else {})
+        return [found.get(row) for row in rows]
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[dict] = None,
+                                               **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vectors_with_score([embedding], k, filter)[0]
+
+    def similarity_search_by_vectors_with_score(self, embeddings: List[List[float]], k: int = 4,
+                                                filter: Optional[dict] = None) -> List[List[Tuple[Document, float]]]:
+        """Tìm kiếm cho nhiều vector câu hỏi cùng lúc (một lượt quét dữ liệu cho cả batch)"""
+        results = []
+        for scores, rows in self._search_many(embeddings, k, filter):
+            docs = []
+            for score, item in zip(scores, self._documents_for_rows(rows)):
+                if item is not None:
+                    docs.append((Document(page_content=item[1] or "", metadata=item[2]), 1.0 - float(score)))
+            results.append(docs)
+        return results
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[dict] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[dict] = None,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k, filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None,
+                          **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        # Khoảng cách là 1 - cosine
+        return lambda distance: 1.0 - distance
+
+    def get(self, ids: Optional[List[str]] = None, include: Optional[List[str]] = None,
+            limit: Optional[int] = None, offset: int = 0):
+        """
+        Đọc dữ liệu đã lưu theo định dạng giống Chroma.get
+
+        Returns:
+            Dict {"ids", "documents", "metadatas"} (kèm "embeddings" nếu include có "embeddings")
+        """
+        include = include or ["documents", "metadatas"]
+        if ids is not None:
+            rows = [row for _, row in self._lookup_rows(ids, self._read)]
+            items = [(row, item) for row, item in zip(rows, self._documents_for_rows(rows)) if item]
+        else:
+            query = "SELECT row, id, document, metadata FROM chunks ORDER BY row"
+            params = ()
+            if limit is not None:
+                query += " LIMIT ? OFFSET ?"
+                params = (limit, offset)
+            items = [(row, (chunk_id, document, json.loads(metadata) if metadata else {}))
+                     for row, chunk_id, document, metadata in self._read(query, params)]
+        result = {"ids": [item[0] for _, item in items]}
+        if "documents" in include:
+            result["documents"] = [item[1] for _, item in items]
+        if "metadatas" in include:
+            result["metadatas"] = [item[2] for _, item in items]
+        if "embeddings" in include:
+            rows = np.array([row for row, _ in items], dtype=np.int64)
+            # Đọc memmap sau SQLite: file vector được mở rộng trước khi commit nên đủ chỗ cho mọi dòng đã đọc
+            result["embeddings"] = self._decode(self._vectors, self._scales, rows) \
+                if len(rows) else np.empty((0, self.dimension or 0), dtype=np.float32)
+        return result
+
+    def warm_up(self):
+        """Đọc toàn bộ file vector một lượt để đưa vào page cache, trả về số byte đã đọc"""
+        vectors, _, _, _, size = self._snapshot
+        if vectors is None:
+            return 0
+        for start in range(0, size, _BLOCK_ROWS):
+            np.asarray(vectors[start:start + _BLOCK_ROWS]).sum()
+        return size * self.dimension * vectors.itemsize
+
+    def stats(self):
+        """Số vector, kiểu lưu, chế độ tìm kiếm và dung lượng trên đĩa"""
+        disk = 0
+        for entry in os.scandir(self.persist_directory):
+            if entry.is_file():
+                disk += entry.stat().st_size
+        return {
+            "vectors": len(self),
+            "dimension": self.dimension,
+            "dtype": self.dtype,
+            "index": "ivf" if self._ivf is not None and self._wants_ivf() else "exact",
+            "nlist": len(self._ivf["centroids"]) if self._ivf is not None else None,
+            "vector_bytes": self._size * (self.dimension or 0) * np.dtype(DTYPES[self.dtype]).itemsize,
+            "disk_bytes": disk
+        }
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, persist_directory: str = "./quantized_db",
+                   **kwargs: Any) -> "QuantizedVectorStore":
+        store = cls(persist_directory, embedding_function=embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        store.persist()
+        return store
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self._embedding
+
+    @classmethod
+    def exists(cls, persist_directory):
+        """Thư mục đã chứa dữ liệu của QuantizedVectorStore hay chưa"""
+        return os.path.exists(os.path.join(persist_directory, cls.META_FILE))
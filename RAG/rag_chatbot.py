@@ -4,27 +4,119 @@ RAG Chatbot Tương Tác Liên Tục - Cho phép Q&A liên tục với dữ li
 from dotenv import load_dotenv
 import os
 import shutil
+import threading
 import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+
+import chromadb
+import numpy as np
 
 # Import từ langchain_community thay vì langchain
 from langchain_community.document_loaders import TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
+from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_community.vectorstores import Chroma  # Sửa import từ langchain_community
-from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
-from langchain.memory import ConversationBufferMemory
 
-# Nạp biến môi trường từ .env
-load_dotenv()
-API = os.getenv('API_KEY')
-os.environ["GOOGLE_API_KEY"] = API
+from answer_cache import AnswerCache
+from bm25_index import BM25Index, bm25_path_for
+from context_packing import ContextPacker, estimate_tokens
+from doc_metadata import FILTER_KEYS, document_metadata, ingest_day, normalize_filter
+from embedding_backends import (check_embedding_info, embedding_info_path_for, load_embedding_info, make_embeddings,
+                                save_embedding_info, GEMINI_EMBEDDING_MODEL)
+from embedding_cache import CachedEmbeddings, embedding_cache_path_for
+from gemini_client import GeminiClient, RateLimitedChatModel, RateLimitedEmbeddings, is_rate_limit_error
+from hybrid_retriever import HybridRetriever
+from ingest_manifest import IngestManifest, manifest_path_for, make_chunk_ids
+from markdown_chunker import MarkdownChunker
+from metrics import REGISTRY, QueryTrace, timed
+from near_dedup import NearDuplicateIndex, near_dedup_path_for
+from quantized_store import QuantizedVectorStore
+from session_memory import SessionMemoryStore, history_as_str
+from sharded_store import (ShardedVectorStore, iter_records, search_by_vectors, shards_path_for, update_metadata,
+                           upsert_vectors, warm_up_store)
+from snapshot import Snapshot, write_snapshot
+
+
+def configure_environment():
+    """Nạp biến môi trường từ .env và dùng API_KEY làm GOOGLE_API_KEY cho client Gemini"""
+    load_dotenv()
+    api_key = os.getenv('API_KEY')
+    if api_key:
+        os.environ["GOOGLE_API_KEY"] = api_key
+
+# Trạng thái index đang phục vụ truy vấn. Được thay thế nguyên khối (không sửa tại chỗ)
+# để các truy vấn đang chạy luôn dùng một cặp vectorstore/retriever nhất quán
+IndexState = namedtuple("IndexState", ["vectorstore", "retriever"])
+EMPTY_INDEX = IndexState(None, None)
+
+# Prompt trả lời câu hỏi dựa trên lịch sử hội thoại và context đã lắp ráp
+_QA_TEMPLATE = """
+        Bạn là trợ lý AI có kiến thức chuyên sâu. Nhiệm vụ của bạn là trả lời câu hỏi dựa trên các tài liệu.
+        
+        Lịch sử trò chuyện:
+        {chat_history}
+        
+        Thông tin từ tài liệu:
+        {context}
+        
+        Câu hỏi: {query}
+        
+        Trả lời bằng tiếng Việt, rõ ràng và ngắn gọn. Hãy dựa vào thông tin từ tài liệu.
+        Nếu không tìm thấy thông tin trong dữ liệu, hãy nói rằng bạn không biết câu trả lời dựa trên dữ liệu hiện có.
+        
+        Câu trả lời:
+        """
+
+QA_PROMPT = PromptTemplate(template=_QA_TEMPLATE, input_variables=["chat_history", "context", "query"])
+
+# Câu trả lời khi API vẫn từ chối vì vượt quota sau khi đã thử lại
+RATE_LIMITED_MESSAGE = "Hệ thống đang vượt giới hạn gọi API, vui lòng thử lại sau ít phút."
 
 class InteractiveRAGChatbot:
     def __init__(self, 
                  persist_directory: str = "./chroma_db",
                  model_name: str = "gemini-1.5-pro-latest", 
-                 temperature: float = 0.2):
+                 temperature: float = 0.2,
+                 load_workers: int = 4,
+                 embed_batch_size: int = 64,
+                 max_inflight_embeddings: int = 4,
+                 embedding_cache_size: int = 200000,
+                 answer_cache_size: int = 512,
+                 answer_cache_ttl: float = 3600,
+                 answer_cache_similarity: float = None,
+                 memory_window: int = 5,
+                 memory_token_limit: int = None,
+                 summarize_history: bool = False,
+                 session_idle_ttl: float = 1800,
+                 retrieval_k: int = 3,
+                 hybrid_search: bool = True,
+                 hybrid_fetch_k: int = 10,
+                 vector_weight: float = 1.0,
+                 lexical_weight: float = 1.0,
+                 context_token_budget: int = 1200,
+                 context_candidates: int = 20,
+                 mmr_lambda: float = 0.5,
+                 near_dedup_threshold: float = 0.9,
+                 vector_backend: str = "chroma",
+                 vector_dtype: str = "float16",
+                 vector_index: str = "auto",
+                 batch_concurrency: int = 8,
+                 chunker: str = "markdown",
+                 chunk_tokens: int = 300,
+                 min_chunk_tokens: int = 60,
+                 shard_by: str = None,
+                 shard_search_workers: int = 8,
+                 requests_per_minute: int = None,
+                 tokens_per_minute: int = None,
+                 api_max_retries: int = 5,
+                 embedding_backend: str = "gemini",
+                 embedding_model: str = None,
+                 embedding_dimension: int = None,
+                 embedding_workers: int = None,
+                 embeddings=None,
+                 llm=None):
         """
         Khởi tạo RAG chatbot tương tác liên tục
         
@@ -32,65 +124,605 @@ class InteractiveRAGChatbot:
             persist_directory: Thư mục để lưu trữ vector database
             model_name: Tên model Gemini để sử dụng
             temperature: Giá trị temperature cho LLM (0.0-1.0)
+            load_workers: Số worker đọc và chia nhỏ file song song khi tải tài liệu
+            embed_batch_size: Số chunk trong mỗi request embedding
+            max_inflight_embeddings: Số request embedding được chạy đồng thời tối đa
+            embedding_cache_size: Số vector tối đa được giữ trong cache embedding trên đĩa
+            answer_cache_size: Số câu trả lời tối đa trong cache câu trả lời
+            answer_cache_ttl: Thời gian sống của câu trả lời trong cache (giây)
+            answer_cache_similarity: Ngưỡng cosine cho tầng cache tương đồng (ví dụ 0.95), None để tắt
+            memory_window: Số lượt hỏi đáp gần nhất được giữ trong lịch sử của mỗi session
+            memory_token_limit: Giới hạn token cho lịch sử của mỗi session (thay cho memory_window)
+            summarize_history: Tóm tắt các lượt cũ vượt memory_token_limit thay vì bỏ đi
+            session_idle_ttl: Xóa lịch sử của session không hoạt động quá số giây này
+            retrieval_k: Số chunk đưa vào prompt
+            hybrid_search: Kết hợp tìm kiếm từ khóa BM25 với tìm kiếm vector
+            hybrid_fetch_k: Số kết quả lấy từ mỗi nguồn trước khi gộp
+            vector_weight: Trọng số của kết quả vector khi gộp
+            lexical_weight: Trọng số của kết quả BM25 khi gộp
+            context_token_budget: Ngân sách token cho phần context của prompt, None để dùng đúng retrieval_k chunk
+            context_candidates: Số chunk ứng viên được truy xuất trước khi chọn lọc bằng MMR
+            mmr_lambda: Hệ số MMR giữa độ liên quan (1.0) và độ đa dạng (0.0)
+            near_dedup_threshold: Ngưỡng tương đồng (0-1) để gộp chunk gần trùng giữa các tài liệu, None để tắt
+            vector_backend: "chroma" hoặc "quantized" (QuantizedVectorStore: vector float16/int8 memory-mapped)
+            vector_dtype: Kiểu lưu vector của backend "quantized" ("float16" hoặc "int8")
+            vector_index: Chế độ tìm kiếm của backend "quantized" ("exact", "ivf" hoặc "auto")
+            batch_concurrency: Số lời gọi LLM chạy đồng thời mặc định của query_batch
+            chunker: "markdown" (chia theo tiêu đề, kích thước tính bằng token) hoặc "recursive"
+                     (splitter cũ: 1000 ký tự, chồng lấn 200)
+            chunk_tokens: Số token tối đa của một chunk khi chunker="markdown"
+            min_chunk_tokens: Section ngắn hơn số token này được gộp với section tiếp theo
+            shard_by: Chia dữ liệu thành nhiều collection theo một khóa metadata ("source_dir", "doc_type",
+                      "crawl_domain" hoặc "ingest_date"), None để dùng một collection
+            shard_search_workers: Số shard được tìm kiếm song song tối đa
+            requests_per_minute: Số request tối đa mỗi phút gửi tới API (embedding và LLM), None để không giới hạn
+            tokens_per_minute: Số token tối đa mỗi phút gửi tới API, None để không giới hạn
+            api_max_retries: Số lần thử lại khi API trả lỗi 429 hoặc lỗi tạm thời
+            embedding_backend: "gemini" (qua API), "hashing" (băm đặc trưng, chạy cục bộ, không cần tải model)
+                               hoặc "sentence-transformers" (model cục bộ trên đĩa)
+            embedding_model: Tên model Gemini, hoặc thư mục model với backend sentence-transformers
+            embedding_dimension: Số chiều vector của backend hashing (mặc định 768)
+            embedding_workers: Số luồng torch của backend sentence-transformers, None để dùng số lõi CPU
+            embeddings: Embedding model thay thế (ví dụ model giả lập khi benchmark), None để tạo theo
+                        embedding_backend
+            llm: Chat model thay thế, None để dùng Gemini
         """
+        # Nạp biến môi trường khi khởi tạo thay vì lúc import module
+        configure_environment()
+        
         # Lưu trữ thư mục persistance
         self.persist_directory = persist_directory
+        if vector_backend not in ("chroma", "quantized"):
+            raise ValueError(f"vector_backend không hợp lệ: {vector_backend}")
+        self.vector_backend = vector_backend
+        self.vector_dtype = vector_dtype
+        self.vector_index = vector_index
+        self.batch_concurrency = max(1, batch_concurrency)
+        if shard_by is not None and shard_by not in FILTER_KEYS:
+            raise ValueError(f"shard_by không hợp lệ: {shard_by} (chỉ hỗ trợ {', '.join(FILTER_KEYS)})")
+        self.shard_by = shard_by
+        self.shard_search_workers = max(1, shard_search_workers)
+        
+        # Cấu hình pipeline tải tài liệu
+        self.load_workers = max(1, load_workers)
+        self.embed_batch_size = max(1, embed_batch_size)
+        self.max_inflight_embeddings = max(1, max_inflight_embeddings)
+        self.last_ingest_stats = None
+        
+        # Manifest ghi lại các file đã nạp để chỉ nạp lại phần thay đổi
+        self.manifest = IngestManifest(manifest_path_for(persist_directory))
+        
+        # Chỉ mục từ khóa BM25, cập nhật cùng lúc với vector store
+        self.retrieval_k = retrieval_k
+        self.hybrid_search = hybrid_search
+        self.hybrid_fetch_k = max(hybrid_fetch_k, retrieval_k)
+        self.vector_weight = vector_weight
+        self.lexical_weight = lexical_weight
+        self.bm25 = BM25Index(bm25_path_for(persist_directory))
+        
+        # Chỉ mục chunk gần trùng: chunk gần giống một chunk đã lưu của tài liệu khác không được embedding lại
+        self.near_dedup = None
+        if near_dedup_threshold is not None:
+            self.near_dedup = NearDuplicateIndex(near_dedup_path_for(persist_directory),
+                                                 threshold=near_dedup_threshold)
         
-        # Khởi tạo embedding model
-        self.embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+        # Client dùng chung cho mọi lời gọi API: giới hạn tần suất, retry khi gặp 429, gộp request trùng
+        self.gemini_client = GeminiClient(
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            max_retries=api_max_retries
+        )
+        
+        # Khởi tạo embedding model, bọc bởi cache trên đĩa để không embedding lại cùng một văn bản
+        # (cache nằm ngoài lớp giới hạn tần suất nên vector đã có không tốn quota)
+        if embeddings is None:
+            embeddings = make_embeddings(embedding_backend, embedding_model, embedding_dimension, embedding_workers)
+        else:
+            embedding_backend = "custom"
+        embedding_model = getattr(embeddings, "model", None) or type(embeddings).__name__
+        embedding_dimension = getattr(embeddings, "dimension", None)
+        if embedding_backend in ("gemini", "custom"):
+            embeddings = RateLimitedEmbeddings(embeddings, self.gemini_client)
+        self.embeddings = CachedEmbeddings(
+            embeddings,
+            # Backend hashing tính vector nhanh hơn tra cache nên không dùng cache
+            cache_path=embedding_cache_path_for(persist_directory) if embedding_backend != "hashing" else None,
+            model_name=embedding_model,
+            max_entries=embedding_cache_size
+        )
+        
+        # Backend, model và số chiều embedding của index, được ghi cạnh index ở lần ghi đầu tiên
+        # (số chiều của Gemini chỉ biết sau lần embedding đầu tiên)
+        self.embedding_info_path = embedding_info_path_for(persist_directory)
+        self._embedding_dimension = embedding_dimension
+        self.embedding_info = {"backend": embedding_backend, "model": embedding_model,
+                               "dimension": embedding_dimension}
+        self._embedding_recorded = False
+        self._embedding_lock = threading.Lock()
         
         # Khởi tạo LLM
-        self.llm = ChatGoogleGenerativeAI(
-            model=model_name,
-            temperature=temperature,
-            convert_system_message_to_human=True
+        if llm is None:
+            llm = ChatGoogleGenerativeAI(
+                model=model_name,
+                temperature=temperature,
+                convert_system_message_to_human=True
+            )
+        self.llm = RateLimitedChatModel(llm=llm, client=self.gemini_client)
+        
+        # Khởi tạo text splitter (lưu vị trí bắt đầu để gộp các chunk chồng lấn khi lắp context)
+        if chunker == "markdown":
+            self.text_splitter = MarkdownChunker(chunk_tokens=chunk_tokens, min_chunk_tokens=min_chunk_tokens)
+            self.splitter_signature = self.text_splitter.signature
+        elif chunker == "recursive":
+            self.text_splitter = RecursiveCharacterTextSplitter(
+                chunk_size=1000,
+                chunk_overlap=200,
+                length_function=len,
+                add_start_index=True
+            )
+            self.splitter_signature = None
+        else:
+            raise ValueError(f"chunker không hợp lệ: {chunker}")
+        
+        # Prompt trả lời, query() và query_stream() tự lắp context và lịch sử hội thoại vào prompt
+        self.qa_prompt = QA_PROMPT
+        
+        # Lắp ráp context theo ngân sách token: MMR, gộp chunk chồng lấn, bỏ trùng lặp
+        self.context_candidates = max(context_candidates, retrieval_k)
+        self.context_packer = None
+        if context_token_budget:
+            self.context_packer = ContextPacker(
+                self.embeddings,
+                token_budget=context_token_budget,
+                lambda_mult=mmr_lambda
+            )
+        
+        # Cache câu trả lời, tự động xóa khi dữ liệu trong vector store thay đổi
+        self.answer_cache = AnswerCache(
+            max_entries=answer_cache_size,
+            ttl_seconds=answer_cache_ttl,
+            similarity_threshold=answer_cache_similarity
         )
         
-        # Khởi tạo text splitter
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len
+        # Lịch sử hội thoại riêng cho từng session, có giới hạn kích thước
+        self.memories = SessionMemoryStore(
+            window=memory_window,
+            token_limit=memory_token_limit,
+            llm=self.llm,
+            summarize=summarize_history,
+            idle_ttl=session_idle_ttl
         )
         
-        # Khởi tạo memory để lưu trữ lịch sử hội thoại
-        self.memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+        # Metrics dùng chung trong tiến trình, xuất qua endpoint /metrics
+        self.metrics = REGISTRY
+        self.metrics.gauge("rag_embedding_cache", "Thống kê cache embedding (hits, misses, entries)",
+                           lambda: self._stats_gauge(self.embeddings.stats()))
+        self.metrics.gauge("rag_answer_cache", "Thống kê cache câu trả lời (hits, misses, entries)",
+                           lambda: self._stats_gauge(self.answer_cache.stats()))
+        self.metrics.gauge("rag_gemini_client", "Thống kê lời gọi API (calls, retries, rate_limited, coalesced)",
+                           lambda: self._stats_gauge(self.gemini_client.stats()))
+        
+        # Index đang phục vụ truy vấn và khóa cho các thao tác ghi (tải tài liệu, reset)
+        self._index = EMPTY_INDEX
+        self._write_lock = threading.RLock()
+        # Thư mục tạm của import_snapshot đã được mở trong tiến trình này chưa
+        self._staging_opened = False
         
         # Tải vector store nếu đã tồn tại, nếu không thì tạo mới
         self._initialize_vectorstore()
-        
-        # QA chain sẽ được khởi tạo khi cần
-        self.qa_chain = None
+    
+    @staticmethod
+    def _stats_gauge(stats):
+        """Chuyển dict thống kê của cache thành các series của gauge (bỏ qua giá trị không phải số)"""
+        return {(("stat", name),): value for name, value in stats.items()
+                if isinstance(value, (int, float)) and not isinstance(value, bool)}
+    
+    @property
+    def memory(self):
+        """Memory của session mặc định (dùng cho chế độ tương tác trên terminal)"""
+        return self.memories.get()
+    
+    @property
+    def vectorstore(self):
+        return self._index.vectorstore
+    
+    @property
+    def retriever(self):
+        return self._index.retriever
+    
+    def _create_vectorstore(self, persist_directory=None):
+        """Mở (hoặc tạo mới) vector store theo backend đã chọn, mặc định tại self.persist_directory"""
+        persist_directory = persist_directory or self.persist_directory
+        if self.shard_by:
+            return ShardedVectorStore(
+                persist_directory,
+                self.shard_by,
+                open_shard=lambda name: self._open_shard(name, persist_directory),
+                embedding_function=self.embeddings,
+                max_workers=self.shard_search_workers
+            )
+        return self._open_shard(None, persist_directory)
+    
+    def _open_shard(self, name, persist_directory=None):
+        """Mở vector store của một shard (name là None: toàn bộ dữ liệu trong một collection)"""
+        persist_directory = persist_directory or self.persist_directory
+        if self.vector_backend == "quantized":
+            return QuantizedVectorStore(
+                os.path.join(persist_directory, "shards", name) if name else persist_directory,
+                embedding_function=self.embeddings,
+                dtype=self.vector_dtype,
+                index_type=self.vector_index,
+                indexed_metadata=FILTER_KEYS
+            )
+        if name:
+            return Chroma(
+                collection_name=name,
+                persist_directory=persist_directory,
+                embedding_function=self.embeddings
+            )
+        return Chroma(
+            persist_directory=persist_directory,
+            embedding_function=self.embeddings
+        )
+    
+    def _chroma_has_data(self):
+        """Thư mục có collection Chroma nào chứa chunk không (sau khi xóa collection, file chroma.sqlite3 vẫn còn)"""
+        if not os.path.exists(os.path.join(self.persist_directory, "chroma.sqlite3")):
+            return False
+        client = chromadb.PersistentClient(path=self.persist_directory)
+        for collection in client.list_collections():
+            if client.get_collection(getattr(collection, "name", collection)).count():
+                return True
+        return False
+    
+    def _check_backend(self):
+        """Không mở thư mục dữ liệu của backend khác hoặc có cách chia shard khác (lỗi khi mở sẽ xóa thư mục)"""
+        is_quantized = QuantizedVectorStore.exists(self.persist_directory) \
+            or os.path.isdir(os.path.join(self.persist_directory, "shards"))
+        is_chroma = self._chroma_has_data()
+        if (self.vector_backend == "quantized" and is_chroma) or (self.vector_backend == "chroma" and is_quantized):
+            raise ValueError(f"Thư mục {self.persist_directory} chứa dữ liệu của backend khác, "
+                             f"không thể mở bằng vector_backend={self.vector_backend}")
+        is_sharded = ShardedVectorStore.exists(self.persist_directory)
+        has_data = is_quantized or is_chroma
+        if is_sharded and not has_data:
+            # Danh sách shard còn sót lại của thư mục đã bị xóa hết dữ liệu: coi như chưa có dữ liệu
+            os.remove(shards_path_for(self.persist_directory))
+            is_sharded = False
+        if (self.shard_by and has_data and not is_sharded) or (not self.shard_by and is_sharded):
+            raise ValueError(f"Thư mục {self.persist_directory} được tạo với cách chia shard khác, "
+                             f"không thể mở bằng shard_by={self.shard_by}")
+        self._check_embedding(has_data)
+    
+    def _check_embedding(self, has_data):
+        """Không mở index được tạo bằng embedding khác (vector không cùng không gian, tìm kiếm sẽ sai)"""
+        if not has_data:
+            # Index rỗng (mới tạo hoặc đã reset) dùng được với mọi embedding, được ghi nhận ở lần ghi đầu tiên
+            return
+        recorded = load_embedding_info(self.embedding_info_path)
+        if recorded is None:
+            # Index tạo trước khi có file thông tin embedding chỉ có thể được tạo bằng Gemini
+            recorded = {"backend": "gemini", "model": GEMINI_EMBEDDING_MODEL, "dimension": None}
+        check_embedding_info(recorded, self.embedding_info)
+        if recorded.get("dimension"):
+            self.embedding_info["dimension"] = recorded["dimension"]
+            self._embedding_recorded = True
+    
+    def _record_embedding(self, vectors):
+        """Từ chối vector sai số chiều; ghi thông tin embedding của index ở lần ghi đầu tiên"""
+        if not len(vectors):
+            return
+        dimension = len(vectors[0])
+        with self._embedding_lock:
+            if self.embedding_info["dimension"] is None:
+                self.embedding_info["dimension"] = dimension
+            elif dimension != self.embedding_info["dimension"]:
+                raise ValueError(f"Vector embedding có {dimension} chiều, "
+                                 f"index dùng {self.embedding_info['dimension']} chiều")
+            if not self._embedding_recorded:
+                save_embedding_info(self.embedding_info_path, self.embedding_info)
+                self._embedding_recorded = True
     
     def _initialize_vectorstore(self):
         """Kiểm tra và tải vector store nếu đã tồn tại"""
         if os.path.exists(self.persist_directory) and os.path.isdir(self.persist_directory):
+            self._check_backend()
             try:
                 print(f"Tìm thấy vector database tại {self.persist_directory}, đang tải...")
-                self.vectorstore = Chroma(
-                    persist_directory=self.persist_directory,
-                    embedding_function=self.embeddings
-                )
+                vectorstore = self._create_vectorstore()
                 print(f"Đã tải vector database thành công")
-                # Khởi tạo QA chain ngay khi tải vector store
-                self._setup_qa_chain()
+                if self.hybrid_search and len(self.bm25) == 0:
+                    self._rebuild_bm25(vectorstore)
+                if self.near_dedup is not None and len(self.near_dedup) == 0:
+                    self._rebuild_near_dedup(vectorstore)
+                # Đưa index vào phục vụ ngay khi tải vector store
+                self._activate_index(vectorstore)
             except Exception as e:
                 print(f"Lỗi khi tải vector database: {e}")
                 print("Sẽ tạo mới vector database...")
                 # Xóa thư mục có vấn đề
                 shutil.rmtree(self.persist_directory)
-                self.vectorstore = None
+                self.manifest.clear()
+                self._index = EMPTY_INDEX
         else:
             print("Chưa có vector database, sẽ được tạo khi tải tài liệu đầu tiên")
-            self.vectorstore = None
+            self._index = EMPTY_INDEX
     
-    def load_documents(self, file_paths, force_reload=False):
+    def warm_up(self, pretouch=False):
         """
-        Tải một hoặc nhiều tài liệu vào vector store
+        Làm nóng index để truy vấn đầu tiên không phải chịu chi phí nạp index từ đĩa
+        
+        Args:
+            pretouch: Nếu True, đọc trước các file index (*.bin, file vector) để đưa vào page cache của hệ điều hành
+            
+        Returns:
+            Dict thời gian (giây) của từng bước
+        """
+        timings = {}
+        if pretouch:
+            start = time.perf_counter()
+            touched = self._pretouch_index_files()
+            timings["pretouch_seconds"] = time.perf_counter() - start
+            print(f"Đã đọc trước {touched / (1024 * 1024):.1f} MB file index "
+                  f"trong {timings['pretouch_seconds']:.2f}s")
+        
+        index = self._index
+        if index.vectorstore is not None:
+            # Chroma: truy vấn bằng một vector đã lưu để nạp segment HNSW; QuantizedVectorStore: đọc
+            # một lượt file vector vào page cache (không gọi API embedding)
+            start = time.perf_counter()
+            try:
+                warm_up_store(index.vectorstore)
+            except Exception as e:
+                print(f"Không thể làm nóng index: {e}")
+            timings["index_warmup_seconds"] = time.perf_counter() - start
+        return timings
+    
+    def _pretouch_index_files(self):
+        """Đọc tuần tự các file HNSW của Chroma (hoặc file vector của QuantizedVectorStore), trả về tổng số byte đã đọc"""
+        touched = 0
+        for root, _, files in os.walk(self.persist_directory):
+            for name in files:
+                if not name.endswith((".bin", ".f16", ".i8")):
+                    continue
+                try:
+                    with open(os.path.join(root, name), "rb") as f:
+                        while True:
+                            block = f.read(1024 * 1024)
+                            if not block:
+                                break
+                            touched += len(block)
+                except OSError as e:
+                    print(f"Không đọc được {name}: {e}")
+        return touched
+    
+    def _rebuild_bm25(self, vectorstore, bm25=None):
+        """Dựng chỉ mục BM25 từ dữ liệu có sẵn trong vector store (database tạo trước khi có BM25)"""
+        bm25 = bm25 or self.bm25
+        data = vectorstore.get(include=["documents", "metadatas"])
+        if not data["ids"]:
+            return
+        print(f"Đang dựng chỉ mục BM25 cho {len(data['ids'])} chunks có sẵn...")
+        bm25.add(data["ids"], data["documents"], data["metadatas"])
+        bm25.save()
+    
+    def _rebuild_near_dedup(self, vectorstore):
+        """Dựng chỉ mục chunk gần trùng từ các chunk có sẵn (mỗi chunk là một bản lưu riêng)"""
+        data = vectorstore.get(include=["documents", "metadatas"])
+        if not data["ids"]:
+            return
+        print(f"Đang dựng chỉ mục chunk gần trùng cho {len(data['ids'])} chunks có sẵn...")
+        for chunk_id, text, metadata in zip(data["ids"], data["documents"], data["metadatas"]):
+            self.near_dedup.add(chunk_id, self.near_dedup.signature(text), metadata or {})
+        self.near_dedup.save()
+    
+    def _drop_index(self):
+        """Gỡ index hiện tại khỏi phục vụ rồi xóa dữ liệu (phải giữ write lock khi gọi)"""
+        old_index = self._index
+        self._index = EMPTY_INDEX
+        if old_index.vectorstore is not None:
+            # Xóa collection qua API thay vì xóa thư mục khi các truy vấn khác có thể đang đọc
+            old_index.vectorstore.delete_collection()
+            shutil.rmtree(os.path.join(self.persist_directory, "shards"), ignore_errors=True)
+        elif os.path.exists(self.persist_directory):
+            shutil.rmtree(self.persist_directory)
+        self.manifest.clear()
+        self.bm25.clear()
+        if self.near_dedup is not None:
+            self.near_dedup.clear()
+        self.answer_cache.clear()
+        with self._embedding_lock:
+            # Ghi đè thông tin embedding bằng embedding đang dùng (không xóa file: thư mục Chroma rỗng
+            # vẫn còn file chroma.sqlite3, thiếu file này sẽ bị coi là index cũ tạo bằng Gemini)
+            self.embedding_info["dimension"] = self._embedding_dimension
+            save_embedding_info(self.embedding_info_path, self.embedding_info)
+            self._embedding_recorded = False
+    
+    def reset_database(self):
+        """Xóa toàn bộ dữ liệu trong vector database"""
+        with self._write_lock:
+            self._drop_index()
+        print(f"Đã xóa toàn bộ vector database tại {self.persist_directory}")
+    
+    def _sidecar_files(self, persist_directory=None):
+        """Các file phụ nằm cạnh vector store, được đóng gói cùng snapshot"""
+        persist_directory = persist_directory or self.persist_directory
+        files = {"manifest": manifest_path_for(persist_directory), "bm25": bm25_path_for(persist_directory)}
+        if self.near_dedup is not None:
+            files["near_dedup"] = near_dedup_path_for(persist_directory)
+        return files
+    
+    def _fill_from_snapshot(self, vectorstore, snapshot, batch_size):
+        """Ghi toàn bộ chunk và vector của snapshot vào vector store"""
+        for row, ids, documents, metadatas in snapshot.iter_chunks(batch_size):
+            vectors = np.asarray(snapshot.vectors[row:row + len(ids)], dtype=np.float32)
+            self._record_embedding(vectors)
+            upsert_vectors(vectorstore, ids, vectors, metadatas, documents)
+        vectorstore.persist()
+    
+    def _build_staging_index(self, snapshot, staging_directory, batch_size):
+        """
+        Nạp snapshot vào thư mục tạm (vector store, các file phụ và BM25 đủ để phục vụ truy vấn)
+        
+        Returns:
+            (vectorstore, bm25) của index tạm
+        """
+        self._discard_staging_index(staging_directory)
+        self._staging_opened = True
+        vectorstore = self._create_vectorstore(staging_directory)
+        self._fill_from_snapshot(vectorstore, snapshot, batch_size)
+        
+        files = self._sidecar_files(staging_directory)
+        for name in snapshot.files():
+            if name in files:
+                snapshot.extract_file(name, files[name])
+        bm25 = BM25Index(files["bm25"])
+        if self.hybrid_search and len(bm25) == 0:
+            self._rebuild_bm25(vectorstore, bm25)
+        # Snapshot cũ chứa BM25 dạng JSON: ghi lại theo định dạng mảng trước khi chuyển sang thư mục chính
+        bm25.save(compact=True)
+        return vectorstore, bm25
+    
+    def _replace_index(self, old_vectorstore, snapshot, staging_directory, batch_size):
+        """
+        Xóa index cũ, ghi lại snapshot vào thư mục chính rồi đưa vào phục vụ (index tạm phục vụ trong lúc ghi).
+        Không đổi tên thư mục tạm: Chroma giữ client theo đường dẫn, client cũ của thư mục chính sẽ đọc file đã xóa.
+        """
+        if old_vectorstore is not None:
+            old_vectorstore.delete_collection()
+            shutil.rmtree(os.path.join(self.persist_directory, "shards"), ignore_errors=True)
+        self.manifest.clear()
+        self.bm25.clear()
+        if self.near_dedup is not None:
+            self.near_dedup.clear()
+        
+        self._check_backend()
+        vectorstore = self._create_vectorstore()
+        self._fill_from_snapshot(vectorstore, snapshot, batch_size)
+        
+        # Các file phụ đã được giải nén (BM25 đã được dựng lại nếu snapshot không có) trong lúc dựng index tạm
+        files = self._sidecar_files()
+        for name, path in self._sidecar_files(staging_directory).items():
+            if os.path.exists(path):
+                os.replace(path, files[name])
+        self.manifest.load()
+        self.bm25.load()
+        if self.hybrid_search and len(self.bm25) == 0:
+            self._rebuild_bm25(vectorstore)
+        if self.near_dedup is not None:
+            self.near_dedup.load()
+            if len(self.near_dedup) == 0:
+                self._rebuild_near_dedup(vectorstore)
+        self._activate_index(vectorstore)
+    
+    def _discard_staging_index(self, staging_directory, vectorstore=None):
+        """Xóa index tạm và các file phụ của nó"""
+        if vectorstore is None and self._staging_opened:
+            vectorstore = self._create_vectorstore(staging_directory)
+        if vectorstore is not None:
+            # Thư mục đã được mở trong tiến trình này (Chroma giữ client theo đường dẫn): xóa qua API
+            vectorstore.delete_collection()
+            shutil.rmtree(os.path.join(staging_directory, "shards"), ignore_errors=True)
+        else:
+            shutil.rmtree(staging_directory, ignore_errors=True)
+        paths = list(self._sidecar_files(staging_directory).values())
+        paths += [bm25_path_for(staging_directory) + ".log", shards_path_for(staging_directory)]
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+    
+    def export_snapshot(self, path):
+        """
+        Ghi toàn bộ index (chunk, metadata, embedding float16 và các file phụ) ra một file snapshot.
+        Truy vấn vẫn được phục vụ trong lúc ghi; các thao tác tải tài liệu chờ đến khi ghi xong
+        để snapshot nhất quán.
+        
+        Args:
+            path: Đường dẫn file snapshot
+            
+        Returns:
+            Dict thống kê (chunks, bytes, seconds)
+        """
+        start = time.perf_counter()
+        with self._write_lock:
+            vectorstore = self.vectorstore
+            if vectorstore is None:
+                raise ValueError("Chưa có dữ liệu để tạo snapshot")
+            self.manifest.save()
+            # Snapshot chỉ đóng gói file chính của BM25: gộp nhật ký vào trước
+            self.bm25.save(compact=True)
+            if self.near_dedup is not None:
+                self.near_dedup.save()
+            header = write_snapshot(path, iter_records(vectorstore), files=self._sidecar_files(), info={
+                "embedding_backend": self.embedding_info["backend"],
+                "embedding_model": self.embeddings.model_name,
+                "splitter": self.splitter_signature
+            })
+        stats = {"chunks": header["chunks"], "bytes": os.path.getsize(path),
+                 "seconds": round(time.perf_counter() - start, 3)}
+        print(f"Đã ghi snapshot {path}: {stats['chunks']} chunks, "
+              f"{stats['bytes'] / (1024 * 1024):.1f} MB trong {stats['seconds']:.2f}s")
+        return stats
+    
+    def import_snapshot(self, path, verify=True, batch_size=5000):
+        """
+        Thay toàn bộ dữ liệu hiện tại bằng dữ liệu trong file snapshot, không gọi API embedding
+        
+        Args:
+            path: Đường dẫn file snapshot
+            verify: Kiểm tra checksum của mọi section trước khi nạp
+            batch_size: Số chunk ghi vào vector store mỗi lần
+            
+        Returns:
+            Dict thống kê (chunks, seconds)
+            
+        Raises:
+            SnapshotError: File hỏng hoặc sai phiên bản
+            ValueError: Snapshot được tạo bằng backend, model hoặc số chiều embedding khác
+        """
+        start = time.perf_counter()
+        with Snapshot(path) as snapshot:
+            if verify:
+                snapshot.verify()
+            # Snapshot cũ không ghi backend: chỉ so sánh model và số chiều
+            check_embedding_info({"backend": snapshot.header.get("embedding_backend", self.embedding_info["backend"]),
+                                  "model": snapshot.header.get("embedding_model"),
+                                  "dimension": snapshot.dimension}, self.embedding_info, source="Snapshot")
+            
+            with self._write_lock:
+                # Dựng index mới trong thư mục tạm, index cũ vẫn phục vụ truy vấn; lỗi ở bước này giữ nguyên index cũ
+                staging_directory = os.path.normpath(self.persist_directory) + "_staging"
+                try:
+                    staging, staging_bm25 = self._build_staging_index(snapshot, staging_directory, batch_size)
+                except BaseException:
+                    self._discard_staging_index(staging_directory)
+                    raise
+                
+                # Phục vụ index tạm rồi mới xóa index cũ và ghi lại dữ liệu vào thư mục chính
+                old_vectorstore = self.vectorstore
+                self.answer_cache.clear()
+                self._activate_index(staging, bm25=staging_bm25)
+                self._replace_index(old_vectorstore, snapshot, staging_directory, batch_size)
+                self._discard_staging_index(staging_directory, staging)
+        
+        stats = {"chunks": len(snapshot), "seconds": round(time.perf_counter() - start, 3)}
+        print(f"Đã nạp snapshot {path}: {stats['chunks']} chunks trong {stats['seconds']:.2f}s")
+        return stats
+    
+    def load_documents(self, file_paths, force_reload=False, on_file_done=None):
+        """
+        Tải một hoặc nhiều tài liệu vào vector store (chỉ nạp lại các file đã thay đổi)
+        
+        Quy trình gồm các bước chạy song song: một pool đọc + chia nhỏ file,
+        các batch embedding với số request đồng thời bị giới hạn, và ghi (upsert)
+        vào vector store ngay khi mỗi batch hoàn tất để bộ nhớ không tăng theo kích thước corpus.
+        Các truy vấn vẫn được phục vụ trong lúc tải; index mới chỉ được thay thế khi tải xong.
         
         Args:
             file_paths: Đường dẫn đến file hoặc danh sách đường dẫn
             force_reload: Nếu True, xóa database cũ và tạo mới
+            on_file_done: Hàm on_file_done(file_path, status, chunks) được gọi khi mỗi file xong,
+                          status là "done", "skipped" (file không đổi) hoặc "failed"
             
         Returns:
             Số lượng chunks đã tải
@@ -99,208 +731,835 @@ class InteractiveRAGChatbot:
         if isinstance(file_paths, str):
             file_paths = [file_paths]
         
+        # Chỉ một thao tác ghi được chạy tại một thời điểm
+        with self._write_lock:
+            return self._load_documents_locked(file_paths, force_reload, on_file_done)
+    
+    def _load_documents_locked(self, file_paths, force_reload, on_file_done=None):
+        """Phần thân của load_documents, chạy khi đã giữ write lock"""
         # Xóa database cũ nếu yêu cầu
-        if force_reload and os.path.exists(self.persist_directory):
+        if force_reload:
             print(f"Xóa vector database cũ tại {self.persist_directory}")
-            shutil.rmtree(self.persist_directory)
-            self.vectorstore = None
+            self._drop_index()
         
-        # Tải và xử lý tất cả tài liệu
-        all_chunks = []
-        for file_path in file_paths:
-            try:
-                # Kiểm tra file tồn tại
-                if not os.path.exists(file_path):
-                    print(f"File không tồn tại: {file_path}")
+        start_time = time.time()
+        ingest_date = ingest_day(start_time)
+        vectorstore = self.vectorstore
+        created_store = vectorstore is None
+        if created_store:
+            print(f"Tạo mới vector database tại {self.persist_directory}")
+            self._check_backend()
+            vectorstore = self._create_vectorstore()
+        
+        # Trạng thái của từng file: số batch chưa xong và lỗi nếu có
+        file_state = {}
+        in_flight = {}
+        batch_ids, batch_docs, batch_files = [], [], {}
+        total_chunks = 0
+        processed_files = 0
+        skipped = 0
+        # Chunk mới của lần tải này -> future của batch chứa nó (None khi batch chưa được gửi)
+        chunk_batch = {}
+        # Các chunk đã lưu có thêm chunk gần trùng, cần cập nhật metadata nguồn khi tải xong
+        touched = set()
+        collapsed = 0
+        
+        def join_open_batch(path):
+            """File chỉ được ghi nhận khi batch đang gom (chứa chunk của file) đã ghi xong"""
+            if path not in batch_files:
+                batch_files[path] = True
+                file_state[path]["pending"] += 1
+        
+        def depend_on(chunk_id, path):
+            """File có chunk gần trùng với một chunk mới phải chờ batch chứa chunk đó ghi xong"""
+            if chunk_id not in chunk_batch:
+                return
+            future = chunk_batch[chunk_id]
+            if future is None:
+                join_open_batch(path)
+            elif future in in_flight and path not in in_flight[future][1]:
+                in_flight[future][1].append(path)
+                file_state[path]["pending"] += 1
+        
+        def finish_batch(future):
+            """Cập nhật trạng thái các file có chunk nằm trong batch vừa xong"""
+            nonlocal total_chunks
+            count, files, ids = in_flight.pop(future)
+            error = future.exception()
+            if error is None:
+                total_chunks += count
+            else:
+                print(f"Lỗi khi embedding/ghi batch {count} chunks: {error}")
+                if self.near_dedup is not None:
+                    self.near_dedup.discard(ids)
+            for path in files:
+                state = file_state[path]
+                state["pending"] -= 1
+                if error is not None:
+                    state["error"] = error
+                if state["pending"] == 0:
+                    self._finish_file(vectorstore, path, state, on_file_done)
+        
+        def submit_batch(executor):
+            """Gửi batch hiện tại đi embedding, chờ bớt nếu đã đủ số request đồng thời"""
+            nonlocal batch_ids, batch_docs, batch_files
+            while len(in_flight) >= self.max_inflight_embeddings:
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish_batch(future)
+            future = executor.submit(self._embed_and_upsert, vectorstore, batch_ids, batch_docs)
+            in_flight[future] = (len(batch_docs), list(batch_files), batch_ids)
+            for chunk_id in batch_ids:
+                if chunk_id in chunk_batch:
+                    chunk_batch[chunk_id] = future
+            batch_ids, batch_docs, batch_files = [], [], {}
+        
+        with ThreadPoolExecutor(max_workers=self.max_inflight_embeddings) as embed_executor:
+            results = self._iter_split_files(file_paths, skip_unchanged=not created_store, ingest_date=ingest_date)
+            # Mỗi file có đúng một kết quả, theo thứ tự của file_paths
+            for file_path, result in zip(file_paths, results):
+                if result is None:
+                    if on_file_done is not None:
+                        on_file_done(file_path, "failed", 0)
+                    continue
+                if result == "unchanged":
+                    skipped += 1
+                    if on_file_done is not None:
+                        on_file_done(file_path, "skipped", 0)
                     continue
                 
-                print(f"Đang xử lý file: {file_path}")
-                loader = TextLoader(file_path)
-                documents = loader.load()
-                
-                # Chia nhỏ tài liệu
-                chunks = self.text_splitter.split_documents(documents)
-                print(f"  - Đã chia thành {len(chunks)} chunks")
-                all_chunks.extend(chunks)
+                file_path, content_hash, stat, chunks, chunk_ids, stale_ids = result
+                processed_files += 1
                 
-            except Exception as e:
-                print(f"Lỗi khi xử lý file {file_path}: {str(e)}")
+                # Giữ pending = 1 trong lúc chia batch để file không bị ghi nhận quá sớm.
+                # Chunk cũ của file đã thay đổi chỉ bị xóa sau khi chunk mới đã được ghi,
+                # để truy vấn đồng thời không bao giờ thấy file bị thiếu
+                file_state[file_path] = {"hash": content_hash, "stat": stat, "chunk_ids": chunk_ids,
+                                         "stale_ids": stale_ids, "pending": 1, "error": None}
+                for chunk_id, chunk in zip(chunk_ids, chunks):
+                    if self.near_dedup is not None:
+                        # Chunk gần trùng với chunk đã lưu của tài liệu khác: chỉ ghi nhận nguồn, không embedding
+                        signature = self.near_dedup.signature(chunk.page_content)
+                        # Khi chia shard, chunk chỉ được gộp với chunk đã lưu trong cùng shard
+                        scope = {self.shard_by: chunk.metadata.get(self.shard_by)} if self.shard_by else None
+                        canonical_id = self.near_dedup.find(signature, source=chunk.metadata.get("source"),
+                                                            scope=scope)
+                        if canonical_id is not None:
+                            depend_on(canonical_id, file_path)
+                            self.near_dedup.add_alias(canonical_id, chunk_id, chunk.metadata)
+                            touched.add(canonical_id)
+                            collapsed += 1
+                            continue
+                        if self.near_dedup.add(chunk_id, signature, chunk.metadata) > 1:
+                            touched.add(chunk_id)
+                        chunk_batch[chunk_id] = None
+                    batch_ids.append(chunk_id)
+                    batch_docs.append(chunk)
+                    join_open_batch(file_path)
+                    if len(batch_docs) >= self.embed_batch_size:
+                        submit_batch(embed_executor)
+                file_state[file_path]["pending"] -= 1
+                if file_state[file_path]["pending"] == 0:
+                    self._finish_file(vectorstore, file_path, file_state[file_path], on_file_done)
+            
+            if batch_docs:
+                submit_batch(embed_executor)
+            for future in as_completed(list(in_flight)):
+                finish_batch(future)
+        
+        if touched:
+            self._refresh_provenance(vectorstore, touched)
+        
+        self.manifest.save()
+        if processed_files:
+            self.bm25.save()
+            if self.near_dedup is not None:
+                self.near_dedup.save()
+        
+        # Dữ liệu đã thay đổi nên các câu trả lời trong cache không còn đúng
+        if processed_files:
+            self.answer_cache.clear()
+        
+        if skipped:
+            print(f"Bỏ qua {skipped} file không thay đổi")
         
         # Nếu không có chunks nào được tạo
-        if not all_chunks:
-            print("Không có tài liệu nào được xử lý thành công")
+        if total_chunks == 0 and processed_files == 0:
+            print("Không có tài liệu mới nào cần xử lý")
             return 0
         
-        # Tạo hoặc cập nhật vector store
-        if self.vectorstore is None:
-            print(f"Tạo mới vector database tại {self.persist_directory}")
-            self.vectorstore = Chroma.from_documents(
-                documents=all_chunks,
-                embedding=self.embeddings,
-                persist_directory=self.persist_directory
-            )
-            # Lưu xuống đĩa
-            self.vectorstore.persist()
-            print(f"Đã lưu vector database với {len(all_chunks)} chunks")
-        else:
-            print(f"Cập nhật vector database hiện có")
-            self.vectorstore.add_documents(all_chunks)
-            # Lưu xuống đĩa
-            self.vectorstore.persist()
-            print(f"Đã cập nhật vector database, thêm {len(all_chunks)} chunks")
+        # Lưu xuống đĩa
+        vectorstore.persist()
+        
+        elapsed = max(time.time() - start_time, 1e-9)
+        self.last_ingest_stats = {
+            "files": processed_files,
+            "skipped_files": skipped,
+            "chunks": total_chunks,
+            "near_duplicates": collapsed,
+            "seconds": round(elapsed, 3),
+            "files_per_second": round(processed_files / elapsed, 2),
+            "chunks_per_second": round(total_chunks / elapsed, 2)
+        }
+        print(f"Đã cập nhật vector database, thêm {total_chunks} chunks từ {processed_files} file "
+              f"trong {elapsed:.2f}s ({self.last_ingest_stats['files_per_second']} file/s, "
+              f"{self.last_ingest_stats['chunks_per_second']} chunks/s)")
+        cache_stats = self.embeddings.stats()
+        print(f"Cache embedding: {cache_stats['hits']} hit, {cache_stats['misses']} miss")
+        if self.near_dedup is not None:
+            self.metrics.inc("rag_near_duplicate_chunks_total", collapsed)
+            dedup_stats = self.near_dedup.stats()
+            share = collapsed / max(collapsed + total_chunks, 1) * 100
+            print(f"Chunk gần trùng: gộp {collapsed} chunks, tiết kiệm {collapsed} embedding ({share:.1f}% số chunk). "
+                  f"Toàn bộ collection: {dedup_stats['collapsed_chunks']} chunks được gộp vào "
+                  f"{dedup_stats['stored_chunks']} chunks đã lưu")
+        
+        # Thay thế index đang phục vụ bằng index trên dữ liệu mới
+        self._activate_index(vectorstore)
+        
+        return total_chunks
+    
+    def _iter_split_files(self, file_paths, skip_unchanged=True, ingest_date=None):
+        """
+        Đọc và chia nhỏ các file bằng một pool worker, trả kết quả theo thứ tự.
+        Chỉ giữ tối đa 2 * load_workers file trong bộ nhớ cùng lúc.
+        """
+        window = max(1, 2 * self.load_workers)
+        with ThreadPoolExecutor(max_workers=self.load_workers) as executor:
+            futures = deque()
+            for file_path in file_paths:
+                futures.append(executor.submit(self._load_and_split, file_path, skip_unchanged, ingest_date))
+                if len(futures) >= window:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+    
+    def _load_and_split(self, file_path, skip_unchanged=True, ingest_date=None):
+        """
+        Đọc một file và chia thành các chunk, gắn metadata có cấu trúc (thư mục nguồn, loại tài liệu,
+        tên miền crawl, ngày nạp) vào từng chunk
+        
+        Returns:
+            "unchanged" nếu file không đổi, None nếu lỗi, hoặc tuple
+            (file_path, content_hash, stat, chunks, chunk_ids, stale_ids)
+        """
+        try:
+            # Kiểm tra file tồn tại
+            if not os.path.exists(file_path):
+                print(f"File không tồn tại: {file_path}")
+                return None
+            
+            # So sánh với manifest để bỏ qua file không đổi
+            status, content_hash, stat = self.manifest.check(file_path, self.splitter_signature)
+            if status == "unchanged" and skip_unchanged:
+                return "unchanged"
+            
+            print(f"Đang xử lý file: {file_path}")
+            with timed(self.metrics, "rag_ingest_stage_seconds", stage="read"):
+                loader = TextLoader(file_path)
+                documents = loader.load()
+                for document in documents:
+                    document.metadata.update(document_metadata(file_path, document.page_content, ingest_date))
+            
+            # Chia nhỏ tài liệu
+            with timed(self.metrics, "rag_ingest_stage_seconds", stage="split"):
+                chunks = self.text_splitter.split_documents(documents)
+            print(f"  - Đã chia thành {len(chunks)} chunks")
+            chunk_ids = make_chunk_ids(file_path, content_hash, len(chunks), self.splitter_signature)
+            
+            entry = self.manifest.get(file_path)
+            new_ids = set(chunk_ids)
+            stale_ids = [i for i in entry["chunk_ids"] if i not in new_ids] if entry else []
+            return file_path, content_hash, stat, chunks, chunk_ids, stale_ids
         
-        # Khởi tạo QA chain
-        self._setup_qa_chain()
+        except Exception as e:
+            print(f"Lỗi khi xử lý file {file_path}: {str(e)}")
+            return None
+    
+    def _embed_and_upsert(self, vectorstore, ids, documents):
+        """Embedding một batch chunk rồi ghi (upsert) vào vector store"""
+        texts = [doc.page_content for doc in documents]
+        metadatas = [doc.metadata for doc in documents]
+        with timed(self.metrics, "rag_ingest_stage_seconds", stage="embed"):
+            vectors = self.embeddings.embed_documents(texts)
+        with timed(self.metrics, "rag_ingest_stage_seconds", stage="upsert"):
+            self._upsert_vectors(vectorstore, ids, texts, metadatas, vectors)
+            self.bm25.add(ids, texts, metadatas)
+        self.metrics.inc("rag_ingested_chunks_total", len(ids))
+    
+    def _upsert_vectors(self, vectorstore, ids, texts, metadatas, vectors):
+        """Ghi các vector đã tính sẵn vào vector store"""
+        self._record_embedding(vectors)
+        upsert_vectors(vectorstore, ids, vectors, metadatas, texts)
+    
+    def _finish_file(self, vectorstore, file_path, state, on_file_done=None):
+        """Khi tất cả batch của file đã được ghi thành công: xóa chunk cũ và ghi nhận vào manifest"""
+        if state["error"] is None:
+            if state["stale_ids"]:
+                self._remove_chunks(vectorstore, state["stale_ids"])
+            self.manifest.update(file_path, state["hash"], state["chunk_ids"], state["stat"],
+                                 self.splitter_signature)
+        elif self.near_dedup is not None:
+            # File sẽ được xử lý lại ở lần tải sau: bỏ các tham chiếu vừa ghi nhận để đếm tham chiếu không bị sai
+            self._remove_chunks(vectorstore, state["chunk_ids"])
+        if on_file_done is not None:
+            if state["error"] is None:
+                on_file_done(file_path, "done", len(state["chunk_ids"]))
+            else:
+                on_file_done(file_path, "failed", 0)
+    
+    def _remove_chunks(self, vectorstore, chunk_ids):
+        """
+        Xóa chunk khỏi vector store và BM25. Chunk đã lưu còn được chunk gần trùng
+        của tài liệu khác tham chiếu thì được giữ lại và chỉ cập nhật metadata nguồn.
+        """
+        touched = []
+        if self.near_dedup is not None:
+            chunk_ids, touched = self.near_dedup.release(chunk_ids)
+        if chunk_ids:
+            if vectorstore is not None:
+                vectorstore.delete(ids=chunk_ids)
+            self.bm25.remove(chunk_ids)
+        if touched and vectorstore is not None:
+            self._refresh_provenance(vectorstore, touched)
+    
+    def _refresh_provenance(self, vectorstore, chunk_ids):
+        """Ghi lại metadata nguồn (source, duplicate_sources) của các chunk đã lưu"""
+        ids, metadatas = [], []
+        for chunk_id in chunk_ids:
+            metadata = self.near_dedup.provenance_metadata(chunk_id)
+            if metadata is not None:
+                ids.append(chunk_id)
+                metadatas.append(metadata)
+        if not ids:
+            return
+        update_metadata(vectorstore, ids, metadatas)
+        for chunk_id, metadata in zip(ids, metadatas):
+            entry = self.bm25.get(chunk_id)
+            if entry is not None:
+                self.bm25.add([chunk_id], [entry[0]], [metadata])
+    
+    def purge_missing_files(self, directory_path):
+        """
+        Xóa khỏi vector store các chunk của những file đã bị xóa khỏi thư mục
         
-        return len(all_chunks)
+        Args:
+            directory_path: Thư mục cần đồng bộ
+            
+        Returns:
+            Số lượng file đã bị loại bỏ
+        """
+        with self._write_lock:
+            removed_files = [path for path in self.manifest.files_under(directory_path)
+                             if not os.path.exists(path)]
+            if not removed_files:
+                return 0
+            
+            removed_ids = []
+            for path in removed_files:
+                removed_ids.extend(self.manifest.remove(path))
+            self._remove_chunks(self.vectorstore, removed_ids)
+            self.bm25.save()
+            if self.near_dedup is not None:
+                self.near_dedup.save()
+            self.manifest.save()
+            self.answer_cache.clear()
+        print(f"Đã loại bỏ {len(removed_files)} file không còn tồn tại ({len(removed_ids)} chunks)")
+        return len(removed_files)
+    
+    @staticmethod
+    def list_files(directory_path, extensions=('.txt', '.md', '.markdown')):
+        """Các file có phần mở rộng được chỉ định trong thư mục (kể cả thư mục con)"""
+        file_paths = []
+        for root, _, files in os.walk(directory_path):
+            for file in files:
+                if any(file.endswith(ext) for ext in extensions):
+                    file_paths.append(os.path.join(root, file))
+        return file_paths
     
     def load_directory(self, directory_path, extensions=['.txt', '.md', '.markdown']):
         """
-        Tải tất cả các file với phần mở rộng được chỉ định từ một thư mục
+        Đồng bộ tất cả các file với phần mở rộng được chỉ định từ một thư mục
         
         Args:
             directory_path: Đường dẫn đến thư mục
             extensions: Danh sách các phần mở rộng file cần tải
             
         Returns:
-            Số lượng file đã tải
+            Số lượng chunks đã tải
         """
         if not os.path.exists(directory_path) or not os.path.isdir(directory_path):
             print(f"Thư mục không tồn tại: {directory_path}")
             return 0
         
+        # Loại bỏ các file đã bị xóa khỏi thư mục
+        self.purge_missing_files(directory_path)
+        
         # Tìm tất cả các file phù hợp
-        file_paths = []
-        for root, _, files in os.walk(directory_path):
-            for file in files:
-                if any(file.endswith(ext) for ext in extensions):
-                    file_paths.append(os.path.join(root, file))
+        file_paths = self.list_files(directory_path, extensions)
         
         if not file_paths:
             print(f"Không tìm thấy file phù hợp trong thư mục {directory_path}")
             return 0
         
         print(f"Tìm thấy {len(file_paths)} file để xử lý")
-        # Tải tất cả file tìm được
+        # Tải các file mới hoặc đã thay đổi
         loaded_chunks = self.load_documents(file_paths)
         
         return loaded_chunks
     
-    def _setup_qa_chain(self):
-        """Thiết lập QA chain với lịch sử hội thoại"""
-        if self.vectorstore is None:
-            print("Không thể thiết lập QA chain: chưa có vector store")
-            return
+    def _activate_index(self, vectorstore=None, bm25=None):
+        """
+        Tạo retriever trên vector store và đưa vào phục vụ
         
-        # Tạo retriever
-        retriever = self.vectorstore.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": 3}
-        )
+        Args:
+            vectorstore: Vector store được đưa vào phục vụ, None để dùng vector store hiện tại
+            bm25: Chỉ mục BM25 của vector store, None để dùng self.bm25
+            
+        Returns:
+            IndexState mới đang phục vụ truy vấn
+        """
+        if vectorstore is None:
+            vectorstore = self.vectorstore
+        if vectorstore is None:
+            print("Không thể đưa index vào phục vụ: chưa có vector store")
+            return self._index
         
-        # Tạo template cho prompt sử dụng cả lịch sử hội thoại
-        template = """
-        Bạn là trợ lý AI có kiến thức chuyên sâu. Nhiệm vụ của bạn là trả lời câu hỏi dựa trên các tài liệu.
+        # Khi lắp context theo ngân sách token, retriever lấy tập ứng viên rộng hơn
+        k = self.context_candidates if self.context_packer else self.retrieval_k
         
-        Lịch sử trò chuyện:
-        {chat_history}
+        # Tạo retriever: kết hợp BM25 + vector, hoặc chỉ tìm kiếm vector
+        if self.hybrid_search:
+            retriever = HybridRetriever(
+                vectorstore=vectorstore,
+                bm25=bm25 or self.bm25,
+                k=k,
+                fetch_k=max(self.hybrid_fetch_k, k),
+                vector_weight=self.vector_weight,
+                lexical_weight=self.lexical_weight
+            )
+        else:
+            retriever = vectorstore.as_retriever(
+                search_type="similarity",
+                search_kwargs={"k": k}
+            )
         
-        Thông tin từ tài liệu:
-        {context}
+        # Thay thế index đang phục vụ bằng một thao tác gán duy nhất
+        self._index = IndexState(vectorstore, retriever)
+        return self._index
+    
+    def query(self, question, return_sources=False, session_id=None, return_timings=False, filter=None):
+        """
+        Truy vấn chatbot
         
-        Câu hỏi: {query}
+        Args:
+            question: Câu hỏi cần trả lời
+            return_sources: Nếu True, trả về cả nguồn tài liệu
+            session_id: Id của phiên hội thoại, None để dùng session mặc định
+            return_timings: Nếu True, trả về thêm thời gian từng bước, số token và trạng thái cache
+            filter: Bộ lọc metadata, ví dụ {"crawl_domain": "hoc24.vn", "ingest_date": {"$gte": "2024-05-01"}}
+                    (xem doc_metadata.normalize_filter); chỉ tìm trong các shard và chunk khớp bộ lọc
+            
+        Returns:
+            Câu trả lời hoặc dict chứa câu trả lời, nguồn tài liệu, tầng cache đã phục vụ
+            ("exact", "similar" hoặc False) và "timings" nếu được yêu cầu
+            
+        Raises:
+            ValueError: Bộ lọc không hợp lệ
+        """
+        where = normalize_filter(filter)
+        # Đọc index đang phục vụ một lần, dùng cho toàn bộ truy vấn kể cả khi đang tải dữ liệu mới
+        index = self._index
+        if index.vectorstore is None:
+            return "Vui lòng tải tài liệu trước khi truy vấn."
         
-        Trả lời bằng tiếng Việt, rõ ràng và ngắn gọn. Hãy dựa vào thông tin từ tài liệu.
-        Nếu không tìm thấy thông tin trong dữ liệu, hãy nói rằng bạn không biết câu trả lời dựa trên dữ liệu hiện có.
+        trace = QueryTrace(self.metrics, kind="query")
+        memory = self.memories.get(session_id)
+        answer, sources, tier = None, [], False
+        try:
+            chat_history = history_as_str(memory)
+            # Tầng tương đồng: so sánh embedding câu hỏi với các câu hỏi đã trả lời (bỏ qua khi có bộ lọc:
+            # câu hỏi giống nhau với phạm vi khác nhau có câu trả lời khác nhau; bỏ qua khi session có lịch sử:
+            # câu trả lời phụ thuộc vào các lượt trước)
+            question_vector = None
+            if self.answer_cache.similarity_enabled and where is None and not chat_history:
+                with trace.stage("embed_question"):
+                    question_vector = self.embeddings.embed_query(question)
+                with trace.stage("cache_lookup"):
+                    cached = self.answer_cache.get_similar(question_vector)
+                if cached is not None:
+                    trace.set_cache("similar")
+                    answer, sources, tier = cached["answer"], cached["sources"], "similar"
+                    return self._cached_result(question, cached, tier, return_sources, memory,
+                                               trace, return_timings)
+            
+            # Truy xuất và lắp ráp context
+            docs = self._retrieve_documents(index, question, question_vector, trace, where)
+            
+            # Tầng khớp chính xác: câu hỏi chuẩn hóa + các chunk được truy xuất + lịch sử của session
+            with trace.stage("cache_lookup"):
+                cache_key = AnswerCache.make_key(question, docs, chat_history)
+                cached = self.answer_cache.get(cache_key)
+            if cached is not None:
+                trace.set_cache("exact")
+                answer, sources, tier = cached["answer"], cached["sources"], "exact"
+                return self._cached_result(question, cached, tier, return_sources, memory,
+                                           trace, return_timings)
+            self.answer_cache.record_miss()
+            trace.set_cache("miss")
+            
+            # Sinh câu trả lời từ LLM
+            sources = [{"content": doc.page_content, "metadata": doc.metadata} for doc in docs]
+            answer = self._generate_answer(question, docs, chat_history, trace)
+            memory.save_context({"input": question}, {"output": answer})
+            self.answer_cache.put(cache_key, answer, sources, question_vector)
+            
+            trace.finish()
+            return self._format_result(answer, sources, False, return_sources, trace, return_timings)
+            
+        except Exception as e:
+            print(f"Lỗi khi thực hiện truy vấn: {str(e)}")
+            if answer is not None:
+                # Đã có câu trả lời, lỗi xảy ra khi lưu lịch sử hoặc cache: không gọi LLM thêm lần nữa
+                trace.finish()
+                return self._format_result(answer, sources, tier, return_sources, trace, return_timings)
+            if is_rate_limit_error(e):
+                # Hết quota: truy vấn thủ công chỉ gửi thêm request bị từ chối
+                answer = RATE_LIMITED_MESSAGE
+            else:
+                trace.mark_fallback()
+                with trace.stage("fallback"):
+                    answer = self._manual_query(index, question, session_id, where)
+            trace.finish()
+            if return_sources or return_timings:
+                return self._format_result(answer, [], False, return_sources, trace, return_timings)
+            return answer
+    
+    def _scoped_retriever(self, index, where):
+        """Retriever của index giới hạn theo bộ lọc metadata"""
+        if where is None:
+            return index.retriever
+        if isinstance(index.retriever, HybridRetriever):
+            return index.retriever.copy(update={"filter": where})
+        k = self.context_candidates if self.context_packer else self.retrieval_k
+        return index.vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": k, "filter": where})
+    
+    def _retrieve_documents(self, index, question, question_vector=None, trace=None, where=None):
+        """Truy xuất tập ứng viên rồi chọn lọc, gộp và đóng gói theo ngân sách token"""
+        start = time.perf_counter()
+        docs = self._scoped_retriever(index, where).get_relevant_documents(question)
+        if trace is not None:
+            trace.record("retrieval", time.perf_counter() - start)
+        if self.context_packer is not None:
+            start = time.perf_counter()
+            docs = self.context_packer.pack(question, docs, question_vector)
+            if trace is not None:
+                trace.record("context_packing", time.perf_counter() - start)
+        return docs
+    
+    def _build_prompt(self, question, docs, chat_history="", trace=None):
+        """Tạo prompt từ tài liệu đã truy xuất và lịch sử hội thoại của session (dạng văn bản)"""
+        start = time.perf_counter()
+        context = "\n\n".join(doc.page_content for doc in docs)
+        prompt_text = self.qa_prompt.format(chat_history=chat_history, context=context, query=question)
+        if trace is not None:
+            trace.record("prompt_build", time.perf_counter() - start)
+            trace.set_prompt_tokens(estimate_tokens(prompt_text))
+        return prompt_text
+    
+    def _generate_answer(self, question, docs, chat_history="", trace=None):
+        """Gọi LLM với prompt đã tạo (người gọi tự lưu lịch sử)"""
+        prompt_text = self._build_prompt(question, docs, chat_history, trace)
+        start = time.perf_counter()
+        response = self.llm.invoke(prompt_text)
+        answer = response.content
+        if trace is not None:
+            trace.record("llm", time.perf_counter() - start)
+            trace.answer_tokens = estimate_tokens(answer)
+        return answer
+    
+    def query_batch(self, questions, return_sources=True, max_concurrency=None, filter=None):
+        """
+        Trả lời nhiều câu hỏi độc lập (không dùng và không ghi lịch sử hội thoại), dùng cho đánh giá
+        và các job xử lý hàng loạt
         
-        Câu trả lời:
+        Tất cả câu hỏi được embedding trong một request, tìm kiếm vector trong một lượt,
+        sau đó các lời gọi LLM chạy song song với số luồng tối đa là max_concurrency.
+        
+        Args:
+            questions: Danh sách câu hỏi
+            return_sources: Nếu True, kết quả của mỗi câu hỏi có thêm nguồn tài liệu
+            max_concurrency: Số lời gọi LLM đồng thời tối đa, None để dùng batch_concurrency
+            filter: Bộ lọc metadata áp dụng cho mọi câu hỏi (như query)
+            
+        Returns:
+            Dict {"results": [{"question", "answer", "cached", "error", "sources"}...] theo thứ tự đầu vào,
+            "timings": {...}}; câu hỏi bị lỗi có "answer" là None và "error" là thông báo lỗi
+            
+        Raises:
+            ValueError: Bộ lọc không hợp lệ
         """
+        where = normalize_filter(filter)
+        index = self._index
+        results = [{"question": question, "answer": None, "cached": False, "error": None}
+                   for question in questions]
+        if return_sources:
+            for result in results:
+                result["sources"] = []
         
-        prompt = PromptTemplate(
-            template=template,
-            input_variables=["chat_history", "context", "query"]
-        )
+        def fail(positions, message):
+            for i in positions:
+                results[i]["error"] = message
         
-        # Tạo QA chain
-        try:
-            self.qa_chain = RetrievalQA.from_chain_type(
-                llm=self.llm,
-                chain_type="stuff",
-                retriever=retriever,
-                return_source_documents=True,
-                chain_type_kwargs={
-                    "prompt": prompt,
-                    "memory": self.memory
-                }
-            )
-            print("Đã khởi tạo QA chain thành công")
-        except Exception as e:
-            print(f"Lỗi khi khởi tạo QA chain: {e}")
-            self.qa_chain = None
+        trace = QueryTrace(self.metrics, kind="batch")
+        pending = [i for i, question in enumerate(questions) if question and question.strip()]
+        fail([i for i, question in enumerate(questions) if not (question and question.strip())],
+             "Câu hỏi không được để trống")
+        if index.vectorstore is None or index.retriever is None:
+            fail(pending, "Vui lòng tải tài liệu trước khi truy vấn.")
+            pending = []
+        
+        def finish_cached(i, cached, tier):
+            results[i].update(answer=cached["answer"], cached=tier)
+            if return_sources:
+                results[i]["sources"] = cached["sources"]
+        
+        # Embedding tất cả câu hỏi trong một request
+        vectors = {}
+        if pending:
+            try:
+                with trace.stage("embed_question"):
+                    embedded = self.embeddings.embed_queries([questions[i] for i in pending])
+                vectors = dict(zip(pending, embedded))
+            except Exception as e:
+                fail(pending, f"Lỗi khi embedding câu hỏi: {str(e)}")
+                pending = []
+        
+        # Tầng cache tương đồng
+        if self.answer_cache.similarity_enabled and pending and where is None:
+            with trace.stage("cache_lookup"):
+                remaining = []
+                for i in pending:
+                    cached = self.answer_cache.get_similar(vectors[i])
+                    if cached is not None:
+                        finish_cached(i, cached, "similar")
+                    else:
+                        remaining.append(i)
+            pending = remaining
+        
+        # Tìm kiếm vector cho cả batch, sau đó gộp BM25 và lắp context cho từng câu hỏi
+        to_generate = []
+        if pending:
+            retriever = self._scoped_retriever(index, where)
+            hybrid = isinstance(retriever, HybridRetriever)
+            k = self.context_candidates if self.context_packer else self.retrieval_k
+            try:
+                with trace.stage("retrieval"):
+                    vector_docs = self._batch_vector_search(
+                        index.vectorstore, [vectors[i] for i in pending], retriever.fetch_k if hybrid else k, where)
+            except Exception as e:
+                fail(pending, f"Lỗi khi tìm kiếm: {str(e)}")
+                vector_docs = []
+            # Thời gian của từng bước được cộng dồn cho cả batch rồi ghi một lần
+            stage_seconds = {"retrieval": 0.0, "context_packing": 0.0, "cache_lookup": 0.0}
+            for i, docs in zip(pending, vector_docs):
+                try:
+                    start = time.perf_counter()
+                    docs = retriever.fuse_with_lexical(questions[i], docs) if hybrid else docs[:k]
+                    stage_seconds["retrieval"] += time.perf_counter() - start
+                    if self.context_packer is not None:
+                        start = time.perf_counter()
+                        docs = self.context_packer.pack(questions[i], docs, vectors[i])
+                        stage_seconds["context_packing"] += time.perf_counter() - start
+                    start = time.perf_counter()
+                    cache_key = AnswerCache.make_key(questions[i], docs)
+                    cached = self.answer_cache.get(cache_key)
+                    stage_seconds["cache_lookup"] += time.perf_counter() - start
+                except Exception as e:
+                    fail([i], f"Lỗi khi truy xuất tài liệu: {str(e)}")
+                    continue
+                if cached is not None:
+                    finish_cached(i, cached, "exact")
+                    continue
+                self.answer_cache.record_miss()
+                to_generate.append((i, docs, cache_key))
+            for stage, seconds in stage_seconds.items():
+                if seconds:
+                    trace.record(stage, seconds)
+        
+        # Gọi LLM song song, giới hạn số lời gọi đồng thời
+        def generate(question, docs):
+            prompt_text = self._build_prompt(question, docs)
+            return self.llm.invoke(prompt_text).content
+        
+        if to_generate:
+            concurrency = max(1, max_concurrency or self.batch_concurrency)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=min(concurrency, len(to_generate))) as executor:
+                futures = {executor.submit(generate, questions[i], docs): (i, docs, cache_key)
+                           for i, docs, cache_key in to_generate}
+                for future in as_completed(futures):
+                    i, docs, cache_key = futures[future]
+                    try:
+                        answer = future.result()
+                    except Exception as e:
+                        fail([i], f"Lỗi khi gọi LLM: {str(e)}")
+                        continue
+                    sources = [{"content": doc.page_content, "metadata": doc.metadata} for doc in docs]
+                    self.answer_cache.put(cache_key, answer, sources, vectors[i] if where is None else None)
+                    results[i]["answer"] = answer
+                    if return_sources:
+                        results[i]["sources"] = sources
+            trace.record("llm", time.perf_counter() - start)
+        
+        total = trace.finish()
+        timings = trace.to_dict()
+        timings.update(
+            questions=len(questions),
+            generated=len(to_generate),
+            errors=sum(1 for result in results if result["error"]),
+            questions_per_second=round(len(questions) / max(total, 1e-9), 2)
+        )
+        return {"results": results, "timings": timings}
     
-    def query(self, question, return_sources=False):
+    @staticmethod
+    def _batch_vector_search(vectorstore, vectors, k, where=None):
+        """Tìm kiếm vector cho nhiều câu hỏi trong một lời gọi tới vector store"""
+        return [[doc for doc, _ in docs] for docs in search_by_vectors(vectorstore, vectors, k, where)]
+    
+    def query_stream(self, question, session_id=None, filter=None):
         """
-        Truy vấn chatbot
+        Truy vấn chatbot dạng luồng: gửi nguồn tài liệu ngay khi truy xuất xong,
+        sau đó chuyển tiếp từng token của LLM ngay khi nhận được
         
         Args:
             question: Câu hỏi cần trả lời
-            return_sources: Nếu True, trả về cả nguồn tài liệu
+            session_id: Id của phiên hội thoại, None để dùng session mặc định
+            filter: Bộ lọc metadata (như query)
             
-        Returns:
-            Câu trả lời hoặc dict chứa câu trả lời và nguồn tài liệu
+        Yields:
+            Các dict sự kiện theo thứ tự:
+            {"type": "sources", "sources": [...], "cached": ...},
+            {"type": "token", "content": "..."} (nhiều lần),
+            {"type": "done", "answer": "...", "cached": ..., "timings": {...}}
+            hoặc {"type": "error", "error": "..."} nếu có lỗi
         """
-        if self.vectorstore is None:
-            return "Vui lòng tải tài liệu trước khi truy vấn."
+        index = self._index
+        if index.vectorstore is None:
+            yield {"type": "error", "error": "Vui lòng tải tài liệu trước khi truy vấn."}
+            return
         
-        if self.qa_chain is None:
-            self._setup_qa_chain()
-            if self.qa_chain is None:
-                return "Không thể khởi tạo QA chain."
+        try:
+            where = normalize_filter(filter)
+        except ValueError as e:
+            yield {"type": "error", "error": str(e)}
+            return
         
+        trace = QueryTrace(self.metrics, kind="stream")
+        memory = self.memories.get(session_id)
+        answer = None
         try:
-            # Thực hiện truy vấn
-            result = self.qa_chain({"query": question})
+            chat_history = history_as_str(memory)
+            question_vector = None
+            cached, tier = None, False
+            if self.answer_cache.similarity_enabled and where is None and not chat_history:
+                with trace.stage("embed_question"):
+                    question_vector = self.embeddings.embed_query(question)
+                with trace.stage("cache_lookup"):
+                    cached = self.answer_cache.get_similar(question_vector)
+                tier = "similar" if cached is not None else False
             
-            # Trích xuất câu trả lời
-            if "result" in result:
-                answer = result["result"]
-            else:
-                # Tìm key phù hợp trong kết quả
-                for key, value in result.items():
-                    if isinstance(value, str) and key != "query":
-                        answer = value
-                        break
-                else:
-                    answer = "Không thể trích xuất câu trả lời từ kết quả."
-            
-            # Trả về kèm nguồn nếu yêu cầu
-            if return_sources and "source_documents" in result:
-                sources = []
-                for doc in result["source_documents"]:
-                    source_info = {
-                        "content": doc.page_content,
-                        "metadata": doc.metadata
-                    }
-                    sources.append(source_info)
-                
-                return {"answer": answer, "sources": sources}
+            if cached is None:
+                docs = self._retrieve_documents(index, question, question_vector, trace, where)
+                with trace.stage("cache_lookup"):
+                    cache_key = AnswerCache.make_key(question, docs, chat_history)
+                    cached = self.answer_cache.get(cache_key)
+                tier = "exact" if cached is not None else False
             
-            return answer
+            # Câu trả lời có sẵn trong cache: gửi toàn bộ trong một lần
+            if cached is not None:
+                trace.set_cache(tier)
+                answer = cached["answer"]
+                yield {"type": "sources", "sources": cached["sources"], "cached": tier}
+                yield {"type": "token", "content": answer}
+                memory.save_context({"input": question}, {"output": answer})
+                trace.finish()
+                yield {"type": "done", "answer": answer, "cached": tier, "timings": trace.to_dict()}
+                return
+            self.answer_cache.record_miss()
+            trace.set_cache("miss")
+            
+            sources = [{"content": doc.page_content, "metadata": doc.metadata} for doc in docs]
+            yield {"type": "sources", "sources": sources, "cached": False}
+            
+            # Chuyển tiếp từng token từ LLM
+            parts = []
+            prompt_text = self._build_prompt(question, docs, chat_history, trace)
+            llm_start = time.perf_counter()
+            for chunk in self.llm.stream(prompt_text):
+                content = chunk.content
+                if content:
+                    if not parts:
+                        trace.record("llm_first_token", time.perf_counter() - llm_start)
+                    parts.append(content)
+                    yield {"type": "token", "content": content}
+            trace.record("llm", time.perf_counter() - llm_start)
+            answer = "".join(parts)
+            trace.answer_tokens = estimate_tokens(answer)
+            
+            memory.save_context({"input": question}, {"output": answer})
+            self.answer_cache.put(cache_key, answer, sources, question_vector)
+            trace.finish()
+            yield {"type": "done", "answer": answer, "cached": False, "timings": trace.to_dict()}
             
         except Exception as e:
-            print(f"Lỗi khi thực hiện truy vấn: {str(e)}")
-            return self.manual_query(question)
+            print(f"Lỗi khi thực hiện truy vấn dạng luồng: {str(e)}")
+            trace.finish()
+            if answer is not None:
+                # Câu trả lời đã được gửi đủ, lỗi xảy ra khi lưu lịch sử hoặc cache
+                yield {"type": "done", "answer": answer, "cached": tier, "timings": trace.to_dict()}
+            elif is_rate_limit_error(e):
+                yield {"type": "error", "error": RATE_LIMITED_MESSAGE, "rate_limited": True}
+            else:
+                yield {"type": "error", "error": f"Lỗi khi xử lý truy vấn: {str(e)}"}
+    
+    def _cached_result(self, question, cached, tier, return_sources, memory, trace=None, return_timings=False):
+        """Trả về câu trả lời lấy từ cache, vẫn ghi vào lịch sử hội thoại"""
+        memory.save_context({"input": question}, {"output": cached["answer"]})
+        if trace is not None:
+            trace.finish()
+        return self._format_result(cached["answer"], cached["sources"], tier, return_sources,
+                                   trace, return_timings)
     
-    def manual_query(self, question):
+    @staticmethod
+    def _format_result(answer, sources, cached, return_sources, trace=None, return_timings=False):
+        """Định dạng kết quả trả về của query"""
+        if return_sources or return_timings:
+            result = {"answer": answer, "cached": cached}
+            if return_sources:
+                result["sources"] = sources
+            if return_timings and trace is not None:
+                result["timings"] = trace.to_dict()
+            return result
+        return answer
+    
+    def manual_query(self, question, session_id=None):
         """Phương pháp truy vấn thủ công"""
-        if self.vectorstore is None:
+        return self._manual_query(self._index, question, session_id)
+    
+    def _manual_query(self, index, question, session_id=None, where=None):
+        """Truy vấn thủ công trên một index cố định"""
+        if index.vectorstore is None:
             return "Vui lòng tải tài liệu trước khi truy vấn."
         
         try:
             # Tạo retriever
-            retriever = self.vectorstore.as_retriever(
+            search_kwargs = {"k": 10}
+            if where is not None:
+                search_kwargs["filter"] = where
+            retriever = index.vectorstore.as_retriever(
                 search_type="similarity",
-                search_kwargs={"k": 10}
+                search_kwargs=search_kwargs
             )
             
             # Lấy tài liệu liên quan
@@ -309,8 +1568,9 @@ class InteractiveRAGChatbot:
             # Tạo context từ các tài liệu
             context = "\n\n".join([doc.page_content for doc in docs])
             
-            # Lấy lịch sử trò chuyện
-            chat_history = self.memory.buffer_as_str if hasattr(self.memory, 'buffer_as_str') else ""
+            # Lấy lịch sử trò chuyện của session
+            memory = self.memories.get(session_id)
+            chat_history = history_as_str(memory)
             
             # Tạo prompt
             prompt_text = f"""
@@ -335,16 +1595,16 @@ class InteractiveRAGChatbot:
             answer = response.content
             
             # Cập nhật lịch sử
-            self.memory.save_context({"input": question}, {"output": answer})
+            memory.save_context({"input": question}, {"output": answer})
             
             return answer
             
         except Exception as e:
             return f"Lỗi khi xử lý truy vấn thủ công: {str(e)}"
     
-    def reset_conversation(self):
-        """Xóa lịch sử hội thoại"""
-        self.memory.clear()
+    def reset_conversation(self, session_id=None):
+        """Xóa lịch sử hội thoại của một session"""
+        self.memories.clear(session_id)
         print("Đã xóa lịch sử hội thoại")
     
     def run_interactive(self):
@@ -363,9 +1623,11 @@ class InteractiveRAGChatbot:
                 return
         
         print("\n===== CHẾ ĐỘ HỎI ĐÁP LIÊN TỤC =====")
-        print("Gõ 'exit' để thoát, 'clear' để xóa lịch sử trò chuyện, 'sources' để xem nguồn của câu trả lời cuối")
+        print("Gõ 'exit' để thoát, 'clear' để xóa lịch sử trò chuyện, 'sources' để xem nguồn của câu trả lời cuối, "
+              "'stream' để bật/tắt chế độ hiển thị từng token")
         
         show_sources = False
+        stream_mode = True
         last_result = None
         
         while True:
@@ -391,9 +1653,18 @@ class InteractiveRAGChatbot:
                     print("Không có thông tin về nguồn tài liệu cho câu trả lời gần nhất.")
                 continue
             
+            elif question.lower() == 'stream':
+                stream_mode = not stream_mode
+                print(f"Chế độ luồng: {'bật' if stream_mode else 'tắt'}")
+                continue
+            
             # Xử lý truy vấn
             start_time = time.time()
             
+            if stream_mode:
+                last_result = self._print_stream(question, start_time)
+                continue
+            
             if show_sources:
                 result = self.query(question, return_sources=True)
                 last_result = result
@@ -407,6 +1678,27 @@ class InteractiveRAGChatbot:
             # Hiển thị câu trả lời
             print(f"\nTrả lời ({round(end_time - start_time, 2)}s):")
             print(answer)
+    
+    def _print_stream(self, question, start_time):
+        """In câu trả lời theo từng token, trả về kết quả để lệnh 'sources' sử dụng"""
+        result = {"answer": "", "sources": []}
+        first_token_time = None
+        print("\nTrả lời: ", end="", flush=True)
+        for event in self.query_stream(question):
+            if event["type"] == "sources":
+                result["sources"] = event["sources"]
+            elif event["type"] == "token":
+                if first_token_time is None:
+                    first_token_time = time.time()
+                print(event["content"], end="", flush=True)
+            elif event["type"] == "done":
+                result["answer"] = event["answer"]
+            elif event["type"] == "error":
+                print(event["error"], end="")
+        end_time = time.time()
+        ttft = round(first_token_time - start_time, 2) if first_token_time else None
+        print(f"\n(token đầu tiên: {ttft}s, tổng: {round(end_time - start_time, 2)}s)")
+        return result
 
 
 # Chạy chế độ tương tác
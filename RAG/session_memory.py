@@ -0,0 +1,114 @@
+"""
+Quản lý lịch sử hội thoại theo từng phiên (session), có giới hạn kích thước
+"""
+import threading
+import time
+
+from langchain.memory import (
+    ConversationBufferWindowMemory,
+    ConversationSummaryBufferMemory,
+    ConversationTokenBufferMemory,
+)
+from langchain_core.messages import get_buffer_string
+
+DEFAULT_SESSION = "default"
+
+
+def history_as_str(memory):
+    """Lấy lịch sử hội thoại dạng văn bản từ bất kỳ loại memory nào"""
+    history = memory.load_memory_variables({}).get(memory.memory_key, "")
+    if isinstance(history, list):
+        return get_buffer_string(history)
+    return history
+
+
+class SessionMemoryStore:
+    def __init__(self, window=5, token_limit=None, llm=None, summarize=False,
+                 idle_ttl=1800, max_sessions=10000):
+        """
+        Lưu memory riêng cho từng session, mỗi memory bị giới hạn kích thước
+
+        Args:
+            window: Số lượt hỏi đáp gần nhất được giữ lại (khi không dùng token_limit)
+            token_limit: Giới hạn số token của lịch sử (cần llm để đếm token), None để dùng window
+            llm: LLM dùng để đếm token và tóm tắt lịch sử
+            summarize: Nếu True, các lượt cũ vượt token_limit được tóm tắt lại thay vì bị bỏ đi
+            idle_ttl: Session không hoạt động quá số giây này sẽ bị xóa
+            max_sessions: Số session tối đa, vượt quá sẽ xóa session lâu nhất không hoạt động
+        """
+        self.window = window
+        self.token_limit = token_limit
+        self.llm = llm
+        self.summarize = summarize
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self._sessions = {}
+        self._last_sweep = time.time()
+        self._lock = threading.Lock()
+
+    def _create_memory(self):
+        """Tạo memory mới theo cấu hình"""
+        if self.token_limit is not None and self.llm is not None and self.summarize:
+            # Các lượt cũ vượt giới hạn token được tóm tắt lại thay vì bị bỏ đi
+            return ConversationSummaryBufferMemory(
+                llm=self.llm,
+                max_token_limit=self.token_limit,
+                memory_key="chat_history",
+                return_messages=True
+            )
+        if self.token_limit is not None and self.llm is not None:
+            return ConversationTokenBufferMemory(
+                llm=self.llm,
+                max_token_limit=self.token_limit,
+                memory_key="chat_history",
+                return_messages=True
+            )
+        return ConversationBufferWindowMemory(
+            k=self.window,
+            memory_key="chat_history",
+            return_messages=True
+        )
+
+    def get(self, session_id=None):
+        """Lấy memory của session, tạo mới nếu chưa có"""
+        session_id = session_id or DEFAULT_SESSION
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep > 60:
+                self._evict_idle(now)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                if len(self._sessions) >= self.max_sessions:
+                    oldest = min(self._sessions, key=lambda key: self._sessions[key]["last_access"])
+                    del self._sessions[oldest]
+                entry = {"memory": self._create_memory(), "last_access": now}
+                self._sessions[session_id] = entry
+            entry["last_access"] = now
+            return entry["memory"]
+
+    def clear(self, session_id=None):
+        """Xóa lịch sử của một session"""
+        with self._lock:
+            entry = self._sessions.pop(session_id or DEFAULT_SESSION, None)
+        if entry is not None:
+            entry["memory"].clear()
+
+    def clear_all(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def _evict_idle(self, now):
+        """Xóa các session không hoạt động quá idle_ttl giây"""
+        self._last_sweep = now
+        if self.idle_ttl is None:
+            return
+        expired = [key for key, entry in self._sessions.items()
+                   if now - entry["last_access"] > self.idle_ttl]
+        for key in expired:
+            del self._sessions[key]
+        if expired:
+            print(f"Đã xóa {len(expired)} session không hoạt động")
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
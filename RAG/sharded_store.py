@@ -0,0 +1,330 @@
+"""
+Vector store chia thành nhiều shard (collection Chroma hoặc QuantizedVectorStore riêng) theo một khóa
+metadata. Truy vấn có bộ lọc theo khóa shard chỉ tìm trong các shard liên quan; truy vấn không lọc
+tìm song song trên mọi shard rồi gộp top-k theo khoảng cách.
+
+Các hàm upsert_vectors, update_metadata, delete_ids, search_by_vectors, iter_records và warm_up_store
+thao tác trên một vector store bất kỳ (Chroma, QuantizedVectorStore hoặc ShardedVectorStore).
+"""
+import hashlib
+import heapq
+import json
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from doc_metadata import allowed_values
+
+
+def shards_path_for(persist_directory):
+    """Đường dẫn file danh sách shard nằm cạnh thư mục persist_directory"""
+    return os.path.normpath(persist_directory) + "_shards.json"
+
+
+def _is_native(store):
+    """QuantizedVectorStore và ShardedVectorStore có API ghi/tìm theo vector; Chroma dùng _collection"""
+    return hasattr(store, "upsert_vectors")
+
+
+def upsert_vectors(store, ids, vectors, metadatas, texts):
+    """Ghi các vector đã tính sẵn vào vector store"""
+    if _is_native(store):
+        store.upsert_vectors(ids, vectors, metadatas, texts)
+    else:
+        store._collection.upsert(ids=ids, embeddings=vectors, metadatas=metadatas, documents=texts)
+
+
+def update_metadata(store, ids, metadatas):
+    """Thay metadata của các chunk đã lưu"""
+    if _is_native(store):
+        store.update_metadata(ids, metadatas)
+    else:
+        store._collection.update(ids=ids, metadatas=metadatas)
+
+
+def delete_ids(store, ids):
+    """Xóa các chunk có trong store, bỏ qua id không tồn tại"""
+    if _is_native(store):
+        store.delete(ids=ids)
+        return
+    existing = store._collection.get(ids=list(ids), include=[])["ids"]
+    if existing:
+        store._collection.delete(ids=existing)
+
+
+def search_by_vectors(store, vectors, k, where=None):
+    """
+    Tìm kiếm cho nhiều vector câu hỏi trong một lời gọi
+
+    Returns:
+        Danh sách (theo câu hỏi) các danh sách (Document, khoảng cách) tăng dần theo khoảng cách
+    """
+    if _is_native(store):
+        return store.similarity_search_by_vectors_with_score(vectors, k, filter=where)
+    if store._collection.count() == 0:
+        return [[] for _ in vectors]
+    found = store._collection.query(query_embeddings=vectors, n_results=k, where=where or None,
+                                    include=["documents", "metadatas", "distances"])
+    return [[(Document(page_content=text or "", metadata=metadata or {}), distance)
+             for text, metadata, distance in zip(texts, metadatas, distances)]
+            for texts, metadatas, distances in zip(found["documents"], found["metadatas"], found["distances"])]
+
+
+def iter_records(store, batch_size=5000):
+    """
+    Đọc toàn bộ dữ liệu đã lưu theo từng trang (không giữ cả collection trong bộ nhớ)
+
+    Yields:
+        (ids, vectors float32, documents, metadatas) của mỗi trang
+    """
+    if isinstance(store, ShardedVectorStore):
+        for shard in store.shards.values():
+            yield from iter_records(shard, batch_size)
+        return
+    get = store.get if _is_native(store) else store._collection.get
+    offset = 0
+    while True:
+        data = get(include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset)
+        if not data["ids"]:
+            return
+        yield (data["ids"], np.asarray(data["embeddings"], dtype=np.float32),
+               data["documents"], [metadata or {} for metadata in data["metadatas"]])
+        offset += len(data["ids"])
+
+
+def warm_up_store(store):
+    """Nạp index của store vào bộ nhớ mà không gọi API embedding"""
+    if _is_native(store):
+        store.warm_up()
+        return
+    # Truy vấn bằng một vector đã lưu để Chroma nạp segment HNSW vào bộ nhớ
+    sample = store._collection.peek(1)
+    embeddings = sample.get("embeddings")
+    if embeddings is not None and len(embeddings) > 0:
+        store._collection.query(query_embeddings=[list(embeddings[0])], n_results=1)
+
+
+class ShardedVectorStore(VectorStore):
+    def __init__(self,
+                 persist_directory: str,
+                 shard_key: str,
+                 open_shard: Callable[[str], VectorStore],
+                 embedding_function: Optional[Embeddings] = None,
+                 max_workers: int = 8):
+        """
+        Vector store gồm nhiều shard, mỗi giá trị của shard_key là một shard
+
+        Args:
+            persist_directory: Thư mục dữ liệu (danh sách shard lưu trong file <persist_directory>_shards.json)
+            shard_key: Khóa metadata dùng để chia shard (ví dụ "crawl_domain")
+            open_shard: Hàm open_shard(tên) mở (hoặc tạo) vector store của một shard
+            embedding_function: Embedding model dùng cho câu hỏi và add_texts
+            max_workers: Số shard được tìm kiếm song song tối đa
+        """
+        self.persist_directory = persist_directory
+        self.shard_key = shard_key
+        self._open_shard = open_shard
+        self._embedding = embedding_function
+        self._lock = threading.Lock()
+        self._registry_path = shards_path_for(persist_directory)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="shard-search")
+
+        names = {}
+        if os.path.exists(self._registry_path):
+            with open(self._registry_path, "r", encoding="utf-8") as f:
+                registry = json.load(f)
+            if registry.get("shard_key") != shard_key:
+                raise ValueError(f"Dữ liệu tại {persist_directory} được chia shard theo "
+                                 f"{registry.get('shard_key')}, không phải {shard_key}")
+            names = registry.get("shards", {})
+        self._names = dict(names)
+        self._shards = {value: open_shard(name) for value, name in names.items()}
+
+    @classmethod
+    def exists(cls, persist_directory):
+        """Thư mục đã chứa dữ liệu chia shard hay chưa"""
+        return os.path.exists(shards_path_for(persist_directory))
+
+    @staticmethod
+    def shard_name(value):
+        """Tên shard hợp lệ cho cả Chroma (chữ, số, gạch ngang; 3-63 ký tự) và tên thư mục"""
+        slug = re.sub(r"[^A-Za-z0-9]+", "-", value).strip("-")[:40]
+        digest = hashlib.sha1(value.encode("utf-8")).hexdigest()[:8]
+        return f"shard-{slug}-{digest}" if slug else f"shard-{digest}"
+
+    def _save_registry(self):
+        """Ghi danh sách shard (phải giữ lock khi gọi)"""
+        tmp_path = self._registry_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "shard_key": self.shard_key, "shards": self._names},
+                      f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self._registry_path)
+
+    def _shard_for(self, value):
+        with self._lock:
+            store = self._shards.get(value)
+            if store is None:
+                name = self.shard_name(value)
+                store = self._shards[value] = self._open_shard(name)
+                self._names[value] = name
+                self._save_registry()
+            return store
+
+    def _value_of(self, metadata):
+        value = (metadata or {}).get(self.shard_key)
+        return "" if value is None else str(value)
+
+    def _group(self, metadatas):
+        """Nhóm vị trí các phần tử theo shard"""
+        groups = {}
+        for i, metadata in enumerate(metadatas):
+            groups.setdefault(self._value_of(metadata), []).append(i)
+        return groups
+
+    @property
+    def shards(self):
+        """Dict giá trị khóa shard -> vector store của shard"""
+        with self._lock:
+            return dict(self._shards)
+
+    def select_shards(self, where=None):
+        """Các shard có thể chứa kết quả khớp bộ lọc"""
+        shards = self.shards
+        allowed = allowed_values(where, self.shard_key)
+        if allowed is None:
+            return list(shards.values())
+        allowed = {str(value) for value in allowed}
+        return [store for value, store in shards.items() if value in allowed]
+
+    # ----- Ghi -----
+
+    def upsert_vectors(self, ids: List[str], embeddings: List[List[float]],
+                       metadatas: Optional[List[dict]] = None, documents: Optional[List[str]] = None):
+        metadatas = metadatas or [{} for _ in ids]
+        documents = documents or ["" for _ in ids]
+        for value, positions in self._group(metadatas).items():
+            upsert_vectors(self._shard_for(value), [ids[i] for i in positions], [embeddings[i] for i in positions],
+                           [metadatas[i] for i in positions], [documents[i] for i in positions])
+
+    def update_metadata(self, ids: List[str], metadatas: List[dict]):
+        # Metadata mới vẫn giữ giá trị khóa shard nên chunk không đổi shard
+        for value, positions in self._group(metadatas).items():
+            update_metadata(self._shard_for(value), [ids[i] for i in positions], [metadatas[i] for i in positions])
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        self.upsert_vectors(ids, self._embedding.embed_documents(texts), metadatas, texts)
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return False
+        for store in self.shards.values():
+            delete_ids(store, ids)
+        return True
+
+    def persist(self):
+        for store in self.shards.values():
+            if hasattr(store, "persist"):
+                store.persist()
+
+    def delete_collection(self):
+        """Xóa toàn bộ shard và danh sách shard"""
+        with self._lock:
+            for store in self._shards.values():
+                store.delete_collection()
+            self._shards.clear()
+            self._names.clear()
+            if os.path.exists(self._registry_path):
+                os.remove(self._registry_path)
+
+    # ----- Tìm kiếm -----
+
+    def similarity_search_by_vectors_with_score(self, embeddings: List[List[float]], k: int = 4,
+                                                filter: Optional[dict] = None) -> List[List[Tuple[Document, float]]]:
+        """Tìm song song trên các shard được chọn, gộp k kết quả có khoảng cách nhỏ nhất cho mỗi câu hỏi"""
+        stores = self.select_shards(filter)
+        if not stores:
+            return [[] for _ in embeddings]
+        if len(stores) == 1:
+            return search_by_vectors(stores[0], embeddings, k, filter)
+        futures = [self._executor.submit(search_by_vectors, store, embeddings, k, filter) for store in stores]
+        per_shard = [future.result() for future in futures]
+        return [heapq.nsmallest(k, (item for results in per_shard for item in results[i]), key=lambda item: item[1])
+                for i in range(len(embeddings))]
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[dict] = None,
+                                               **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vectors_with_score([embedding], k, filter)[0]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[dict] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[dict] = None,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        if not self.select_shards(filter):
+            return []
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k, filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None,
+                          **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        for store in self.shards.values():
+            return store._select_relevance_score_fn()
+        return lambda distance: 1.0 - distance
+
+    def get(self, ids: Optional[List[str]] = None, include: Optional[List[str]] = None, **kwargs: Any):
+        """Đọc dữ liệu của mọi shard theo định dạng giống Chroma.get"""
+        include = include or ["documents", "metadatas"]
+        result = {"ids": []}
+        for key in include:
+            result[key] = []
+        for store in self.shards.values():
+            data = store.get(ids=ids, include=include)
+            result["ids"].extend(data["ids"])
+            for key in include:
+                values = data.get(key)
+                if values is not None:
+                    result[key].extend(list(values))
+        return result
+
+    def warm_up(self):
+        for store in self.shards.values():
+            warm_up_store(store)
+
+    def stats(self):
+        """Số chunk của từng shard"""
+        counts = {}
+        for value, store in self.shards.items():
+            counts[value] = len(store) if _is_native(store) else store._collection.count()
+        return {"shard_key": self.shard_key, "shards": len(counts), "chunks": counts}
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, persist_directory: str = "./sharded_db",
+                   shard_key: str = "source_dir", open_shard: Optional[Callable[[str], VectorStore]] = None,
+                   **kwargs: Any) -> "ShardedVectorStore":
+        if open_shard is None:
+            raise ValueError("Cần open_shard để mở vector store của từng shard")
+        store = cls(persist_directory, shard_key, open_shard, embedding_function=embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        store.persist()
+        return store
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self._embedding
@@ -0,0 +1,266 @@
+"""
+Snapshot một file của index: văn bản và metadata của các chunk (nén gzip), ma trận embedding float16
+và các file phụ (manifest, BM25, chỉ mục chunk gần trùng). Dùng để sao chép index sang node khác
+hoặc khởi động nhanh mà không phải embedding lại.
+
+Cấu trúc file:
+    [0:8]    MAGIC
+    [8:16]   vị trí header (uint64 little-endian)
+    [16:24]  độ dài header
+    [24:56]  sha256 của header
+    [64:...] các section, mỗi section bắt đầu ở vị trí chia hết cho 64 (ma trận vector đọc được bằng mmap)
+    cuối file: header JSON (phiên bản, số chunk, số chiều, vị trí, độ dài và sha256 của từng section)
+
+Ví dụ:
+    python snapshot.py info index.ragsnap
+    python snapshot.py verify index.ragsnap
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import time
+import zlib
+
+import numpy as np
+
+MAGIC = b"RAGSNAP\x00"
+FORMAT_VERSION = 1
+
+_PREFIX = struct.Struct("<8sQQ32s")
+_ALIGN = 64
+_READ_BLOCK = 1 << 20
+
+
+class SnapshotError(Exception):
+    """File snapshot không hợp lệ, sai phiên bản hoặc sai checksum"""
+
+
+def _pad(f):
+    padding = -f.tell() % _ALIGN
+    if padding:
+        f.write(b"\x00" * padding)
+
+
+def _copy_section(src, dst):
+    """Chép nội dung file src vào cuối dst, trả về (vị trí, độ dài, sha256)"""
+    _pad(dst)
+    offset = dst.tell()
+    digest = hashlib.sha256()
+    for block in iter(lambda: src.read(_READ_BLOCK), b""):
+        digest.update(block)
+        dst.write(block)
+    return {"offset": offset, "length": dst.tell() - offset, "sha256": digest.hexdigest()}
+
+
+def write_snapshot(path, records, files=None, info=None):
+    """
+    Ghi snapshot ra file (ghi vào file tạm rồi đổi tên, không để lại file dở dang)
+
+    Args:
+        path: Đường dẫn file snapshot
+        records: Iterable các trang (ids, vectors, documents, metadatas) như sharded_store.iter_records
+        files: Dict tên -> đường dẫn các file phụ được đóng gói kèm (file không tồn tại được bỏ qua)
+        info: Thông tin thêm ghi vào header (model embedding, cấu hình chia chunk...)
+
+    Returns:
+        Header của snapshot
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    count, dimension = 0, None
+    sections = {}
+    fd, tmp_path = tempfile.mkstemp(prefix=".snapshot-", dir=directory)
+    try:
+        with os.fdopen(fd, "w+b") as out, tempfile.TemporaryFile(dir=directory) as chunks:
+            out.write(b"\x00" * _ALIGN)
+            # Ma trận vector được ghi thẳng vào file, chunk được nén vào file tạm rồi chép sang sau
+            vector_offset = out.tell()
+            vector_digest = hashlib.sha256()
+            with gzip.GzipFile(fileobj=chunks, mode="wb", compresslevel=6) as compressed:
+                for ids, vectors, documents, metadatas in records:
+                    vectors = np.ascontiguousarray(vectors, dtype=np.float16)
+                    if dimension is None:
+                        dimension = vectors.shape[1]
+                    elif vectors.shape[1] != dimension:
+                        raise SnapshotError(f"Vector có {vectors.shape[1]} chiều, snapshot đang ghi {dimension} chiều")
+                    data = vectors.tobytes()
+                    vector_digest.update(data)
+                    out.write(data)
+                    for record in zip(ids, documents, metadatas):
+                        compressed.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+                    count += len(ids)
+            sections["vectors"] = {"offset": vector_offset, "length": out.tell() - vector_offset,
+                                   "sha256": vector_digest.hexdigest()}
+            chunks.seek(0)
+            sections["chunks"] = _copy_section(chunks, out)
+
+            for name, file_path in (files or {}).items():
+                if file_path and os.path.exists(file_path):
+                    with open(file_path, "rb") as f:
+                        sections[f"file:{name}"] = _copy_section(f, out)
+
+            header = dict(info or {})
+            header.update({"format": FORMAT_VERSION, "created_at": time.time(), "chunks": count,
+                           "dimension": dimension, "vector_dtype": "float16", "sections": sections})
+            header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+            _pad(out)
+            header_offset = out.tell()
+            out.write(header_bytes)
+            out.seek(0)
+            out.write(_PREFIX.pack(MAGIC, header_offset, len(header_bytes), hashlib.sha256(header_bytes).digest()))
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return header
+
+
+class Snapshot:
+    def __init__(self, path):
+        """
+        Mở file snapshot để đọc; ma trận vector được memory-map, không đọc cả file vào bộ nhớ
+
+        Raises:
+            SnapshotError: File không phải snapshot, sai phiên bản hoặc header bị hỏng
+        """
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            prefix = self._file.read(_PREFIX.size)
+            if len(prefix) < _PREFIX.size:
+                raise SnapshotError(f"{path} không phải file snapshot")
+            magic, header_offset, header_length, header_digest = _PREFIX.unpack(prefix)
+            if magic != MAGIC:
+                raise SnapshotError(f"{path} không phải file snapshot")
+            self._file.seek(header_offset)
+            header_bytes = self._file.read(header_length)
+            if hashlib.sha256(header_bytes).digest() != header_digest:
+                raise SnapshotError(f"Header của snapshot {path} bị hỏng (sai checksum)")
+            self.header = json.loads(header_bytes)
+            if self.header.get("format") != FORMAT_VERSION:
+                raise SnapshotError(f"Snapshot phiên bản {self.header.get('format')} không được hỗ trợ "
+                                    f"(phiên bản hiện tại: {FORMAT_VERSION})")
+        except BaseException:
+            self._file.close()
+            raise
+        self._vectors = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._vectors = None
+        self._file.close()
+
+    def __len__(self):
+        return self.header["chunks"]
+
+    @property
+    def dimension(self):
+        return self.header["dimension"]
+
+    @property
+    def vectors(self):
+        """Ma trận embedding float16 (chunks x dimension), đọc qua mmap"""
+        if self._vectors is None:
+            if not len(self):
+                return np.empty((0, self.dimension or 0), dtype=np.float16)
+            self._vectors = np.memmap(self.path, dtype=np.float16, mode="r",
+                                      offset=self.header["sections"]["vectors"]["offset"],
+                                      shape=(len(self), self.dimension))
+        return self._vectors
+
+    def _read_section(self, name):
+        """Đọc nội dung một section theo từng khối"""
+        section = self.header["sections"][name]
+        self._file.seek(section["offset"])
+        remaining = section["length"]
+        while remaining:
+            block = self._file.read(min(_READ_BLOCK, remaining))
+            if not block:
+                raise SnapshotError(f"Snapshot {self.path} bị cắt cụt ở section {name}")
+            remaining -= len(block)
+            yield block
+
+    def verify(self):
+        """
+        Kiểm tra sha256 của mọi section
+
+        Raises:
+            SnapshotError: Có section sai checksum
+        """
+        for name, section in self.header["sections"].items():
+            digest = hashlib.sha256()
+            for block in self._read_section(name):
+                digest.update(block)
+            if digest.hexdigest() != section["sha256"]:
+                raise SnapshotError(f"Section {name} của snapshot {self.path} bị hỏng (sai checksum)")
+
+    def iter_chunks(self, batch_size=5000):
+        """
+        Giải nén các chunk theo luồng
+
+        Yields:
+            (start, ids, documents, metadatas): start là dòng đầu tiên của trang trong ma trận vector
+        """
+        decompressor = zlib.decompressobj(wbits=31)
+        ids, documents, metadatas = [], [], []
+        start = 0
+        pending = b""
+        for block in self._read_section("chunks"):
+            pending += decompressor.decompress(block)
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                chunk_id, document, metadata = json.loads(line)
+                ids.append(chunk_id)
+                documents.append(document)
+                metadatas.append(metadata)
+                if len(ids) >= batch_size:
+                    yield start, ids, documents, metadatas
+                    start += len(ids)
+                    ids, documents, metadatas = [], [], []
+        if ids:
+            yield start, ids, documents, metadatas
+
+    def files(self):
+        """Tên các file phụ có trong snapshot"""
+        return [name[len("file:"):] for name in self.header["sections"] if name.startswith("file:")]
+
+    def extract_file(self, name, path):
+        """Ghi file phụ ra đường dẫn path (ghi file tạm rồi đổi tên)"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            for block in self._read_section(f"file:{name}"):
+                f.write(block)
+        os.replace(tmp_path, path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Xem thông tin hoặc kiểm tra checksum của file snapshot")
+    parser.add_argument("command", choices=["info", "verify"])
+    parser.add_argument("path")
+    args = parser.parse_args()
+
+    with Snapshot(args.path) as snapshot:
+        if args.command == "verify":
+            start = time.perf_counter()
+            snapshot.verify()
+            print(f"Snapshot hợp lệ ({os.path.getsize(args.path)} bytes, kiểm tra trong "
+                  f"{time.perf_counter() - start:.2f}s)")
+        else:
+            header = dict(snapshot.header)
+            header["created_at"] = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(header["created_at"]))
+            print(json.dumps(header, ensure_ascii=False, indent=2))
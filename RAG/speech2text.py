@@ -1,32 +1,315 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import whisper
+from whisper.audio import SAMPLE_RATE
+
+# Cache mô hình trong tiến trình: mỗi (kích thước, thiết bị) chỉ được tải một lần
+_MODELS = {}
+_MODELS_LOCK = threading.Lock()
+# Mỗi mô hình chỉ chạy một lượt transcribe tại một thời điểm: các lượt chạy song song trên
+# cùng mô hình sẽ ghi đè kv-cache hook của nhau
+_MODEL_RUN_LOCKS = {}
+
+# Mô hình của worker trong process pool (mỗi worker tải một mô hình)
+_worker_model = None
+_worker_options = None
+
+
+def get_model(model_size="base", device=None):
+    """
+    Lấy mô hình Whisper từ cache, tải nếu chưa có.
+
+    Tham số:
+    model_size (str): Kích thước mô hình (tiny, base, small, medium, large)
+    device (str): Thiết bị chạy mô hình (cpu, cuda), None để Whisper tự chọn
 
-def transcribe_audio(audio_file_path, model_size="base"):
+    Trả về:
+    whisper.Whisper: Mô hình đã tải
+    """
+    key = (model_size, device)
+    model = _MODELS.get(key)
+    if model is None:
+        with _MODELS_LOCK:
+            model = _MODELS.get(key)
+            if model is None:
+                start = time.perf_counter()
+                model = whisper.load_model(model_size, device=device)
+                _MODEL_RUN_LOCKS[id(model)] = threading.Lock()
+                _MODELS[key] = model
+                print(f"Đã tải mô hình Whisper {model_size} trong {time.perf_counter() - start:.2f}s")
+    return model
+
+
+def _transcribe_options(model, language=None):
+    # fp16 chỉ dùng được trên GPU, tắt trên CPU để tránh cảnh báo và chuyển đổi thừa
+    options = {"fp16": model.device.type != "cpu"}
+    if language:
+        options["language"] = language
+    return options
+
+
+def transcribe_with_details(audio_file_path, model_size="base", language=None):
+    """
+    Chuyển đổi âm thanh thành văn bản, trả về cả ngôn ngữ nhận dạng được.
+
+    Tham số:
+    audio_file_path (str): Đường dẫn đến file âm thanh cần chuyển đổi
+    model_size (str): Kích thước mô hình (tiny, base, small, medium, large)
+    language (str): Mã ngôn ngữ (ví dụ "vi"), None để tự nhận dạng
+
+    Trả về:
+    dict: {"text", "language"}
+    """
+    model = get_model(model_size)
+    with _MODEL_RUN_LOCKS[id(model)]:
+        result = model.transcribe(audio_file_path, **_transcribe_options(model, language))
+    return {"text": result["text"], "language": result.get("language")}
+
+
+def transcribe_audio(audio_file_path, model_size="base", language=None):
     """
     Chuyển đổi âm thanh thành văn bản sử dụng OpenAI Whisper.
-    
+
     Tham số:
     audio_file_path (str): Đường dẫn đến file âm thanh cần chuyển đổi
     model_size (str): Kích thước mô hình (tiny, base, small, medium, large)
-    
+    language (str): Mã ngôn ngữ (ví dụ "vi"), None để tự nhận dạng
+
     Trả về:
     str: Văn bản được chuyển đổi
     """
-    # Tải mô hình
-    model = whisper.load_model(model_size)
-    
-    # Thực hiện chuyển đổi
-    result = model.transcribe(audio_file_path)
-    
+    # Mô hình được lấy từ cache (chỉ tải ở lần gọi đầu tiên)
+    result = transcribe_with_details(audio_file_path, model_size, language)
+
     # Trả về kết quả
     return result["text"]
 
+
+def detect_speech_segments(audio, sample_rate=SAMPLE_RATE, frame_ms=30, threshold_db=-35.0,
+                           min_silence_ms=400, min_speech_ms=250, padding_ms=200, max_segment_s=30.0):
+    """
+    Tìm các đoạn có tiếng nói dựa trên năng lượng (VAD đơn giản) và gom thành các đoạn
+    không dài quá max_segment_s, cắt tại các khoảng lặng.
+
+    Tham số:
+    audio (np.ndarray): Tín hiệu mono dạng float32
+    sample_rate (int): Tần số lấy mẫu
+    frame_ms (int): Độ dài mỗi khung phân tích (ms)
+    threshold_db (float): Ngưỡng năng lượng so với khung to nhất (dB), thấp hơn là khoảng lặng
+    min_silence_ms (int): Khoảng lặng ngắn hơn giá trị này không được dùng để cắt
+    min_speech_ms (int): Đoạn tiếng nói ngắn hơn giá trị này bị bỏ qua
+    padding_ms (int): Phần đệm thêm ở hai đầu mỗi đoạn
+    max_segment_s (float): Độ dài tối đa của một đoạn (Whisper xử lý cửa sổ 30 giây)
+
+    Trả về:
+    list: Các cặp (start, end) tính bằng sample
+    """
+    frame = max(1, int(sample_rate * frame_ms / 1000))
+    n_frames = len(audio) // frame
+    if n_frames == 0:
+        return [(0, len(audio))] if len(audio) else []
+
+    frames = np.asarray(audio[:n_frames * frame], dtype=np.float32).reshape(n_frames, frame)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1) + 1e-12)
+    level_db = 20 * np.log10(rms / rms.max())
+    voiced = np.concatenate(([False], level_db > threshold_db, [False]))
+    edges = np.flatnonzero(np.diff(voiced.astype(np.int8)))
+    runs = [[int(start), int(end)] for start, end in zip(edges[::2], edges[1::2])]
+    if not runs:
+        return []
+
+    # Nối các đoạn cách nhau bởi khoảng lặng quá ngắn, bỏ các tiếng động ngắn
+    min_silence = max(1, min_silence_ms // frame_ms)
+    merged = [runs[0]]
+    for start, end in runs[1:]:
+        if start - merged[-1][1] < min_silence:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    min_speech = max(1, min_speech_ms // frame_ms)
+    merged = [run for run in merged if run[1] - run[0] >= min_speech] or merged
+
+    # Gom các đoạn liên tiếp thành đoạn dài tối đa max_segment_s, đoạn quá dài được cắt đều
+    padding = int(sample_rate * padding_ms / 1000)
+    max_len = int(sample_rate * max_segment_s)
+    spans = [(max(0, start * frame - padding), min(len(audio), end * frame + padding)) for start, end in merged]
+    segments = []
+    for start, end in spans:
+        if segments and end - segments[-1][0] <= max_len:
+            segments[-1] = (segments[-1][0], end)
+            continue
+        while end - start > max_len:
+            segments.append((start, start + max_len))
+            start += max_len
+        segments.append((start, end))
+    return segments
+
+
+def _init_worker(model_size, language, threads):
+    """Khởi tạo worker: giới hạn số thread của torch và tải mô hình một lần cho cả worker"""
+    global _worker_model, _worker_options
+    import torch
+    if threads:
+        torch.set_num_threads(threads)
+    _worker_model = get_model(model_size)
+    _worker_options = _transcribe_options(_worker_model, language)
+
+
+def _transcribe_file_task(audio_file_path):
+    start = time.perf_counter()
+    try:
+        audio = whisper.load_audio(audio_file_path)
+        result = _worker_model.transcribe(audio, **_worker_options)
+        return {
+            "file": audio_file_path,
+            "text": result["text"].strip(),
+            "language": result.get("language"),
+            "duration": len(audio) / SAMPLE_RATE,
+            "seconds": time.perf_counter() - start,
+            "error": None
+        }
+    except Exception as e:
+        # Lỗi của ffmpeg kèm cả phần giới thiệu phiên bản, chỉ giữ dòng cuối
+        message = str(e).strip().splitlines()[-1] if str(e).strip() else repr(e)
+        return {"file": audio_file_path, "text": "", "language": None, "duration": 0.0,
+                "seconds": time.perf_counter() - start, "error": message}
+
+
+def _transcribe_segment_task(audio, offset):
+    result = _worker_model.transcribe(audio, condition_on_previous_text=False, **_worker_options)
+    return [
+        {"start": round(offset + segment["start"], 2),
+         "end": round(offset + segment["end"], 2),
+         "text": segment["text"].strip()}
+        for segment in result["segments"]
+    ]
+
+
+class TranscriptionPool:
+    def __init__(self, model_size="base", workers=None, language=None):
+        """
+        Process pool chuyển đổi âm thanh, mỗi worker giữ một mô hình Whisper riêng.
+
+        Tham số:
+        model_size (str): Kích thước mô hình
+        workers (int): Số process, mặc định tối đa 4 và không quá số CPU
+        language (str): Mã ngôn ngữ (ví dụ "vi"), None để tự nhận dạng
+        """
+        cpu_count = os.cpu_count() or 1
+        self.workers = max(1, workers or min(4, cpu_count))
+        # Chia đều CPU cho các worker để các thread của torch không tranh nhau
+        threads = max(1, cpu_count // self.workers)
+        # Dùng spawn vì fork một tiến trình đã khởi tạo torch có thể bị treo
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_size, language, threads)
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def transcribe_files(self, audio_file_paths):
+        """
+        Chuyển đổi nhiều file song song, mỗi file do một worker xử lý.
+
+        Trả về:
+        list: Kết quả theo thứ tự đầu vào, mỗi phần tử là dict
+              {"file", "text", "language", "duration", "seconds", "error"}
+        """
+        start = time.perf_counter()
+        results = list(self._executor.map(_transcribe_file_task, audio_file_paths))
+        elapsed = time.perf_counter() - start
+        audio_seconds = sum(result["duration"] for result in results)
+        failed = sum(1 for result in results if result["error"])
+        print(f"Đã chuyển {len(results) - failed}/{len(results)} file ({audio_seconds:.1f}s âm thanh) "
+              f"trong {elapsed:.1f}s với {self.workers} worker: "
+              f"{audio_seconds / max(elapsed, 1e-9):.2f} giây âm thanh/giây")
+        return results
+
+    def transcribe_long(self, audio_file_path, max_segment_s=30.0):
+        """
+        Chia file dài theo khoảng lặng, chuyển đổi các đoạn song song rồi ghép lại theo thời gian.
+
+        Trả về:
+        dict: {"text", "segments": [{"start", "end", "text"}], "duration", "seconds", "audio_seconds_per_second"}
+        """
+        start = time.perf_counter()
+        audio = whisper.load_audio(audio_file_path)
+        spans = detect_speech_segments(audio, max_segment_s=max_segment_s)
+        futures = [self._executor.submit(_transcribe_segment_task, audio[begin:end], begin / SAMPLE_RATE)
+                   for begin, end in spans]
+        segments = []
+        for future in futures:
+            segments.extend(future.result())
+        elapsed = time.perf_counter() - start
+        duration = len(audio) / SAMPLE_RATE
+        speed = duration / max(elapsed, 1e-9)
+        print(f"Đã chuyển {audio_file_path} ({duration:.1f}s âm thanh, {len(spans)} đoạn) "
+              f"trong {elapsed:.1f}s: {speed:.2f} giây âm thanh/giây")
+        return {
+            "text": " ".join(segment["text"] for segment in segments if segment["text"]),
+            "segments": segments,
+            "duration": duration,
+            "seconds": elapsed,
+            "audio_seconds_per_second": speed
+        }
+
+
+def transcribe_batch(audio_file_paths, model_size="base", workers=None, language=None):
+    """
+    Chuyển đổi nhiều file âm thanh bằng một process pool (mỗi worker tải mô hình một lần).
+
+    Trả về:
+    list: Kết quả của từng file (xem TranscriptionPool.transcribe_files)
+    """
+    with TranscriptionPool(model_size, workers, language) as pool:
+        return pool.transcribe_files(audio_file_paths)
+
+
+def transcribe_long_audio(audio_file_path, model_size="base", workers=None, language=None, max_segment_s=30.0):
+    """
+    Chuyển đổi file âm thanh dài: chia theo khoảng lặng và xử lý các đoạn song song.
+
+    Trả về:
+    dict: Văn bản, các đoạn kèm thời gian và tốc độ xử lý (xem TranscriptionPool.transcribe_long)
+    """
+    with TranscriptionPool(model_size, workers, language) as pool:
+        return pool.transcribe_long(audio_file_path, max_segment_s=max_segment_s)
+
 # Ví dụ sử dụng
 if __name__ == "__main__":
-    # Thay đổi đường dẫn đến file âm thanh của bạn
-    audio_file = "output.mp3"
-    
-    # Chuyển đổi sử dụng mô hình base
-    text = transcribe_audio(audio_file, model_size="tiny")
-    
-    print("Kết quả chuyển đổi:")
-    print(text)
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Chuyển đổi âm thanh thành văn bản bằng Whisper")
+    parser.add_argument("files", nargs="*", default=["output.mp3"], help="Các file âm thanh")
+    parser.add_argument("--model", default="tiny", help="Kích thước mô hình")
+    parser.add_argument("--language", help="Mã ngôn ngữ, ví dụ vi")
+    parser.add_argument("--workers", type=int, help="Số process")
+    parser.add_argument("--segment", action="store_true", help="Chia file dài theo khoảng lặng và xử lý song song")
+    args = parser.parse_args()
+
+    if args.segment:
+        for audio_file in args.files:
+            result = transcribe_long_audio(audio_file, args.model, args.workers, args.language)
+            for segment in result["segments"]:
+                print(f"[{segment['start']:7.2f} - {segment['end']:7.2f}] {segment['text']}")
+    elif len(args.files) > 1:
+        for result in transcribe_batch(args.files, args.model, args.workers, args.language):
+            print(f"{result['file']}: {result['error'] or result['text']}")
+    else:
+        text = transcribe_audio(args.files[0], model_size=args.model, language=args.language)
+        print("Kết quả chuyển đổi:")
+        print(text)
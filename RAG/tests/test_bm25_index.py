@@ -0,0 +1,156 @@
+"""
+Chỉ mục BM25: điểm khớp với công thức BM25, lưu tăng dần qua nhật ký, gộp nhật ký và đọc file định dạng cũ
+"""
+import gzip
+import json
+import math
+import os
+import random
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bm25_index import BM25Index, tokenize
+
+
+def make_texts(n, seed=0):
+    rng = random.Random(seed)
+    vocab = [f"từ{i}" for i in range(200)]
+    weights = [1 / (i + 1) for i in range(200)]
+    return {f"c{i}": " ".join(rng.choices(vocab, weights=weights, k=rng.randint(5, 40))) for i in range(n)}
+
+
+def brute_force(texts, query, k1=1.5, b=0.75):
+    """Điểm BM25 tính trực tiếp trên văn bản"""
+    counts = {doc_id: Counter(tokenize(text)) for doc_id, text in texts.items()}
+    avg_len = sum(sum(c.values()) for c in counts.values()) / len(counts)
+    scores = {}
+    for term in set(tokenize(query)):
+        df = sum(1 for c in counts.values() if term in c)
+        idf = math.log(1 + (len(counts) - df + 0.5) / (df + 0.5))
+        for doc_id, c in counts.items():
+            if term in c:
+                length = sum(c.values())
+                score = idf * c[term] * (k1 + 1) / (c[term] + k1 * (1 - b + b * length / avg_len))
+                scores[doc_id] = scores.get(doc_id, 0.0) + score
+    return scores
+
+
+def assert_matches(index, texts, queries=("từ0 từ7 từ150", "từ199", "từ1 từ2 từ3")):
+    for query in queries:
+        expected = brute_force(texts, query)
+        found = index.search(query, k=10)
+        top = sorted(expected.values(), reverse=True)[:10]
+        assert [round(score, 4) for _, score in found] == [round(score, 4) for score in top]
+        assert all(math.isclose(expected[doc_id], score, rel_tol=1e-5) for doc_id, score in found)
+
+
+def test_search_matches_bm25_after_updates(tmp_path):
+    texts = make_texts(500)
+    index = BM25Index(str(tmp_path / "db_bm25.npz"), max_df_ratio=None)
+    index.add(list(texts), list(texts.values()))
+    index.save()
+    assert_matches(index, texts)
+
+    removed = list(texts)[:50]
+    index.remove(removed)
+    for doc_id in removed:
+        del texts[doc_id]
+    updated = {doc_id: "từ199 từ198 từ199" for doc_id in list(texts)[:20]}
+    index.add(list(updated), list(updated.values()))
+    texts.update(updated)
+
+    assert len(index) == len(texts)
+    assert_matches(index, texts)
+
+
+def test_incremental_save_appends_to_journal(tmp_path):
+    path = str(tmp_path / "db_bm25.npz")
+    texts = make_texts(200)
+    index = BM25Index(path, max_df_ratio=None)
+    index.add(list(texts), list(texts.values()))
+    index.save()
+    base_mtime = os.stat(path).st_mtime_ns
+    assert not os.path.exists(index.journal_path)
+
+    index.add(["new"], ["từ199 từ199 hiếm"], [{"source": "new.md"}])
+    index.remove(["c0"])
+    index.save()
+
+    # File chính không bị ghi lại, chỉ nhật ký được ghi thêm
+    assert os.stat(path).st_mtime_ns == base_mtime
+    assert os.path.exists(index.journal_path)
+    texts["new"] = "từ199 từ199 hiếm"
+    del texts["c0"]
+    reloaded = BM25Index(path, max_df_ratio=None)
+    assert len(reloaded) == len(texts)
+    assert reloaded.get("new") == ("từ199 từ199 hiếm", {"source": "new.md"})
+    assert reloaded.get("c0") is None
+    assert_matches(reloaded, texts)
+
+    reloaded.save(compact=True)
+    assert not os.path.exists(index.journal_path)
+    assert_matches(BM25Index(path, max_df_ratio=None), texts)
+
+
+def test_large_journal_is_compacted(tmp_path):
+    path = str(tmp_path / "db_bm25.npz")
+    index = BM25Index(path, max_df_ratio=None)
+    index.add(["a"], ["từ1"])
+    index.save()
+    texts = make_texts(1500, seed=1)
+    index.add(list(texts), list(texts.values()))
+    index.save()
+
+    assert not os.path.exists(index.journal_path)
+    texts["a"] = "từ1"
+    assert_matches(BM25Index(path, max_df_ratio=None), texts)
+
+
+def test_truncated_journal_keeps_complete_changes(tmp_path):
+    path = str(tmp_path / "db_bm25.npz")
+    index = BM25Index(path)
+    index.add(["a"], ["máy bay"])
+    index.save()
+    index.add(["b"], ["tàu hỏa"])
+    index.save()
+    complete = os.path.getsize(index.journal_path)
+    index.add(["c"], ["xe đạp"])
+    index.save()
+    # Lần ghi thứ hai bị ngắt giữa chừng
+    with open(index.journal_path, "rb") as f:
+        data = f.read()
+    with open(index.journal_path, "wb") as f:
+        f.write(data[:complete + (len(data) - complete) // 2])
+
+    reloaded = BM25Index(path)
+    assert reloaded.get("b") is not None and reloaded.get("c") is None
+    reloaded.save()
+    assert not os.path.exists(index.journal_path)
+    assert sorted(doc_id for doc_id, _ in BM25Index(path).search("tàu hỏa máy bay")) == ["a", "b"]
+
+
+def test_frequent_terms_are_skipped_when_query_has_rarer_terms(tmp_path):
+    index = BM25Index(str(tmp_path / "db_bm25.npz"), max_df_ratio=0.5)
+    index.add([f"c{i}" for i in range(10)], ["tài liệu chung"] * 9 + ["tài liệu đặc biệt"])
+
+    found = index.search("tài liệu đặc biệt", k=10)
+    assert [doc_id for doc_id, _ in found] == ["c9"]
+    # Câu hỏi chỉ có từ phổ biến vẫn có kết quả
+    assert len(index.search("tài liệu", k=10)) == 10
+
+
+def test_predicate_and_legacy_file(tmp_path):
+    path = str(tmp_path / "db_bm25.npz")
+    docs = {"a": ["máy bay", {"source": "a.md"}], "b": ["máy bay cánh quạt", {"source": "b.md"}]}
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump({"docs": docs}, f)
+
+    index = BM25Index(path)
+    assert len(index) == 2
+    assert [doc_id for doc_id, _ in index.search("máy bay", predicate=lambda m: m["source"] == "b.md")] == ["b"]
+    index.save()
+    with open(path, "rb") as f:
+        assert f.read(2) != b"\x1f\x8b"
+    assert BM25Index(path).get("a") == ("máy bay", {"source": "a.md"})
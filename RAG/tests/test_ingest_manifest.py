@@ -0,0 +1,89 @@
+"""
+Manifest nạp tài liệu: chỉ nạp lại file mới hoặc đã thay đổi, loại bỏ chunk của file đã xóa
+"""
+import os
+import time
+
+from ingest_manifest import IngestManifest
+from test_reset_reload import make_chatbot, make_docs
+
+OPTIONS = {"embedding_backend": "hashing", "embedding_dimension": 64}
+
+
+def rewrite(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    # mtime chắc chắn khác lần ghi trước kể cả trên hệ thống file có độ phân giải thời gian thấp
+    mtime = time.time() + 10
+    os.utime(path, (mtime, mtime))
+
+
+def test_check_statuses(tmp_path):
+    path = str(tmp_path / "a.md")
+    rewrite(path, "nội dung một")
+    manifest = IngestManifest(str(tmp_path / "manifest.json"))
+
+    status, content_hash, stat = manifest.check(path)
+    assert status == "new"
+    manifest.update(path, content_hash, ["a-0"], stat)
+    assert manifest.check(path)[0] == "unchanged"
+
+    # Chỉ đổi mtime: không cần nạp lại, manifest ghi nhận mtime mới
+    os.utime(path, (stat.st_mtime + 20, stat.st_mtime + 20))
+    assert manifest.check(path)[0] == "unchanged"
+    assert manifest.get(path)["mtime"] == stat.st_mtime + 20
+
+    rewrite(path, "nội dung hai")
+    assert manifest.check(path)[0] == "modified"
+    assert manifest.check(path, splitter="khác")[0] == "modified"
+
+
+def test_file_rewritten_between_check_and_update(tmp_path):
+    path = str(tmp_path / "a.md")
+    rewrite(path, "nội dung một")
+    manifest = IngestManifest(str(tmp_path / "manifest.json"))
+
+    status, content_hash, stat = manifest.check(path)
+    rewrite(path, "nội dung hai, dài hơn")
+    manifest.update(path, content_hash, ["a-0"], stat)
+
+    assert manifest.check(path)[0] == "modified"
+
+
+def test_reload_only_changed_files(tmp_path):
+    docs = str(tmp_path / "docs")
+    make_docs(docs)
+    chatbot = make_chatbot(str(tmp_path / "db"), **OPTIONS)
+    chunks = chatbot.load_directory(docs)
+    assert chunks > 0
+    assert chatbot.load_directory(docs) == 0
+
+    rewrite(os.path.join(docs, "doc1.md"), "# Tài liệu 1\n\nnội dung mới của tài liệu một")
+    os.remove(os.path.join(docs, "doc2.md"))
+    assert chatbot.load_directory(docs) == 1
+
+    restarted = make_chatbot(str(tmp_path / "db"), **OPTIONS)
+    assert restarted.load_directory(docs) == 0
+    sources = {os.path.basename(metadata["source"]) for metadata in restarted.vectorstore.get()["metadatas"]}
+    assert sources == {"doc0.md", "doc1.md", "doc3.md"}
+
+
+def test_file_rewritten_during_ingestion_is_reloaded(tmp_path):
+    docs = str(tmp_path / "docs")
+    make_docs(docs)
+    path = os.path.join(docs, "doc0.md")
+    chatbot = make_chatbot(str(tmp_path / "db"), **OPTIONS)
+    check = chatbot.manifest.check
+
+    def check_then_rewrite(file_path, splitter=None):
+        result = check(file_path, splitter)
+        if file_path == path:
+            # Crawler ghi lại file sau khi manifest đã tính hash
+            rewrite(path, "# Tài liệu 0\n\nphiên bản mới")
+        return result
+    chatbot.manifest.check = check_then_rewrite
+    chatbot.load_directory(docs)
+    chatbot.manifest.check = check
+
+    assert chatbot.load_directory(docs) == 1
+    assert chatbot.load_directory(docs) == 0
@@ -0,0 +1,111 @@
+"""
+Hàng đợi job tải tài liệu: chạy tiếp từ nhóm file đã ghi nhận sau khi tiến trình dừng đột ngột, và hủy job
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from job_queue import JobQueue
+
+
+class Crash(BaseException):
+    """Tiến trình dừng đột ngột giữa lúc tải"""
+
+
+class FakeChatbot:
+    """Ghi lại các nhóm file được tải; on_batch được gọi sau mỗi nhóm"""
+
+    def __init__(self, directory, on_batch=None):
+        self.directory = directory
+        self.on_batch = on_batch
+        self.batches = []
+
+    def purge_missing_files(self, directory_path):
+        return 0
+
+    def list_files(self, directory_path):
+        return sorted(os.path.join(directory_path, name) for name in os.listdir(directory_path))
+
+    def load_documents(self, paths, on_file_done=None):
+        self.batches.append(list(paths))
+        for path in paths:
+            on_file_done(path, "done", 3)
+        if self.on_batch is not None:
+            self.on_batch(len(self.batches))
+
+
+def make_files(directory, n):
+    os.makedirs(directory)
+    for i in range(n):
+        with open(os.path.join(directory, f"doc{i}.md"), "w", encoding="utf-8") as f:
+            f.write(f"Tài liệu {i}")
+    return str(directory)
+
+
+def wait_finished(queue, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} chưa kết thúc: {queue.get(job_id)}")
+
+
+def test_interrupted_job_resumes_after_last_committed_batch(tmp_path):
+    docs = make_files(tmp_path / "docs", 5)
+    path = str(tmp_path / "db_jobs.sqlite3")
+
+    def crash(batch):
+        if batch == 2:
+            raise Crash()
+
+    first = JobQueue(path, commit_every=2)
+    first._chatbot = FakeChatbot(docs, on_batch=crash)
+    job_id = first.submit(docs, is_directory=True)["id"]
+    try:
+        first._run(first._claim())
+    except Crash:
+        pass
+    assert first.get(job_id)["status"] == "running"
+
+    # Khởi động lại: job được đưa lại vào hàng đợi, chỉ các file chưa ghi nhận được tải lại
+    restarted = JobQueue(path, commit_every=2, poll_interval=0.01)
+    job = restarted.get(job_id)
+    assert job["status"] == "queued" and job["processed_files"] == 2
+    chatbot = FakeChatbot(docs)
+    restarted.start(chatbot)
+    try:
+        job = wait_finished(restarted, job_id)
+    finally:
+        restarted.stop()
+
+    assert job["status"] == "completed"
+    assert job["processed_files"] == job["total_files"] == 5 and job["chunks"] == 15
+    loaded = [path for batch in chatbot.batches for path in batch]
+    assert loaded == first._chatbot.list_files(docs)[2:]
+
+
+def test_cancel_queued_and_running_jobs(tmp_path):
+    docs = make_files(tmp_path / "docs", 6)
+    other = make_files(tmp_path / "other", 1)
+    queue = JobQueue(str(tmp_path / "db_jobs.sqlite3"), commit_every=2, poll_interval=0.01)
+
+    queued = queue.submit(other, is_directory=True)["id"]
+    assert queue.cancel(queued)["status"] == "cancelled"
+
+    running = queue.submit(docs, is_directory=True)["id"]
+    chatbot = FakeChatbot(docs, on_batch=lambda batch: queue.cancel(running) if batch == 1 else None)
+    queue.start(chatbot)
+    try:
+        job = wait_finished(queue, running)
+    finally:
+        queue.stop()
+
+    # Job đang chạy dừng sau nhóm file hiện tại, các file đã tải được giữ lại
+    assert job["status"] == "cancelled" and job["cancel_requested"]
+    assert job["processed_files"] == 2 and len(chatbot.batches) == 1
+    assert all(other not in path for batch in chatbot.batches for path in batch)
+    assert queue.get(queued)["status"] == "cancelled"
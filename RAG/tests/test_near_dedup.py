@@ -0,0 +1,85 @@
+"""
+Chunk gần trùng giữa các tài liệu: đếm tham chiếu (chunk đã lưu chỉ bị xóa khi không còn tài liệu nào dùng)
+và metadata nguồn (source, duplicate_sources) khi tài liệu được thêm, sửa hoặc xóa
+"""
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from near_dedup import NearDuplicateIndex
+from test_reset_reload import make_chatbot
+
+FOOTER = " ".join(f"chân{j}" for j in range(150))
+
+
+def write(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def test_refcount_and_provenance(tmp_path):
+    index = NearDuplicateIndex(str(tmp_path / "db_near_dedup.json.gz"))
+    signature = index.signature(FOOTER)
+    index.add("a:0", signature, {"source": "a.md", "start_index": 10})
+    found = index.find(index.signature(FOOTER + " thêm"), source="b.md")
+    assert found == "a:0"
+    index.add_alias(found, "b:0", {"source": "b.md", "start_index": 20})
+    # Cùng nguồn không được gộp
+    assert index.find(signature, source="a.md") is None
+
+    metadata = index.provenance_metadata("a:0")
+    assert metadata["source"] == "a.md" and metadata["start_index"] == 10
+    assert json.loads(metadata["duplicate_sources"]) == ["b.md"] and metadata["duplicate_count"] == 1
+
+    index.save()
+    index = NearDuplicateIndex(index.path)
+    # Xóa tài liệu gốc: chunk được giữ lại, nguồn chuyển sang tài liệu còn lại
+    assert index.release(["a:0"]) == ([], ["a:0"])
+    metadata = index.provenance_metadata("a:0")
+    assert metadata["source"] == "b.md" and metadata["start_index"] == 20
+    assert json.loads(metadata["duplicate_sources"]) == [] and metadata["duplicate_count"] == 0
+    # Tham chiếu cuối cùng: chunk bị xóa
+    assert index.release(["b:0"]) == (["a:0"], [])
+    assert len(index) == 0 and index.find(signature) is None
+
+
+def test_shared_chunk_survives_until_last_document_is_removed(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    write(docs / "a.md", "# A\n\n" + " ".join(f"alpha{j}" for j in range(150)) + "\n\n" + FOOTER)
+    write(docs / "b.md", "# B\n\n" + " ".join(f"beta{j}" for j in range(150)) + "\n\n" + FOOTER)
+    chatbot = make_chatbot(str(tmp_path / "db"), embedding_backend="hashing", embedding_dimension=64,
+                           near_dedup_threshold=0.9)
+
+    chatbot.load_directory(str(docs))
+
+    def footer_chunks():
+        data = chatbot.vectorstore.get(include=["documents", "metadatas"])
+        return [metadata for text, metadata in zip(data["documents"], data["metadatas"]) if "chân0" in text]
+
+    stored = footer_chunks()
+    assert len(stored) == 1
+    assert {stored[0]["source"], *json.loads(stored[0]["duplicate_sources"])} == \
+        {str(docs / "a.md"), str(docs / "b.md")}
+    # Đoạn chung có thể dài hơn một chunk: mỗi chunk của nó chỉ được lưu một lần
+    assert chatbot.near_dedup.stats()["collapsed_chunks"] >= 1
+
+    # Tài liệu giữ bản lưu bị xóa: chunk vẫn còn, nguồn là tài liệu còn lại
+    owner = stored[0]["source"]
+    other = str(docs / "b.md") if owner == str(docs / "a.md") else str(docs / "a.md")
+    os.remove(owner)
+    assert chatbot.purge_missing_files(str(docs)) == 1
+    stored = footer_chunks()
+    assert len(stored) == 1 and stored[0]["source"] == other
+    assert json.loads(stored[0]["duplicate_sources"]) == []
+
+    # Tài liệu cuối cùng bỏ đoạn chung: chunk bị xóa
+    write(other, "# Mới\n\n" + " ".join(f"gamma{j}" for j in range(150)))
+    chatbot.load_directory(str(docs))
+    assert footer_chunks() == []
+    assert chatbot.near_dedup.stats()["collapsed_chunks"] == 0
+    assert len(chatbot.near_dedup) == len(chatbot.vectorstore.get()["ids"])
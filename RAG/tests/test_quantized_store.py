@@ -0,0 +1,103 @@
+"""
+Truy vấn không khóa của QuantizedVectorStore trong lúc đang ghi (file vector tăng kích thước) và lúc xóa store
+"""
+import os
+import sys
+import threading
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from quantized_store import QuantizedVectorStore
+
+
+def random_vectors(n, dimension=16, seed=0):
+    return np.random.RandomState(seed).randn(n, dimension).astype(np.float32)
+
+
+class SearchWhileGrowing(QuantizedVectorStore):
+    """Chạy một truy vấn ngay sau khi file vector được mở rộng, giữa lần ghi"""
+
+    def _open_arrays(self):
+        super()._open_arrays()
+        if getattr(self, "query", None) is not None:
+            self.results.append(self.similarity_search_by_vector_with_score(self.query, k=3))
+
+
+def test_search_during_grow_sees_previous_state(tmp_path):
+    store = SearchWhileGrowing(str(tmp_path / "db"), initial_capacity=16)
+    vectors = random_vectors(40)
+    store.upsert_vectors([f"a{i}" for i in range(16)], vectors[:16], documents=[f"a{i}" for i in range(16)])
+    store.query, store.results = vectors[20].tolist(), []
+
+    store.upsert_vectors([f"b{i}" for i in range(24)], vectors[16:], documents=[f"b{i}" for i in range(24)])
+
+    assert store.results and all(len(found) == 3 for found in store.results)
+    assert all(doc.page_content.startswith("a") for found in store.results for doc, _ in found)
+    best, distance = store.similarity_search_by_vector_with_score(store.query, k=1)[0]
+    assert best.page_content == "b4" and distance < 1e-3
+
+
+def test_search_after_delete_collection(tmp_path):
+    store = QuantizedVectorStore(str(tmp_path / "db"))
+    vectors = random_vectors(8)
+    store.upsert_vectors([f"c{i}" for i in range(8)], vectors, documents=[f"c{i}" for i in range(8)])
+
+    store.delete_collection()
+
+    assert not os.path.exists(str(tmp_path / "db"))
+    best, _ = store.similarity_search_by_vector_with_score(vectors[2].tolist(), k=1)[0]
+    assert best.page_content == "c2"
+    assert not QuantizedVectorStore(str(tmp_path / "db")).similarity_search_by_vector(vectors[2].tolist())
+
+
+def run_in_thread(function, timeout=5):
+    """Chạy hàm trong luồng khác, trả về kết quả (None nếu chưa xong sau timeout)"""
+    result = []
+    thread = threading.Thread(target=lambda: result.append(function()))
+    thread.start()
+    thread.join(timeout)
+    return result[0] if result else None
+
+
+def test_reads_do_not_wait_for_writer_lock(tmp_path):
+    store = QuantizedVectorStore(str(tmp_path / "db"), indexed_metadata=["source"])
+    vectors = random_vectors(8)
+    store.upsert_vectors([f"c{i}" for i in range(8)], vectors, documents=[f"c{i}" for i in range(8)],
+                         metadatas=[{"source": f"s{i % 2}"} for i in range(8)])
+
+    with store._lock:
+        found = run_in_thread(lambda: store.similarity_search_by_vector(vectors[3].tolist(), k=1))
+        data = run_in_thread(lambda: store.get(ids=["c5"]))
+        filtered = run_in_thread(lambda: store.similarity_search_by_vector(vectors[3].tolist(), k=8,
+                                                                           filter={"source": "s0"}))
+
+    assert found[0].page_content == "c3"
+    assert data["documents"] == ["c5"]
+    assert len(filtered) == 4
+
+
+class WriteDuringTraining(QuantizedVectorStore):
+    """Truy vấn và ghi từ luồng khác trong lúc build_ivf chạy k-means"""
+
+    def _train_ivf(self, *args):
+        self.during = (run_in_thread(lambda: self.similarity_search_by_vector(self.query, k=1)),
+                       run_in_thread(lambda: self.upsert_vectors(["late"], [self.query], documents=["late"]) or True))
+        return super()._train_ivf(*args)
+
+
+def test_build_ivf_runs_kmeans_outside_lock(tmp_path):
+    store = WriteDuringTraining(str(tmp_path / "db"), index_type="ivf", nlist=4, nprobe=1)
+    vectors = random_vectors(200)
+    store.upsert_vectors([f"c{i}" for i in range(199)], vectors[:199], documents=[f"c{i}" for i in range(199)])
+    store.query = vectors[199].tolist()
+
+    store.build_ivf()
+
+    found, written = store.during
+    assert found is not None and written
+    # Vector ghi trong lúc dựng đã được gán cụm và tìm thấy qua IVF
+    late_row = store._lookup_rows(["late"])[0][1]
+    assert store._ivf["assign"][late_row] >= 0
+    assert store.similarity_search_by_vector(store.query, k=1)[0].page_content == "late"
@@ -0,0 +1,64 @@
+"""
+query() với memory giới hạn theo token (LLM được bọc bởi RateLimitedChatModel)
+"""
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+from test_reset_reload import make_chatbot, make_docs
+
+
+class WordCountingChatModel(GenericFakeChatModel):
+    """Model giả đếm token theo số từ (không cần tokenizer GPT-2 của transformers)"""
+
+    def get_num_tokens_from_messages(self, messages):
+        return sum(len(str(message.content).split()) for message in messages)
+
+
+def answers(n):
+    return iter([AIMessage(content=f"Trả lời {i}") for i in range(n)])
+
+
+def test_token_limited_memory(tmp_path):
+    docs = str(tmp_path / "docs")
+    make_docs(docs)
+    llm = WordCountingChatModel(messages=answers(2))
+    chatbot = make_chatbot(str(tmp_path / "db"), llm=llm, embedding_backend="hashing", embedding_dimension=64,
+                           memory_token_limit=200)
+    chatbot.load_directory(docs)
+
+    assert chatbot.query("Tài liệu 1 nói gì?", session_id="s1") == "Trả lời 0"
+    assert chatbot.query("Tài liệu 2 nói gì?", session_id="s1") == "Trả lời 1"
+    messages = chatbot.memories.get("s1").chat_memory.messages
+    assert [message.content for message in messages if message.type == "ai"] == ["Trả lời 0", "Trả lời 1"]
+
+
+def test_error_after_generation_does_not_call_llm_again(tmp_path, monkeypatch):
+    docs = str(tmp_path / "docs")
+    make_docs(docs)
+    chatbot = make_chatbot(str(tmp_path / "db"), llm=GenericFakeChatModel(messages=answers(2)),
+                           embedding_backend="hashing", embedding_dimension=64)
+    chatbot.load_directory(docs)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("không lưu được lịch sử")
+    monkeypatch.setattr(type(chatbot.memories.get("s1")), "save_context", fail)
+
+    assert chatbot.query("Tài liệu 1 nói gì?", session_id="s1") == "Trả lời 0"
+    monkeypatch.undo()
+    assert chatbot.query("Tài liệu 2 nói gì?", session_id="s1") == "Trả lời 1"
+
+
+def test_cached_answer_depends_on_history(tmp_path):
+    docs = str(tmp_path / "docs")
+    make_docs(docs)
+    chatbot = make_chatbot(str(tmp_path / "db"), llm=GenericFakeChatModel(messages=answers(4)),
+                           embedding_backend="hashing", embedding_dimension=64, answer_cache_similarity=0.9)
+    chatbot.load_directory(docs)
+
+    chatbot.query("X123 giá bao nhiêu?", session_id="s1")
+    assert chatbot.query("còn màu thì sao?", session_id="s1") == "Trả lời 1"
+
+    # Cùng câu hỏi ở session mới (không có lịch sử) không được nhận câu trả lời phụ thuộc lịch sử của s1
+    result = chatbot.query("còn màu thì sao?", session_id="s2", return_sources=True)
+    assert result["answer"] == "Trả lời 2" and result["cached"] is False
+    assert chatbot.query("còn màu thì sao?", session_id="s3", return_sources=True)["cached"] == "similar"
@@ -0,0 +1,84 @@
+"""
+Xóa rồi tải lại dữ liệu với embedding không phải Gemini (Chroma giữ lại file chroma.sqlite3 rỗng sau khi reset)
+"""
+import itertools
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+os.environ.setdefault("RAG_TOKENIZER", "none")
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+from benchmark import FakeEmbeddings
+from rag_chatbot import InteractiveRAGChatbot
+
+
+def make_docs(directory, n_files=4):
+    os.makedirs(directory)
+    for i in range(n_files):
+        with open(os.path.join(directory, f"doc{i}.md"), "w", encoding="utf-8") as f:
+            f.write(f"# Tài liệu {i}\n\n" + " ".join(f"từ{i}-{j}" for j in range(300)))
+
+
+def make_chatbot(persist_directory, llm=None, **kwargs):
+    llm = llm or GenericFakeChatModel(messages=itertools.repeat(AIMessage(content="Trả lời")))
+    options = {"chunker": "recursive", "hybrid_search": False, "near_dedup_threshold": None, **kwargs}
+    return InteractiveRAGChatbot(persist_directory=persist_directory, llm=llm, **options)
+
+
+@pytest.fixture(params=["hashing", "custom", "sharded"])
+def embedding_options(request):
+    if request.param == "hashing":
+        return {"embedding_backend": "hashing", "embedding_dimension": 64}
+    if request.param == "custom":
+        return {"embeddings": FakeEmbeddings(dimension=32)}
+    return {"embedding_backend": "hashing", "embedding_dimension": 64,
+            "shard_by": "doc_type"}
+
+
+def test_reset_then_reload(tmp_path, embedding_options):
+    docs = str(tmp_path / "docs")
+    make_docs(docs)
+    persist_directory = str(tmp_path / "db")
+
+    chatbot = make_chatbot(persist_directory, **embedding_options)
+    chunks = chatbot.load_directory(docs)
+    assert chunks > 0
+
+    chatbot.reset_database()
+    assert chatbot.load_directory(docs) == chunks
+    assert chatbot.load_documents([os.path.join(docs, "doc0.md")], force_reload=True) > 0
+
+    chatbot.reset_database()
+    restarted = make_chatbot(persist_directory, **embedding_options)
+    assert restarted.load_directory(docs) == chunks
+
+
+def test_snapshot_import_into_existing_directory(tmp_path):
+    docs = str(tmp_path / "docs")
+    make_docs(docs)
+    options = {"embedding_backend": "hashing", "embedding_dimension": 64}
+
+    source = make_chatbot(str(tmp_path / "source"), **options)
+    chunks = source.load_directory(docs)
+    snapshot_path = str(tmp_path / "index.ragsnap")
+    source.export_snapshot(snapshot_path)
+
+    target = make_chatbot(str(tmp_path / "target"), **options)
+    target.load_directory(docs)
+    assert target.import_snapshot(snapshot_path)["chunks"] == chunks
+
+
+def test_other_embedding_is_refused(tmp_path):
+    docs = str(tmp_path / "docs")
+    make_docs(docs)
+    persist_directory = str(tmp_path / "db")
+    make_chatbot(persist_directory, embedding_backend="hashing", embedding_dimension=64).load_directory(docs)
+
+    with pytest.raises(ValueError):
+        make_chatbot(persist_directory, embedding_backend="hashing", embedding_dimension=32)
@@ -0,0 +1,91 @@
+"""
+Snapshot của index: ghi rồi nạp lại, file hỏng bị từ chối, index cũ vẫn phục vụ trong lúc nạp
+"""
+import os
+
+import pytest
+
+from snapshot import Snapshot, SnapshotError
+from test_reset_reload import make_chatbot, make_docs
+
+OPTIONS = {"embedding_backend": "hashing", "embedding_dimension": 64}
+
+
+@pytest.fixture(params=["chroma", "quantized"])
+def backend(request):
+    return dict(OPTIONS, vector_backend=request.param)
+
+
+def export(tmp_path, options):
+    docs = str(tmp_path / "docs")
+    make_docs(docs)
+    source = make_chatbot(str(tmp_path / "source"), **options)
+    chunks = source.load_directory(docs)
+    path = str(tmp_path / "index.ragsnap")
+    assert source.export_snapshot(path)["chunks"] == chunks
+    return path, chunks
+
+
+def stored_ids(chatbot):
+    return sorted(chatbot.vectorstore.get()["ids"])
+
+
+def test_round_trip(tmp_path, backend):
+    path, chunks = export(tmp_path, backend)
+    target = make_chatbot(str(tmp_path / "target"), **backend)
+    assert target.import_snapshot(path)["chunks"] == chunks
+    assert target.import_snapshot(path)["chunks"] == chunks
+    assert len(stored_ids(target)) == chunks
+    assert len(target.manifest.files) == 4
+
+    # Index được nạp lại khi khởi động lại, file không đổi không bị nạp lại
+    restarted = make_chatbot(str(tmp_path / "target"), **backend)
+    assert len(stored_ids(restarted)) == chunks
+    assert restarted.load_directory(str(tmp_path / "docs")) == 0
+    assert not os.path.exists(str(tmp_path / "target") + "_staging_manifest.json")
+
+
+def test_corrupted_snapshot_is_refused(tmp_path):
+    path, _ = export(tmp_path, OPTIONS)
+    with Snapshot(path) as snapshot:
+        offset = snapshot.header["sections"]["chunks"]["offset"]
+    with open(path, "r+b") as f:
+        f.seek(offset + 20)
+        byte = f.read(1)
+        f.seek(offset + 20)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+    target = make_chatbot(str(tmp_path / "target"), **OPTIONS)
+    target.load_documents([os.path.join(str(tmp_path / "docs"), "doc0.md")])
+    before = stored_ids(target)
+    with pytest.raises(SnapshotError):
+        target.import_snapshot(path)
+    assert stored_ids(target) == before
+
+
+def test_old_index_serves_until_new_index_is_ready(tmp_path, backend, monkeypatch):
+    path, chunks = export(tmp_path, backend)
+    target = make_chatbot(str(tmp_path / "target"), **backend)
+    target.load_documents([os.path.join(str(tmp_path / "docs"), "doc0.md")])
+    before = stored_ids(target)
+    fill = type(target)._fill_from_snapshot
+
+    def failing_fill(self, vectorstore, snapshot, batch_size):
+        raise RuntimeError("hết dung lượng đĩa")
+    monkeypatch.setattr(type(target), "_fill_from_snapshot", failing_fill)
+    with pytest.raises(RuntimeError):
+        target.import_snapshot(path)
+    assert stored_ids(target) == before
+    assert target.query("Tài liệu 0") == "Trả lời"
+
+    served = []
+
+    def checking_fill(self, vectorstore, snapshot, batch_size):
+        # Lần ghi thứ hai (vào thư mục chính): index tạm đang phục vụ dữ liệu mới
+        if self.vectorstore is not None and self.vectorstore is not vectorstore:
+            served.append(len(stored_ids(self)))
+        fill(self, vectorstore, snapshot, batch_size)
+    monkeypatch.setattr(type(target), "_fill_from_snapshot", checking_fill)
+    target.import_snapshot(path)
+    assert served == [len(before), chunks]
+    assert len(stored_ids(target)) == chunks
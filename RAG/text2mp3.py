@@ -1,12 +1,22 @@
-from gtts import gTTS
+import argparse
 
+from tts_service import TTSService, make_backend
+
+parser = argparse.ArgumentParser(description="Chuyển văn bản thành file âm thanh")
 # Nhập nội dung văn bản cần chuyển thành giọng nói
-text = "Xin chào, đây là ví dụ sử dụng gTTS để tạo file âm thanh từ văn bản."
+parser.add_argument("text", nargs="?", default="Xin chào, đây là ví dụ sử dụng gTTS để tạo file âm thanh từ văn bản.")
+parser.add_argument("--lang", default="vi", help="Mã ngôn ngữ, 'vi' là tiếng Việt")
+parser.add_argument("--output", help="File âm thanh đầu ra (mặc định output.mp3, output.wav với backend tone)")
+parser.add_argument("--backend", help="gtts (mặc định) hoặc tone (offline)")
+args = parser.parse_args()
 
-# Tạo đối tượng gTTS
-tts = gTTS(text=text, lang='vi')  # lang='vi' là tiếng Việt
+# Tổng hợp theo từng câu, các câu đã đọc trước đó được lấy từ cache
+tts = TTSService(backend=make_backend(args.backend))
+audio = tts.synthesize(args.text, lang=args.lang)
 
-# Lưu file mp3
-tts.save("output.mp3")
+# Lưu file âm thanh
+output = args.output or ("output.mp3" if tts.mimetype == "audio/mpeg" else "output.wav")
+with open(output, "wb") as f:
+    f.write(audio)
 
-print("Đã tạo xong file output.mp3")
\ No newline at end of file
+print(f"Đã tạo xong file {output}")
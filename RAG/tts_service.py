@@ -0,0 +1,300 @@
+"""
+Chuyển văn bản thành giọng nói theo từng câu: tổng hợp song song, cache âm thanh trên đĩa
+và trả về dạng luồng để câu đầu tiên được phát trước khi các câu sau tổng hợp xong
+"""
+import hashlib
+import io
+import math
+import os
+import re
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…;:])\s+|\n+")
+
+
+def split_sentences(text, max_chars=200):
+    """
+    Tách văn bản thành các câu, câu quá dài được cắt tại dấu phẩy hoặc khoảng trắng
+
+    Args:
+        text: Văn bản cần đọc
+        max_chars: Số ký tự tối đa của một đoạn gửi đi tổng hợp
+
+    Returns:
+        Danh sách câu theo thứ tự
+    """
+    sentences = []
+    for sentence in _SENTENCE_END.split(text.strip()):
+        sentence = " ".join(sentence.split())
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(", ", 0, max_chars)
+            if cut <= 0:
+                cut = sentence.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            sentences.append(sentence[:cut + 1].strip())
+            sentence = sentence[cut + 1:].strip()
+        if sentence:
+            sentences.append(sentence)
+    return sentences
+
+
+class SentenceBuffer:
+    def __init__(self, max_chars=200):
+        """
+        Gom văn bản đến dần (token của LLM) và trả ra từng câu ngay khi câu đó kết thúc
+
+        Args:
+            max_chars: Câu dài hơn giá trị này được cắt ra sớm tại dấu phẩy hoặc khoảng trắng
+        """
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, text):
+        """Thêm văn bản, trả về danh sách các câu đã hoàn chỉnh"""
+        self._buffer += text
+        boundary = None
+        for boundary in _SENTENCE_END.finditer(self._buffer):
+            pass
+        if boundary is not None:
+            complete, self._buffer = self._buffer[:boundary.start()], self._buffer[boundary.end():]
+            return split_sentences(complete, self.max_chars)
+        if len(self._buffer) > 2 * self.max_chars:
+            # Câu quá dài chưa kết thúc: đọc trước các đoạn đầu, giữ lại đoạn cuối
+            parts = split_sentences(self._buffer, self.max_chars)
+            tail = parts.pop()
+            self._buffer = tail + " " if self._buffer[-1].isspace() else tail
+            return parts
+        return []
+
+    def flush(self):
+        """Trả về phần văn bản còn lại khi luồng kết thúc"""
+        rest, self._buffer = self._buffer, ""
+        return split_sentences(rest, self.max_chars)
+
+
+class GTTSBackend:
+    """Tổng hợp bằng Google Translate TTS (cần mạng), trả về MP3; các đoạn MP3 nối tiếp phát được liền mạch"""
+
+    name = "gtts"
+    mimetype = "audio/mpeg"
+    extension = "mp3"
+
+    def __init__(self, tld="com", slow=False):
+        self.tld = tld
+        self.slow = slow
+
+    def stream_prefix(self):
+        return b""
+
+    def to_clip(self, data):
+        return data
+
+    def synthesize(self, text, lang="vi"):
+        from gtts import gTTS
+        buffer = io.BytesIO()
+        gTTS(text=text, lang=lang, tld=self.tld, slow=self.slow).write_to_fp(buffer)
+        return buffer.getvalue()
+
+
+class ToneBackend:
+    """
+    Backend thay thế chạy offline (thử nghiệm, không có mạng): mỗi âm tiết là một tiếng bíp ngắn.
+    Trả về PCM 16-bit mono, luồng được mở đầu bằng header WAV không giới hạn độ dài.
+    """
+
+    name = "tone"
+    mimetype = "audio/wav"
+    extension = "pcm"
+
+    def __init__(self, sample_rate=16000, syllable_ms=120, latency_ms=0.0):
+        self.sample_rate = sample_rate
+        self.syllable_ms = syllable_ms
+        self.latency_ms = latency_ms
+
+    def _wav_header(self, data_size):
+        return (b"RIFF" + struct.pack("<I", min(0xFFFFFFFF, data_size + 36)) + b"WAVE"
+                + b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, self.sample_rate, self.sample_rate * 2, 2, 16)
+                + b"data" + struct.pack("<I", data_size))
+
+    def stream_prefix(self):
+        # Kích thước dữ liệu 0xFFFFFFFF: trình phát đọc đến hết luồng
+        return self._wav_header(0xFFFFFFFF)
+
+    def to_clip(self, data):
+        return self._wav_header(len(data)) + data
+
+    def synthesize(self, text, lang="vi"):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        syllables = max(1, len(text.split()))
+        length = int(self.sample_rate * self.syllable_ms / 1000)
+        t = np.arange(length) / self.sample_rate
+        envelope = np.sin(np.pi * np.arange(length) / length)
+        # Cao độ phụ thuộc nội dung để cùng văn bản luôn cho cùng âm thanh
+        pitch = 300 + int(hashlib.md5(text.encode("utf-8")).hexdigest()[:4], 16) % 400
+        tone = (0.3 * envelope * np.sin(2 * math.pi * pitch * t) * 32767).astype("<i2")
+        pause = np.zeros(length // 3, dtype="<i2")
+        return np.tile(np.concatenate([tone, pause]), syllables).tobytes()
+
+
+class AudioCache:
+    def __init__(self, directory, max_bytes=200 * 1024 * 1024):
+        """
+        Cache âm thanh đã tổng hợp trên đĩa, xóa các file ít được dùng nhất khi vượt dung lượng
+
+        Args:
+            directory: Thư mục lưu file âm thanh
+            max_bytes: Tổng dung lượng tối đa (byte)
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self._total = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def _path(self, key, extension):
+        return os.path.join(self.directory, f"{key}.{extension}")
+
+    def get(self, key, extension):
+        path = self._path(key, extension)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # Cập nhật thời điểm truy cập để xóa theo LRU
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, extension, data):
+        path = self._path(key, extension)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        with self._lock:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            self._total += len(data) - previous
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Xóa file cũ nhất cho đến khi còn 90% dung lượng cho phép (phải giữ lock khi gọi)"""
+        entries = sorted((entry for entry in os.scandir(self.directory)
+                          if entry.is_file() and not entry.name.endswith(".tmp")),
+                         key=lambda entry: entry.stat().st_mtime)
+        target = int(self.max_bytes * 0.9)
+        for entry in entries:
+            if self._total <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self._total -= size
+            except OSError:
+                continue
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "bytes": self._total,
+                "max_bytes": self.max_bytes
+            }
+
+
+class TTSService:
+    def __init__(self, backend=None, cache_dir="./tts_cache", max_cache_bytes=200 * 1024 * 1024,
+                 workers=4, max_chars=200):
+        """
+        Dịch vụ chuyển văn bản thành giọng nói
+
+        Args:
+            backend: Backend tổng hợp (GTTSBackend, ToneBackend hoặc đối tượng có cùng giao diện),
+                     None để dùng gTTS
+            cache_dir: Thư mục cache âm thanh
+            max_cache_bytes: Dung lượng tối đa của cache
+            workers: Số câu được tổng hợp đồng thời
+            max_chars: Số ký tự tối đa của một câu gửi đi tổng hợp
+        """
+        self.backend = backend or GTTSBackend()
+        self.cache = AudioCache(cache_dir, max_cache_bytes)
+        self.workers = max(1, workers)
+        self.max_chars = max_chars
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tts")
+
+    @property
+    def mimetype(self):
+        return self.backend.mimetype
+
+    def _key(self, sentence, lang):
+        text = f"{self.backend.name}:{lang}:{sentence}"
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def synthesize_sentence(self, sentence, lang="vi"):
+        """Tổng hợp một câu, dùng lại âm thanh trong cache nếu đã có"""
+        key = self._key(sentence, lang)
+        data = self.cache.get(key, self.backend.extension)
+        if data is None:
+            data = self.backend.synthesize(sentence, lang)
+            self.cache.put(key, self.backend.extension, data)
+        return data
+
+    def submit(self, sentence, lang="vi"):
+        """Tổng hợp một câu trong thread pool, trả về Future chứa đoạn âm thanh phát được độc lập"""
+        return self._executor.submit(
+            lambda: self.backend.to_clip(self.synthesize_sentence(sentence, lang)))
+
+    def stream(self, text, lang="vi"):
+        """
+        Tổng hợp văn bản theo từng câu và trả về âm thanh dạng luồng
+
+        Các câu được tổng hợp song song (tối đa 2 * workers câu cùng lúc) nhưng được trả về
+        đúng thứ tự; âm thanh của câu đầu tiên được gửi ngay khi câu đó xong.
+
+        Yields:
+            Các đoạn byte âm thanh (mở đầu bằng stream_prefix của backend)
+        """
+        prefix = self.backend.stream_prefix()
+        if prefix:
+            yield prefix
+        futures = deque()
+        for sentence in split_sentences(text, self.max_chars):
+            futures.append(self._executor.submit(self.synthesize_sentence, sentence, lang))
+            if len(futures) >= 2 * self.workers:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+    def synthesize(self, text, lang="vi"):
+        """Tổng hợp toàn bộ văn bản, trả về bytes âm thanh"""
+        return b"".join(self.stream(text, lang))
+
+    def stats(self):
+        return self.cache.stats()
+
+
+def make_backend(name=None):
+    """Tạo backend theo tên ("gtts" hoặc "tone"), mặc định đọc từ biến môi trường RAG_TTS_BACKEND"""
+    name = (name or os.getenv("RAG_TTS_BACKEND", "gtts")).lower()
+    if name == "tone":
+        return ToneBackend()
+    if name == "gtts":
+        return GTTSBackend()
+    raise ValueError(f"Backend TTS không hợp lệ: {name}")
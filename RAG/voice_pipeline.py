@@ -0,0 +1,158 @@
+"""
+Hỏi đáp bằng giọng nói: chuyển âm thanh thành văn bản, truy vấn chatbot dạng luồng và đọc
+câu trả lời theo từng câu ngay khi LLM sinh xong câu đó (các bước chạy gối lên nhau)
+"""
+import base64
+import queue
+import threading
+import time
+
+from metrics import REGISTRY, QueryTrace
+from tts_service import SentenceBuffer
+
+REGISTRY.histogram("rag_voice_time_to_first_audio_seconds",
+                   "Thời gian từ khi nhận âm thanh câu hỏi đến khi có âm thanh đầu tiên của câu trả lời")
+
+
+class VoicePipeline:
+    def __init__(self, chatbot, tts, model_size="base", language=None, registry=REGISTRY):
+        """
+        Pipeline hỏi đáp bằng giọng nói
+
+        Args:
+            chatbot: InteractiveRAGChatbot dùng để trả lời
+            tts: TTSService dùng để đọc câu trả lời
+            model_size: Kích thước mô hình Whisper
+            language: Mã ngôn ngữ của câu hỏi (ví dụ "vi"), None để Whisper tự nhận dạng
+            registry: MetricsRegistry nhận các số đo
+        """
+        self.chatbot = chatbot
+        self.tts = tts
+        self.model_size = model_size
+        self.language = language
+        self.registry = registry
+
+    def transcribe(self, audio_file_path):
+        """Chuyển âm thanh câu hỏi thành văn bản bằng mô hình Whisper dùng chung"""
+        # Import khi cần để server khởi động nhanh (whisper kéo theo torch)
+        from speech2text import transcribe_with_details
+        result = transcribe_with_details(audio_file_path, self.model_size, self.language)
+        return result["text"].strip(), result["language"]
+
+    def run(self, audio_file_path=None, question=None, session_id=None, lang=None, start_time=None):
+        """
+        Trả lời câu hỏi bằng giọng nói
+
+        Args:
+            audio_file_path: File âm thanh chứa câu hỏi
+            question: Câu hỏi dạng văn bản (bỏ qua bước chuyển âm thanh nếu có)
+            session_id: Id của phiên hội thoại
+            lang: Ngôn ngữ đọc câu trả lời, None để dùng ngôn ngữ nhận dạng được (mặc định "vi")
+            start_time: Mốc time.perf_counter() khi nhận request, dùng để tính thời gian đến âm thanh đầu tiên
+
+        Yields:
+            Các dict sự kiện:
+            {"type": "transcript", "text": "...", "language": ...},
+            các sự kiện của query_stream ("sources", "token", "done", "error"),
+            {"type": "audio", "index": i, "sentence": "...", "mimetype": "...", "data": base64} (theo thứ tự câu),
+            {"type": "end", "timings": {...}} khi đã gửi hết âm thanh
+        """
+        start_time = start_time or time.perf_counter()
+        trace = QueryTrace(self.registry, kind="voice")
+
+        if question is None:
+            try:
+                with trace.stage("stt"):
+                    question, detected = self.transcribe(audio_file_path)
+            except Exception as e:
+                trace.finish()
+                yield {"type": "error", "error": f"Lỗi khi chuyển âm thanh thành văn bản: {str(e)}"}
+                return
+            lang = lang or detected
+        lang = lang or "vi"
+        yield {"type": "transcript", "text": question, "language": lang}
+        if not question:
+            trace.finish()
+            yield {"type": "error", "error": "Không nhận dạng được câu hỏi trong âm thanh."}
+            return
+
+        # Thread sinh câu trả lời đẩy sự kiện vào hàng đợi, mỗi câu hoàn chỉnh được gửi đi tổng hợp
+        # ngay; thread hiện tại gửi sự kiện cho client và gửi âm thanh theo đúng thứ tự câu
+        events = queue.Queue()
+        stop = threading.Event()
+        sentences = []
+
+        def on_audio(index, future):
+            events.put(("audio", index, future))
+
+        def submit(sentence):
+            index = len(sentences)
+            sentences.append(sentence)
+            future = self.tts.submit(sentence, lang)
+            future.add_done_callback(lambda f: on_audio(index, f))
+
+        def produce():
+            buffer = SentenceBuffer(self.tts.max_chars)
+            stream = self.chatbot.query_stream(question, session_id=session_id)
+            try:
+                for event in stream:
+                    if stop.is_set():
+                        break
+                    if event["type"] == "token":
+                        for sentence in buffer.feed(event["content"]):
+                            submit(sentence)
+                    elif event["type"] == "done":
+                        for sentence in buffer.flush():
+                            submit(sentence)
+                    events.put(("event", event))
+            except Exception as e:
+                events.put(("event", {"type": "error", "error": f"Lỗi khi xử lý truy vấn: {str(e)}"}))
+            finally:
+                stream.close()
+                events.put(("end", None))
+
+        producer = threading.Thread(target=produce, name="voice-answer", daemon=True)
+        producer.start()
+
+        ready = {}
+        next_index = 0
+        answered = False
+        first_audio = None
+        tts_errors = 0
+        try:
+            while not answered or next_index < len(sentences):
+                item = events.get()
+                if item[0] == "event":
+                    yield item[1]
+                    continue
+                if item[0] == "end":
+                    answered = True
+                    continue
+                _, index, future = item
+                ready[index] = future
+                while next_index in ready:
+                    future = ready.pop(next_index)
+                    sentence = sentences[next_index]
+                    next_index += 1
+                    try:
+                        clip = future.result()
+                    except Exception as e:
+                        tts_errors += 1
+                        print(f"Lỗi khi đọc câu '{sentence[:50]}': {e}")
+                        continue
+                    if first_audio is None:
+                        first_audio = time.perf_counter() - start_time
+                        trace.record("time_to_first_audio", first_audio)
+                        self.registry.observe("rag_voice_time_to_first_audio_seconds", first_audio)
+                    yield {"type": "audio", "index": next_index - 1, "sentence": sentence,
+                           "mimetype": self.tts.mimetype, "data": base64.b64encode(clip).decode("ascii")}
+        finally:
+            # Client ngắt kết nối: dừng sinh câu trả lời
+            stop.set()
+
+        trace.finish()
+        timings = trace.to_dict()
+        timings["time_to_first_audio_ms"] = round(first_audio * 1000, 2) if first_audio is not None else None
+        timings["sentences"] = len(sentences)
+        timings["tts_errors"] = tts_errors
+        yield {"type": "end", "timings": timings}